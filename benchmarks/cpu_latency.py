@@ -0,0 +1,126 @@
+"""
+Reports cold and warm FlorenceCaller latency with and without a CPU performance profile.
+
+Each configuration runs in a fresh process, because thread settings are process-wide and the
+inter-op thread count can only be set once. "default" and "profile" time the first call right after
+loading, with no warmup, so their cold latencies compare like for like. "profile_warmup" runs the
+profile's warmup first, showing what the first real request costs once warmup has been paid at load.
+
+Example:
+    python -m benchmarks.cpu_latency --threads 4 --interop-threads 1 --channels-last
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from typing import Optional
+
+EXAMPLE_IMAGE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "example_images",
+    "dogs.jpg",
+)
+
+
+def run_config(
+    profile_kwargs: Optional[dict],
+    warmup: bool,
+    image_path: str,
+    task: str,
+    repeats: int,
+) -> dict:
+    """
+    Loads Florence with the given profile settings and times a sequence of calls.
+
+    Args:
+        profile_kwargs (Optional[dict]): Arguments for CPUPerformanceProfile, or None for the defaults.
+        warmup (bool): Whether to run the warmup calls before the first timed call.
+        image_path (str): The image to run the task on.
+        task (str): The Florence task name.
+        repeats (int): The number of warm calls to time.
+
+    Returns:
+        dict: Load, warmup, first-call and warm latencies in seconds.
+    """
+    from PIL import Image
+    from image_agent.models.Florence import FlorenceCaller
+    from image_agent.models.CPUProfile import CPUPerformanceProfile
+
+    image = Image.open(image_path).convert("RGB")
+    profile = (
+        CPUPerformanceProfile(warmup=False, **profile_kwargs)
+        if profile_kwargs is not None
+        else None
+    )
+
+    start = time.perf_counter()
+    caller = FlorenceCaller(cpu_profile=profile)
+    load_s = time.perf_counter() - start
+
+    warmup_s = 0.0
+    if warmup:
+        start = time.perf_counter()
+        caller.warmup()
+        warmup_s = time.perf_counter() - start
+
+    # cold unless warmup ran above
+    start = time.perf_counter()
+    caller.call(task_prompt=task, image=image)
+    first_call_s = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        caller.call(task_prompt=task, image=image)
+        warm.append(time.perf_counter() - start)
+    warm.sort()
+
+    return {
+        "load_s": round(load_s, 3),
+        "warmup_s": round(warmup_s, 3),
+        "first_call_s": round(first_call_s, 3),
+        "warm_median_s": round(statistics.median(warm), 3),
+        "warm_p95_s": round(warm[min(int(0.95 * len(warm)), len(warm) - 1)], 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--image", default=EXAMPLE_IMAGE)
+    parser.add_argument("--task", default="general object detection")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--interop-threads", type=int, default=None)
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--no-inference-mode", action="store_true")
+    args = parser.parse_args()
+
+    profile_kwargs = {
+        "num_threads": args.threads,
+        "num_interop_threads": args.interop_threads,
+        "compile": args.compile,
+        "channels_last": args.channels_last,
+        "inference_mode": not args.no_inference_mode,
+    }
+    configs = {
+        "default": (None, False),
+        "profile": (profile_kwargs, False),
+        "profile_warmup": (profile_kwargs, True),
+    }
+
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for name, (config_kwargs, warmup) in configs.items():
+        with context.Pool(1) as pool:
+            report[name] = pool.apply(
+                run_config, (config_kwargs, warmup, args.image, args.task, args.repeats)
+            )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
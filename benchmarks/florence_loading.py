@@ -0,0 +1,146 @@
+"""
+Reports FlorenceCaller startup time and per-process memory for different weight loading options.
+
+Each configuration loads the model in fresh worker processes. With several workers, memory-mapped weights
+show up as shared clean pages rather than anonymous memory, so the proportional set size (Pss) of each
+worker drops as workers are added. Run once beforehand, or pass --convert, so that the memory-mapped
+checkpoints already exist and their one-time conversion is not counted as startup time.
+
+Example:
+    python -m benchmarks.florence_loading --workers 2 --convert
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from typing import Optional
+
+from benchmarks.cpu_latency import EXAMPLE_IMAGE
+
+CONFIGS = {
+    "float32": {},
+    "bfloat16": {"torch_dtype": "bfloat16"},
+    "bfloat16_mmap": {"torch_dtype": "bfloat16", "mmap_weights": True},
+}
+
+
+def smaps_rollup_mb() -> dict:
+    """
+    Reads this process's memory breakdown from /proc/self/smaps_rollup, on Linux.
+
+    Returns:
+        dict: Pss, shared clean, private and anonymous memory in megabytes. Empty on other platforms.
+    """
+    fields = {
+        "Pss": "pss_mb",
+        "Shared_Clean": "shared_clean_mb",
+        "Private_Clean": "private_clean_mb",
+        "Private_Dirty": "private_dirty_mb",
+        "Anonymous": "anonymous_mb",
+    }
+    report = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    report[fields[name]] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return report
+
+
+def load_worker(options: dict, image_path: Optional[str], barrier) -> dict:
+    """
+    Loads Florence with the given options, runs one call and measures memory while all workers are loaded.
+
+    Args:
+        options (dict): Weight loading options for FlorenceCaller.
+        image_path (Optional[str]): The image to run a call on, or None to skip the call.
+        barrier: Waited on after loading so that memory is measured with every worker resident.
+
+    Returns:
+        dict: Load time, call time and memory measurements.
+    """
+    from image_agent.profiling import MB, current_rss_bytes, model_weight_bytes
+    from image_agent.models.Florence import FlorenceCaller
+
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    caller = FlorenceCaller(**options)
+    load_s = time.perf_counter() - start
+
+    call_s = None
+    if image_path is not None:
+        from PIL import Image
+
+        image = Image.open(image_path).convert("RGB")
+        start = time.perf_counter()
+        caller.call(task_prompt="general object detection", image=image)
+        call_s = round(time.perf_counter() - start, 3)
+
+    barrier.wait()
+    report = {
+        "pid": os.getpid(),
+        "load_s": round(load_s, 3),
+        "call_s": call_s,
+        "weights_mb": round(model_weight_bytes(caller) / MB, 1),
+        "rss_delta_mb": round((current_rss_bytes() - rss_before) / MB, 1),
+        "rss_mb": round(current_rss_bytes() / MB, 1),
+        **smaps_rollup_mb(),
+    }
+    barrier.wait()
+    return report
+
+
+def run_config(options: dict, workers: int, image_path: Optional[str]) -> dict:
+    """
+    Starts the workers for one configuration and aggregates their measurements.
+
+    Args:
+        options (dict): Weight loading options for FlorenceCaller.
+        workers (int): The number of worker processes loading the model at once.
+        image_path (Optional[str]): The image to run a call on, or None to skip the call.
+
+    Returns:
+        dict: The per-worker measurements and the totals across workers.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        barrier = manager.Barrier(workers)
+        with context.Pool(workers) as pool:
+            results = pool.starmap(
+                load_worker, [(options, image_path, barrier)] * workers
+            )
+    totals = {
+        "max_load_s": max(r["load_s"] for r in results),
+        "total_rss_mb": round(sum(r["rss_mb"] for r in results), 1),
+    }
+    if all("pss_mb" in r for r in results):
+        totals["total_pss_mb"] = round(sum(r["pss_mb"] for r in results), 1)
+    return {"options": options, "workers": results, **totals}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--image", default=EXAMPLE_IMAGE)
+    parser.add_argument("--no-call", action="store_true")
+    parser.add_argument("--convert", action="store_true")
+    args = parser.parse_args()
+
+    image_path = None if args.no_call else args.image
+    report = {}
+    for name in args.configs:
+        options = CONFIGS[name]
+        if args.convert and options.get("mmap_weights"):
+            run_config(options, 1, None)
+        report[name] = run_config(options, args.workers, image_path)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Checks the retries, backoff, hedging and deadline handling of the shared HTTP client against the stub
+OpenAI server, and reports the tail latency that hedging saves.
+
+Every scenario runs locally without network access. The script exits with a non-zero status if any
+check fails, so it can be used as a smoke test after changing `image_agent.models.HTTPClient`.
+
+Example:
+    python -m benchmarks.http_client --requests 40 --slow-every 5 --slow-latency 1.0
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "ping"}]}
+
+
+def post(client: httpx.Client, base_url: str) -> httpx.Response:
+    """
+    Sends one chat completions request.
+    """
+    return client.post(f"{base_url}/chat/completions", json=PAYLOAD)
+
+
+def check_retries() -> dict:
+    """
+    Injects 429 and 503 responses and checks that they are retried until the request succeeds, and
+    that the last failure is returned once the retries run out.
+    """
+    from image_agent.models.HTTPClient import build_http_client
+    from image_agent.models.StubServer import StubChatCompletionsServer
+
+    with StubChatCompletionsServer(failure_statuses=[429, 503, 503]) as server:
+        with build_http_client(max_retries=3, backoff_base=0.01) as client:
+            recovered = post(client, server.base_url)
+        recovered_attempts = len(server.requests)
+
+    with StubChatCompletionsServer(failure_statuses=[503, 503, 503]) as server:
+        with build_http_client(max_retries=1, backoff_base=0.01) as client:
+            exhausted = post(client, server.base_url)
+        exhausted_attempts = len(server.requests)
+
+    return {
+        "recovered_status": recovered.status_code,
+        "recovered_attempts": recovered_attempts,
+        "exhausted_status": exhausted.status_code,
+        "exhausted_attempts": exhausted_attempts,
+        "ok": recovered.status_code == 200
+        and recovered_attempts == 4
+        and exhausted.status_code == 503
+        and exhausted_attempts == 2,
+    }
+
+
+def check_deadline() -> dict:
+    """
+    Checks that an expired request deadline raises DeadlineExceeded without sending anything, and that
+    a live deadline caps the time spent waiting on a slow response.
+    """
+    from image_agent.deadline import Deadline, DeadlineExceeded, deadline_scope
+    from image_agent.models.HTTPClient import build_http_client
+    from image_agent.models.StubServer import StubChatCompletionsServer
+
+    with StubChatCompletionsServer(latency=1.0) as server:
+        with build_http_client(max_retries=2, backoff_base=0.01) as client:
+            expired = Deadline(0.0)
+            try:
+                with deadline_scope(expired):
+                    post(client, server.base_url)
+                expired_error = None
+            except DeadlineExceeded as e:
+                expired_error = type(e).__name__
+            sent_after_expiry = len(server.requests)
+
+            start = time.perf_counter()
+            try:
+                with deadline_scope(Deadline(0.3)):
+                    post(client, server.base_url)
+                capped_error = None
+            except (DeadlineExceeded, httpx.TimeoutException) as e:
+                capped_error = type(e).__name__
+            capped_seconds = time.perf_counter() - start
+
+    return {
+        "expired_error": expired_error,
+        "sent_after_expiry": sent_after_expiry,
+        "capped_error": capped_error,
+        "capped_s": round(capped_seconds, 3),
+        "ok": expired_error == "DeadlineExceeded"
+        and sent_after_expiry == 0
+        and capped_error is not None
+        and capped_seconds < 0.8,
+    }
+
+
+def run_hedging(hedge: bool, requests: int, slow_every: int, slow_latency: float) -> dict:
+    """
+    Sends sequential requests to a server where every `slow_every`-th response is slow.
+
+    Args:
+        hedge (bool): Whether hedged requests are enabled.
+        requests (int): The number of requests to send.
+        slow_every (int): How often the server stalls.
+        slow_latency (float): How long a stalled response takes, in seconds.
+
+    Returns:
+        dict: Latency statistics and the number of requests the server received.
+    """
+    from image_agent.models.HTTPClient import build_http_client
+    from image_agent.models.StubServer import StubChatCompletionsServer
+
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    def responder(payload: dict) -> str:
+        with lock:
+            n = next(counter)
+        time.sleep(slow_latency if n % slow_every == 0 else 0.02)
+        return "pong"
+
+    latencies = []
+    with StubChatCompletionsServer(responder=responder) as server:
+        with build_http_client(
+            max_retries=0, hedge=hedge, hedge_quantile=0.5, hedge_min_samples=5
+        ) as client:
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = post(client, server.base_url)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+        sent = len(server.requests)
+
+    latencies.sort()
+    return {
+        "median_s": round(statistics.median(latencies), 3),
+        "p95_s": round(latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)], 3),
+        "max_s": round(latencies[-1], 3),
+        "server_requests": sent,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--slow-every", type=int, default=5)
+    parser.add_argument("--slow-latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    plain = run_hedging(False, args.requests, args.slow_every, args.slow_latency)
+    hedged = run_hedging(True, args.requests, args.slow_every, args.slow_latency)
+    report = {
+        "retries": check_retries(),
+        "deadline": check_deadline(),
+        "hedging": {
+            "plain": plain,
+            "hedged": hedged,
+            "p95_saved_s": round(plain["p95_s"] - hedged["p95_s"], 3),
+            "ok": hedged["server_requests"] > args.requests
+            and hedged["p95_s"] < plain["p95_s"],
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if not all(section["ok"] for section in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
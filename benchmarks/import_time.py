@@ -0,0 +1,133 @@
+"""
+Reports how long the image_agent package takes to import and to build a GPT-only agent, in fresh
+interpreters, and which heavy optional dependencies each step pulls in.
+
+Example:
+    python -m benchmarks.import_time --repeats 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = [
+    "torch",
+    "transformers",
+    "mlx",
+    "mlx_vlm",
+    "langchain_community",
+    "llama_cpp",
+    "matplotlib",
+    "IPython",
+    "numpy",
+    "openai",
+    "langchain_openai",
+]
+
+TARGETS = {
+    "package": "import image_agent",
+    "agent_module": "import image_agent.agent.Agent",
+    "gpt_agent": (
+        "from image_agent.agent.Agent import Agent\n"
+        "Agent(openai_api_key='unused', vision_mode='gpt')"
+    ),
+}
+
+# times the target and reports the heavy modules it loaded, on the last line of stdout
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec(compile({code!r}, "<target>", "exec"))
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run_target(code: str) -> dict:
+    """
+    Runs a target in a fresh interpreter.
+
+    Args:
+        code (str): The code to time.
+
+    Returns:
+        dict: The elapsed time, the process wall time and the heavy modules that were loaded.
+    """
+    import time
+
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE.format(code=code, heavy=HEAVY_MODULES)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - start
+    return result
+
+
+def slowest_imports(code: str, top: int) -> dict:
+    """
+    Lists the top-level imports and their direct imports with the highest cumulative time, as reported
+    by `python -X importtime`.
+
+    Args:
+        code (str): The code to profile.
+        top (int): The number of imports to report.
+
+    Returns:
+        dict: The cumulative import time in milliseconds of the slowest imports, keyed by module.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nesting is shown by two spaces per level, keep the top two levels
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            imports.append((name.strip(), round(int(cumulative) / 1000, 1)))
+    return dict(sorted(imports, key=lambda entry: entry[1], reverse=True)[:top])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    report = {}
+    for name in args.targets:
+        code = TARGETS[name]
+        # the first run also writes bytecode caches, so it is not counted
+        run_target(code)
+        runs = [run_target(code) for _ in range(args.repeats)]
+        report[name] = {
+            "median_s": round(statistics.median(r["seconds"] for r in runs), 3),
+            "max_s": round(max(r["seconds"] for r in runs), 3),
+            "process_median_s": round(
+                statistics.median(r["process_seconds"] for r in runs), 3
+            ),
+            "heavy_modules": runs[-1]["loaded"],
+            "slowest_imports_ms": slowest_imports(code, args.top),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Reports how much speculative Florence prefetching saves on end-to-end request latency.
+
+Requests run against the stub OpenAI server, with a configurable round-trip latency, and the stub
+Florence caller, with a configurable call latency, so that the overlap between planning and vision is
+measured without any model or API. The stub planner cycles through plans that start with object
+detection, with captioning and with OCR, so some speculation is wasted.
+
+Example:
+    python -m benchmarks.speculative_vision --requests 20 --llm-latency 0.4 --florence-latency 0.5
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import threading
+import time
+
+from PIL import Image
+
+PLANS = [
+    [("special_vision", "general object detection", None)],
+    [
+        ("special_vision", "image captioning", None),
+        ("special_vision", "specific object detection", "dog"),
+    ],
+    [("special_vision", "general object detection", None), ("special_vision", "OCR", None)],
+    [("special_vision", "OCR", None)],
+]
+
+
+def make_responder():
+    """
+    Builds a stub responder that hands out the plans in turn and accepts every answer.
+    """
+    plans = itertools.cycle(PLANS)
+    lock = threading.Lock()
+
+    def responder(payload: dict):
+        response_format = payload.get("response_format") or {}
+        schema_name = response_format.get("json_schema", {}).get("name")
+        if schema_name == "Plan":
+            with lock:
+                steps = next(plans)
+            return {
+                "plan": [
+                    {"tool_name": name, "tool_mode": mode, "tool_input": text}
+                    for name, mode, text in steps
+                ]
+            }
+        if schema_name:
+            return {"final_answer": 1, "assessment": "The outputs answer the question."}
+        return "Run the vision tools listed in the structured plan."
+
+    return responder
+
+
+def run(speculative: bool, requests: int, llm_latency: float, florence_latency: float) -> dict:
+    """
+    Runs a sequence of requests with or without speculation.
+
+    Args:
+        speculative (bool): Whether speculative vision is enabled.
+        requests (int): The number of requests.
+        llm_latency (float): The stub OpenAI round-trip latency, in seconds.
+        florence_latency (float): The stub Florence call latency, in seconds.
+
+    Returns:
+        dict: Latency statistics and, with speculation, its hit rate and the time it saved.
+    """
+    from image_agent.agent.Agent import Agent
+    from image_agent.models.Stub import StubFlorenceCaller
+    from image_agent.models.StubServer import StubChatCompletionsServer
+
+    image = Image.effect_noise((768, 512), 64).convert("RGB")
+    florence = StubFlorenceCaller(latency=florence_latency)
+    latencies = []
+    with StubChatCompletionsServer(responder=make_responder(), latency=llm_latency) as server:
+        agent = Agent(
+            openai_api_key="stub",
+            vision_mode="gpt",
+            openai_base_url=server.base_url,
+            backends={"special_vision": florence},
+            speculative_vision=speculative,
+        )
+        agent.display_components = lambda *args, **kwargs: None
+        for _ in range(requests):
+            start = time.perf_counter()
+            agent.invoke("What is in this image?", image)
+            latencies.append(time.perf_counter() - start)
+
+    report = {
+        "median_s": round(statistics.median(latencies), 3),
+        "mean_s": round(statistics.mean(latencies), 3),
+        "florence_calls": len(florence.calls),
+    }
+    if speculative:
+        stats = agent.speculation_stats
+        report.update(
+            {
+                "submitted": stats["submitted"],
+                "hits": stats["hits"],
+                "cancelled": stats["cancelled"],
+                "hit_rate": round(stats["hits"] / max(stats["submitted"], 1), 3),
+                "saved_s_per_request": round(stats["saved_seconds"] / requests, 3),
+            }
+        )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--florence-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    baseline = run(False, args.requests, args.llm_latency, args.florence_latency)
+    speculative = run(True, args.requests, args.llm_latency, args.florence_latency)
+    report = {
+        "baseline": baseline,
+        "speculative": speculative,
+        "median_saved_s": round(baseline["median_s"] - speculative["median_s"], 3),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,67 @@
-from image_agent.models.OpenAIText import OpenAICaller, StructuredOpenAICaller
-from image_agent.models.Qwen import QwenCaller
-from image_agent.models.Florence import FlorenceCaller
-from image_agent.models.OpenAIVision import OpenAIVisionCaller
 from image_agent.agent.AgentNodes import AgentNodes
 from image_agent.agent.AgentEdges import AgentEdges
 from image_agent.agent.AgentState import AgentState
+from image_agent.agent.OutputCompactor import OutputCompactor
+from image_agent.models.HTTPClient import get_shared_http_client
+from image_agent.models.CPUProfile import CPUPerformanceProfile
+from image_agent.models.Cassette import Cassette, CassetteCaller
+from image_agent.models.LazyCaller import LazyCaller
+from image_agent.models.config import adaptive_vision_backends
 from image_agent.prompts.PlanStructure import Plan, PlanStructurePrompt
 from image_agent.prompts.PlanConstruction import PlanConstructionPrompt
 from image_agent.prompts.ResultEvaluation import ResultAssessment, ResultEvalutionPrompt
 from image_agent.prompts.ImageInterpretation import ImageInterpretationPrompt
-from image_agent.agent.config import dummy_agent_config
+from image_agent.prompts.SufficiencyCheck import SufficiencyCheck, SufficiencyCheckPrompt
+from image_agent.agent.config import (
+    dummy_agent_config,
+    prompt_token_budget,
+    request_timeout,
+    deadline_low_fraction,
+    single_flight,
+    single_flight_result_ttl,
+    speculative_vision,
+    speculative_vision_tasks,
+    speculative_vision_workers,
+    speculative_vision_timeout,
+    result_store_path,
+    result_store_max_age,
+    early_exit,
+    roi_vision,
+    group_special_vision,
+    budget_max_tokens,
+    budget_max_vision_calls,
+    budget_max_dollars,
+    budget_max_model_seconds,
+)
+from image_agent.agent.SingleFlight import SingleFlight
+from image_agent.agent.SpeculativeVision import SpeculativeVision
+from image_agent.agent.ResultStore import ResultStore
+from image_agent.agent.RequestBudget import RequestBudget
+from image_agent.image_tools import hash_image
+from image_agent.utils import hash_query, is_partial_result
+from image_agent.deadline import Deadline
+from image_agent.profiling import MemoryProfiler
 from langgraph.graph import StateGraph, END
 from langgraph.store.memory import InMemoryStore
+import copy
 import uuid
-from typing import Any
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Optional
 import logging
 
+# the model backends pull in heavy optional dependencies (transformers, torch, MLX, langchain), so they
+# are imported when a backend is actually created rather than when this module is imported
+if TYPE_CHECKING:
+    from image_agent.models.OpenAIText import OpenAICaller, StructuredOpenAICaller
+    from image_agent.models.Qwen import QwenCaller
+    from image_agent.models.Florence import FlorenceCaller
+    from image_agent.models.OpenAIVision import OpenAIVisionCaller
+    from image_agent.models.PerceptualCache import PerceptualCache
+    from image_agent.models.AdaptiveVision import AdaptiveVisionRouter
+    from image_agent.agent.PlanTemplates import PlanTemplateLibrary
+
 
 logging.basicConfig(
     format="%(name)s: %(asctime)s | %(levelname)s | %(filename)s:%(lineno)s | %(process)d >>> %(message)s",
@@ -33,53 +79,372 @@ class Agent:
         openai_api_key (str): The API key for OpenAI.
         agent_graph (StateGraph): The state graph representing the agent's workflow.
         store (InMemoryStore): The in-memory store for agent's data.
+        result_store (Optional[ResultStore]): The durable store of completed results, if any.
+        history_max_age (Optional[float]): The oldest stored result served for a repeated request, in
+            seconds. None never serves from history.
         agent (StateGraph): The compiled agent graph.
+        nodes (AgentNodes): The node functions of the graph, with the configured models.
+        compactor (OutputCompactor): Compacts tool outputs so that prompts fit the token budget.
+        http_client (httpx.Client): The pooled HTTP client shared by all OpenAI callers.
+        single_flight (Optional[SingleFlight]): Deduplicates identical concurrent requests, if enabled.
+        speculative_executor (Optional[ThreadPoolExecutor]): Runs speculative Florence tasks, if enabled.
+        speculation_stats (Counter): Speculative tasks submitted, started, used and cancelled, and the
+            seconds saved, over all requests.
+        early_exit (Optional[str]): How the remaining plan steps are checked for need after each vision
+            step, "heuristic" or "llm", or None if early exit is disabled.
+        early_exit_stats (Counter): Early-exit checks, exits, steps skipped and seconds saved, over all
+            requests.
+        roi_vision (bool): Whether general vision inputs are cropped to earlier detections.
+        budget_limits (dict): The caps of the default per-request budget.
+        budget_spent (Counter): The resources spent over all requests.
+        plan_templates (Optional[PlanTemplateLibrary]): The plan templates that common queries are
+            matched to instead of calling the planner, if any.
+        cassette (Optional[Cassette]): The record/replay cassette for model calls, if any.
+        perceptual_cache (Optional[PerceptualCache]): The near-duplicate cache for vision results, if any.
+        profiler (Optional[MemoryProfiler]): The memory profiler, if profiling is enabled.
     """
 
-    def __init__(self, openai_api_key: str, vision_mode="local"):
+    VISION_CALLERS: tuple = (
+        "general_vision",
+        "general_vision_local",
+        "general_vision_gpt",
+        "special_vision",
+    )
+
+    def __init__(
+        self,
+        openai_api_key: str,
+        vision_mode="local",
+        text_mode: str = "gpt",
+        prompt_token_budget: int = prompt_token_budget,
+        http_client: Optional[Any] = None,
+        openai_base_url: Optional[str] = None,
+        cpu_profile: Optional[CPUPerformanceProfile] = None,
+        florence_options: Optional[dict] = None,
+        single_flight: bool = single_flight,
+        result_cache_ttl: float = single_flight_result_ttl,
+        speculative_vision: bool = speculative_vision,
+        early_exit: Optional[str] = early_exit,
+        roi_vision: bool = roi_vision,
+        budget_limits: Optional[dict] = None,
+        plan_templates: Optional["PlanTemplateLibrary"] = None,
+        result_store: Optional[ResultStore] = None,
+        history_max_age: Optional[float] = result_store_max_age,
+        cassette: Optional[Cassette] = None,
+        perceptual_cache: Optional["PerceptualCache"] = None,
+        backends: Optional[dict] = None,
+        profiler: Optional[MemoryProfiler] = None,
+    ):
         """
         Initializes the Agent with the provided OpenAI API key.
 
         Args:
             openai_api_key (str): The API key for OpenAI.
+            vision_mode (str): The general vision backend, either "local", "gpt" or "adaptive", which routes
+                each call to the backend expected to meet the latency SLO and falls back if it fails.
+            text_mode (str): The planning and assessment backend, either "gpt" for OpenAI or "cpu" for a local
+                llama.cpp model with schema-constrained decoding.
+            prompt_token_budget (int): The maximum number of tokens for the planning and assessment prompts.
+            http_client (Optional[httpx.Client]): The HTTP client for the OpenAI callers. Defaults to the
+                process-wide shared client.
+            openai_base_url (Optional[str]): An alternative OpenAI-compatible endpoint, e.g. a local stub server.
+            cpu_profile (Optional[CPUPerformanceProfile]): Warmup, thread and compilation settings for the
+                local backends. Without warmup, Florence is loaded when the first special vision step runs
+                rather than when the agent is created.
+            florence_options (Optional[dict]): Weight loading options for FlorenceCaller, i.e. torch_dtype,
+                mmap_weights and skip_modules. Defaults to the values in the models config.
+            single_flight (bool): Whether to collapse concurrent identical requests into one execution.
+            result_cache_ttl (float): With single flight enabled, how long completed results are reused for
+                identical requests, in seconds. 0 disables reuse.
+            speculative_vision (bool): Whether to start the most likely Florence tasks in the background as
+                soon as a request arrives, so that they overlap with planning.
+            early_exit (Optional[str]): Whether to check after each vision step if the outputs so far already
+                answer the question, and if so skip the remaining steps and go on to the assessment.
+                "heuristic" uses a local check of the question against the outputs, "llm" a small structured
+                model call.
+            roi_vision (bool): Whether to send general vision only the regions found by earlier specific
+                object detection steps, cropped and padded, at a resolution adapted to their size.
+                `nodes.roi_stats` reports how many calls were cropped and the pixels saved.
+            budget_limits (Optional[dict]): The caps of the budget given to each request that does not bring
+                its own, i.e. max_tokens, max_vision_calls, max_dollars and max_model_seconds. Defaults to the
+                values in the agent config.
+            plan_templates (Optional[PlanTemplateLibrary]): Matches common queries (captioning, reading
+                text, counting, locating and describing objects) to pre-validated plans, so that they start
+                at routing without the planning and plan structure LLM calls. Other queries are planned as
+                usual.
+            result_store (Optional[ResultStore]): Keeps completed results on disk, indexed by user, image,
+                query and time. Defaults to a store at the configured path, if any.
+            history_max_age (Optional[float]): With a result store, a request for which the same user already
+                got a complete answer about the same image and query at most this many seconds ago is served
+                from the store. None never serves from history.
+            cassette (Optional[Cassette]): Records every model call to disk, or replays recorded calls
+                without loading any model or calling any API.
+            perceptual_cache (Optional[PerceptualCache]): Reuses vision results for near-duplicate images,
+                with box coordinates rescaled to the new resolution.
+            backends (Optional[dict]): Prebuilt callers to use instead of the default ones, keyed by
+                "planner", "plan_structure", "result_assessment", "general_vision" or "special_vision", or in
+                adaptive mode "general_vision_local" and "general_vision_gpt".
+            profiler (Optional[MemoryProfiler]): Records backend load memory and per-node allocations.
         """
         self.openai_api_key: str = openai_api_key
         self.vision_mode = vision_mode
+        self.text_mode: str = text_mode
+        self.compactor: OutputCompactor = OutputCompactor(
+            token_budget=prompt_token_budget
+        )
+        self.http_client = http_client or get_shared_http_client()
+        self.openai_base_url: Optional[str] = openai_base_url
+        self.cpu_profile: Optional[CPUPerformanceProfile] = cpu_profile
+        self.florence_options: dict = florence_options or {}
+        self.cassette: Optional[Cassette] = cassette
+        self.perceptual_cache: Optional["PerceptualCache"] = perceptual_cache
+        self.backends: dict = backends or {}
+        self.profiler: Optional[MemoryProfiler] = profiler
+        self.single_flight: Optional[SingleFlight] = (
+            SingleFlight(result_ttl=result_cache_ttl) if single_flight else None
+        )
+        self.speculative_executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(
+                speculative_vision_workers, thread_name_prefix="speculative-vision"
+            )
+            if speculative_vision
+            else None
+        )
+        self.speculation_stats: Counter = Counter()
+        if early_exit not in (None, "heuristic", "llm"):
+            raise ValueError("Early exit must be None, heuristic or llm")
+        self.early_exit: Optional[str] = early_exit
+        self.early_exit_stats: Counter = Counter()
+        self.roi_vision: bool = roi_vision
+        self.budget_limits: dict = {
+            "max_tokens": budget_max_tokens,
+            "max_vision_calls": budget_max_vision_calls,
+            "max_dollars": budget_max_dollars,
+            "max_model_seconds": budget_max_model_seconds,
+            **(budget_limits or {}),
+        }
+        self.budget_spent: Counter = Counter()
+        self.plan_templates: Optional["PlanTemplateLibrary"] = plan_templates
+        self.result_store: Optional[ResultStore] = result_store or (
+            ResultStore(result_store_path) if result_store_path is not None else None
+        )
+        self.history_max_age: Optional[float] = history_max_age
         self.agent_graph: StateGraph = self._set_up_graph()
         self.store: InMemoryStore = InMemoryStore()
         self.agent = self.agent_graph.compile(store=self.store)
 
+    def _make_caller(
+        self, name: str, factory: Callable[[], Any], lazy: bool = False
+    ) -> Any:
+        """
+        Creates a model caller, routing it through the cassette if one is configured.
+
+        A caller passed in `backends` under the same name takes the place of the factory. In replay mode
+        the factory is never called, so no model is loaded and no API client is created. Vision callers
+        are wrapped by the perceptual cache, if one is configured.
+
+        Args:
+            name (str): The name under which the caller's calls are recorded.
+            factory (Callable[[], Any]): Creates the real caller.
+            lazy (bool): Whether to defer calling the factory until the caller is first used.
+
+        Returns:
+            Any: The caller, or a CassetteCaller wrapping it.
+        """
+        if name in self.backends:
+            factory = lambda: self.backends[name]
+        if self.profiler is not None:
+            factory = partial(self.profiler.measure_load, name, factory)
+        if self.perceptual_cache is not None and name in self.VISION_CALLERS:
+            factory = partial(self._with_perceptual_cache, name, factory)
+        if lazy:
+            factory = partial(LazyCaller, name, factory)
+
+        if self.cassette is None:
+            return factory()
+        caller = None if self.cassette.replaying else factory()
+        return CassetteCaller(name, self.cassette, caller)
+
+    def _with_perceptual_cache(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Creates a vision caller and wraps it with the perceptual cache.
+        """
+        from image_agent.models.PerceptualCache import PerceptualCacheCaller
+
+        return PerceptualCacheCaller(name, self.perceptual_cache, factory())
+
     def _set_up_llm(self) -> None:
         """
         Sets up the various language models used by the agent.
         """
-        self.planner_llm: OpenAICaller = OpenAICaller(
-            api_key=self.openai_api_key, system_prompt=PlanConstructionPrompt
-        )
+        logger.info(f"Text mode is {self.text_mode}")
+        if self.text_mode == "gpt":
+            from image_agent.models.OpenAIText import (
+                OpenAICaller,
+                StructuredOpenAICaller,
+            )
 
-        self.plan_structure_llm: StructuredOpenAICaller = StructuredOpenAICaller(
-            api_key=self.openai_api_key,
-            system_prompt=PlanStructurePrompt,
-            output_model=Plan,
-        )
+            self.planner_llm: OpenAICaller = self._make_caller(
+                "planner",
+                lambda: OpenAICaller(
+                    api_key=self.openai_api_key,
+                    system_prompt=PlanConstructionPrompt,
+                    http_client=self.http_client,
+                    base_url=self.openai_base_url,
+                ),
+            )
 
-        self.result_assessment_llm: StructuredOpenAICaller = StructuredOpenAICaller(
-            api_key=self.openai_api_key,
-            system_prompt=ResultEvalutionPrompt,
-            output_model=ResultAssessment,
-        )
+            self.plan_structure_llm: StructuredOpenAICaller = self._make_caller(
+                "plan_structure",
+                lambda: StructuredOpenAICaller(
+                    api_key=self.openai_api_key,
+                    system_prompt=PlanStructurePrompt,
+                    output_model=Plan,
+                    http_client=self.http_client,
+                    base_url=self.openai_base_url,
+                ),
+            )
+
+            self.result_assessment_llm: StructuredOpenAICaller = self._make_caller(
+                "result_assessment",
+                lambda: StructuredOpenAICaller(
+                    api_key=self.openai_api_key,
+                    system_prompt=ResultEvalutionPrompt,
+                    output_model=ResultAssessment,
+                    http_client=self.http_client,
+                    base_url=self.openai_base_url,
+                ),
+            )
+
+            self.sufficiency_llm: Optional[StructuredOpenAICaller] = None
+            if self.early_exit == "llm":
+                self.sufficiency_llm = self._make_caller(
+                    "sufficiency",
+                    lambda: StructuredOpenAICaller(
+                        api_key=self.openai_api_key,
+                        system_prompt=SufficiencyCheckPrompt,
+                        output_model=SufficiencyCheck,
+                        http_client=self.http_client,
+                        base_url=self.openai_base_url,
+                    ),
+                )
+        elif self.text_mode == "cpu":
+            # imported here so that llama.cpp is only needed when this mode is used
+            from image_agent.models.LlamaCpp import (
+                LlamaCppCaller,
+                StructuredLlamaCppCaller,
+                load_llama_cpp_model,
+            )
+
+            replaying = self.cassette is not None and self.cassette.replaying
+            num_threads = self.cpu_profile.num_threads if self.cpu_profile else None
+            shared_llm = None if replaying else load_llama_cpp_model(n_threads=num_threads)
+            self.planner_llm: LlamaCppCaller = self._make_caller(
+                "planner",
+                lambda: LlamaCppCaller(
+                    system_prompt=PlanConstructionPrompt, llm=shared_llm
+                ),
+            )
+            self.plan_structure_llm: StructuredLlamaCppCaller = self._make_caller(
+                "plan_structure",
+                lambda: StructuredLlamaCppCaller(
+                    system_prompt=PlanStructurePrompt, output_model=Plan, llm=shared_llm
+                ),
+            )
+            self.result_assessment_llm: StructuredLlamaCppCaller = self._make_caller(
+                "result_assessment",
+                lambda: StructuredLlamaCppCaller(
+                    system_prompt=ResultEvalutionPrompt,
+                    output_model=ResultAssessment,
+                    llm=shared_llm,
+                ),
+            )
+            self.sufficiency_llm: Optional[StructuredLlamaCppCaller] = None
+            if self.early_exit == "llm":
+                self.sufficiency_llm = self._make_caller(
+                    "sufficiency",
+                    lambda: StructuredLlamaCppCaller(
+                        system_prompt=SufficiencyCheckPrompt,
+                        output_model=SufficiencyCheck,
+                        llm=shared_llm,
+                    ),
+                )
+        else:
+            raise ValueError("Text mode must be gpt or cpu")
 
         logger.info(f"General vision mode is {self.vision_mode}")
-        if self.vision_mode == "local":
-            self.general_vision: QwenCaller = QwenCaller()
-        elif self.vision_mode == "gpt":
-            self.general_vision: OpenAIVisionCaller = OpenAIVisionCaller(
-                api_key=self.openai_api_key, system_prompt=ImageInterpretationPrompt
+        general_vision_factories: dict = {
+            "local": self._load_qwen,
+            "gpt": self._load_openai_vision,
+        }
+        if self.vision_mode in general_vision_factories:
+            self.general_vision: Any = self._make_caller(
+                "general_vision", general_vision_factories[self.vision_mode]
+            )
+        elif self.vision_mode == "adaptive":
+            from image_agent.models.AdaptiveVision import AdaptiveVisionRouter
+
+            # each backend is recorded and cached under its own name, the routing itself is live
+            self.general_vision: AdaptiveVisionRouter = AdaptiveVisionRouter(
+                {
+                    name: self._make_caller(
+                        f"general_vision_{name}", general_vision_factories[name]
+                    )
+                    for name in adaptive_vision_backends
+                }
             )
         else:
-            raise ValueError("Vision mode must be local or gpt")
+            raise ValueError("Vision mode must be local, gpt or adaptive")
+
+        # Florence is only needed by plans with special vision steps, so importing torch and loading
+        # its weights waits until the first one runs, unless the profile asks for it to be warmed up
+        # before the first request
+        self.specialist_vision: FlorenceCaller = self._make_caller(
+            "special_vision",
+            self._load_florence,
+            lazy=self.cpu_profile is None or not self.cpu_profile.warmup,
+        )
+
+    def _load_qwen(self) -> "QwenCaller":
+        """
+        Loads the local Qwen general vision backend, importing MLX only now.
+        """
+        from image_agent.models.Qwen import QwenCaller
+
+        return QwenCaller(cpu_profile=self.cpu_profile)
+
+    def _load_openai_vision(self) -> "OpenAIVisionCaller":
+        """
+        Creates the OpenAI general vision backend.
+        """
+        from image_agent.models.OpenAIVision import OpenAIVisionCaller
+
+        return OpenAIVisionCaller(
+            api_key=self.openai_api_key,
+            system_prompt=ImageInterpretationPrompt,
+            http_client=self.http_client,
+            base_url=self.openai_base_url,
+        )
+
+    def _load_florence(self) -> "FlorenceCaller":
+        """
+        Loads the Florence special vision backend, importing transformers and torch only now.
+        """
+        from image_agent.models.Florence import FlorenceCaller
 
-        self.specialist_vision: FlorenceCaller = FlorenceCaller()
+        return FlorenceCaller(cpu_profile=self.cpu_profile, **self.florence_options)
+
+    def priced_calls(self) -> set:
+        """
+        Returns the kinds of calls, "text" and "general_vision", that go to OpenAI and cost money. In
+        adaptive mode general vision is priced as if every call went to OpenAI, an upper bound.
+        """
+        priced = set()
+        if self.text_mode == "gpt":
+            priced.add("text")
+        if self.vision_mode in ("gpt", "adaptive"):
+            priced.add("general_vision")
+        return priced
 
     def _set_up_graph(self) -> StateGraph:
         """
@@ -90,28 +455,48 @@ class Agent:
         """
         self._set_up_llm()
 
-        nodes: AgentNodes = AgentNodes(
+        self.nodes: AgentNodes = AgentNodes(
             planner=self.planner_llm,
             structure=self.plan_structure_llm,
             assessment=self.result_assessment_llm,
             special_vision=self.specialist_vision,
             general_vision=self.general_vision,
+            compactor=self.compactor,
+            sufficiency=self.sufficiency_llm,
+            roi_vision=self.roi_vision,
+            priced=self.priced_calls(),
+            # a group runs as a whole, so there would be no check between its steps to exit after
+            group_special_vision=group_special_vision and self.early_exit is None,
         )
         edges: AgentEdges = AgentEdges()
 
         agent: StateGraph = StateGraph(AgentState)
 
         ## Nodes
-        agent.add_node("planning", nodes.plan_node)
-        agent.add_node("structure_plan", nodes.structure_plan_node)
-        agent.add_node("routing", nodes.routing_node)
-        agent.add_node("special_vision", nodes.call_special_vision_node)
-        agent.add_node("general_vision", nodes.call_general_vision_node)
-        agent.add_node("assessment", nodes.assessment_node)
-        agent.add_node("response", nodes.dump_result_node)
+        node_functions: dict = {
+            "planning": self.nodes.plan_node,
+            "structure_plan": self.nodes.structure_plan_node,
+            "routing": self.nodes.routing_node,
+            "special_vision": self.nodes.call_special_vision_node,
+            "general_vision": self.nodes.call_general_vision_node,
+            "assessment": self.nodes.assessment_node,
+            "response": self.nodes.dump_result_node,
+        }
+        if self.early_exit is not None:
+            node_functions["early_exit"] = self.nodes.early_exit_node
+        for node_name, node_function in node_functions.items():
+            if self.profiler is not None:
+                node_function = self.profiler.wrap_node(node_name, node_function)
+            agent.add_node(node_name, node_function)
 
         ## Edges
-        agent.set_entry_point("planning")
+        agent.set_conditional_entry_point(
+            edges.start,
+            {
+                "planning": "planning",
+                "routing": "routing",
+            },
+        )
         agent.add_edge("planning", "structure_plan")
         agent.add_edge("structure_plan", "routing")
         agent.add_conditional_edges(
@@ -121,10 +506,24 @@ class Agent:
                 "special_vision": "special_vision",
                 "general_vision": "general_vision",
                 "finalize": "assessment",
+                "timeout": "response",
+                "over_budget": "response",
             },
         )
-        agent.add_edge("special_vision", "routing")
-        agent.add_edge("general_vision", "routing")
+        if self.early_exit is None:
+            agent.add_edge("special_vision", "routing")
+            agent.add_edge("general_vision", "routing")
+        else:
+            agent.add_edge("special_vision", "early_exit")
+            agent.add_edge("general_vision", "early_exit")
+            agent.add_conditional_edges(
+                "early_exit",
+                edges.exit_early,
+                {
+                    "continue": "routing",
+                    "timeout": "response",
+                },
+            )
         agent.add_conditional_edges(
             "assessment",
             edges.back_to_plan,
@@ -132,6 +531,7 @@ class Agent:
                 "good_answer": "response",
                 "bad_answer": "planning",
                 "timeout": "response",
+                "over_budget": "response",
             },
         )
         agent.add_edge("response", END)
@@ -156,21 +556,195 @@ class Agent:
                     print(stage[k1][k2])
         print("#" * 20)
 
+    @staticmethod
+    def request_key(
+        query: str, image: Any, config: dict, max_planning_steps: int
+    ) -> tuple:
+        """
+        Builds the key under which identical requests are deduplicated.
+
+        Args:
+            query (str): The query to process.
+            image (Any): The image data associated with the query.
+            config (dict): Configuration options for the agent.
+            max_planning_steps (int): The maximum number of planning steps to execute.
+
+        Returns:
+            tuple: The user id, image content hash, normalized query hash and planning limit.
+        """
+        return (
+            config["configurable"]["user_id"],
+            hash_image(image),
+            hash_query(query),
+            max_planning_steps,
+        )
+
     def invoke(
         self,
         query: str,
         image: Any,
         config: dict = dummy_agent_config,
         max_planning_steps: int = 2,
+        timeout: Optional[float] = request_timeout,
+        budget: Optional[RequestBudget] = None,
     ) -> list:
         """
         Invokes the agent with a query and an image, returning the results.
 
+        When single-flight deduplication is enabled, a request identical to one already in flight (same user,
+        image content, normalized query, planning limit, timeout and budget limits) waits for that execution
+        and returns a copy of its results instead of running the pipeline again. Results that timed out or ran
+        over budget are not kept for later retries. With a result store, completed results are recorded in it
+        and, if `history_max_age` is set, a repeated request is answered from it.
+
+        Args:
+            query (str): The query to process.
+            image (Any): The image data associated with the query.
+            config (dict): Configuration options for the agent.
+            max_planning_steps (int): The maximum number of planning steps to execute.
+            timeout (Optional[float]): The end-to-end deadline for the request, in seconds. When it passes,
+                in-flight model calls are cancelled and the partial results are returned with the
+                `timed_out` flag set on the final response. Defaults to no deadline.
+            budget (Optional[RequestBudget]): Caps on the tokens, vision calls, dollars and model time the
+                request may use. Once one is used up, no further vision step or replanning runs and the
+                partial results are returned. The final response reports the spend. Defaults to a budget
+                with the agent's `budget_limits`.
+
+        Returns:
+            list: The results generated by the agent.
+        """
+        if self.single_flight is None and self.result_store is None:
+            return self._invoke(
+                query, image, config, max_planning_steps, timeout, budget=budget
+            )
+
+        key = self.request_key(query, image, config, max_planning_steps)
+        if self.single_flight is None:
+            return self._invoke_with_history(
+                key, query, image, config, max_planning_steps, timeout, budget
+            )
+        budget_limits = (
+            tuple(sorted(budget.limits.items())) if budget is not None else None
+        )
+        results = self.single_flight.do(
+            # requests only share an execution if it runs under the same deadline and budget
+            key + (timeout, budget_limits),
+            lambda: self._invoke_with_history(
+                key, query, image, config, max_planning_steps, timeout, budget
+            ),
+            # a retry should get a fresh attempt, not the answer that ran out of time or budget
+            cacheable=lambda results: not is_partial_result(results),
+        )
+        # callers share the results, so each gets its own copy
+        return copy.deepcopy(results)
+
+    def _invoke_with_history(
+        self,
+        key: tuple,
+        query: str,
+        image: Any,
+        config: dict,
+        max_planning_steps: int,
+        timeout: Optional[float],
+        budget: Optional[RequestBudget] = None,
+    ) -> list:
+        """
+        Serves a request from the result store if it holds a recent enough answer, and otherwise runs the
+        agent graph and records the results.
+
+        Args:
+            key (tuple): The request key from `request_key`.
+            query (str): The query to process.
+            image (Any): The image data associated with the query.
+            config (dict): Configuration options for the agent.
+            max_planning_steps (int): The maximum number of planning steps to execute.
+            timeout (Optional[float]): The end-to-end deadline for the request, in seconds.
+            budget (Optional[RequestBudget]): The request budget.
+
+        Returns:
+            list: The results generated by the agent, or stored for an earlier identical request. Stored
+                results went through JSON, so values JSON cannot represent come back as strings.
+        """
+        if self.result_store is None:
+            return self._invoke(
+                query, image, config, max_planning_steps, timeout, budget=budget
+            )
+
+        user_id, image_hash, query_hash, _ = key
+        if self.history_max_age is not None:
+            stored = self.result_store.lookup(
+                image_hash, query_hash, user_id=user_id, max_age=self.history_max_age
+            )
+            if stored is not None:
+                logger.info("Serving the request from the result store")
+                return stored
+
+        results = self._invoke(
+            query, image, config, max_planning_steps, timeout, budget=budget
+        )
+        self.result_store.record(user_id, image_hash, query_hash, query, results)
+        return results
+
+    def replan(
+        self,
+        query: str,
+        image: Any,
+        plan: str,
+        feedback: str,
+        config: dict = dummy_agent_config,
+        max_planning_steps: int = 2,
+        timeout: Optional[float] = request_timeout,
+    ) -> list:
+        """
+        Runs the agent for an image on which an existing plan gave an answer that was not good enough,
+        starting from a revision of that plan instead of planning from scratch.
+
+        Args:
+            query (str): The query to process.
+            image (Any): The image data associated with the query.
+            plan (str): The plan that was already executed.
+            feedback (str): The assessment of the answer that plan produced.
+            config (dict): Configuration options for the agent.
+            max_planning_steps (int): The maximum number of planning steps, including the existing plan.
+            timeout (Optional[float]): The end-to-end deadline for the request, in seconds.
+
+        Returns:
+            list: The results generated by the agent.
+        """
+        return self._invoke(
+            query,
+            image,
+            config,
+            max_planning_steps,
+            timeout,
+            initial_state={
+                "plan": plan,
+                "plan_version": 1,
+                "answer_assessment": feedback,
+            },
+        )
+
+    def _invoke(
+        self,
+        query: str,
+        image: Any,
+        config: dict,
+        max_planning_steps: int,
+        timeout: Optional[float],
+        initial_state: Optional[dict] = None,
+        budget: Optional[RequestBudget] = None,
+    ) -> list:
+        """
+        Runs the agent graph for a single request.
+
         Args:
             query (str): The query to process.
             image (Any): The image data associated with the query.
             config (dict): Configuration options for the agent.
             max_planning_steps (int): The maximum number of planning steps to execute.
+            timeout (Optional[float]): The end-to-end deadline for the request, in seconds.
+            initial_state (Optional[dict]): Extra state to start the graph from, e.g. a previous plan.
+            budget (Optional[RequestBudget]): The request budget. Defaults to one with the agent's limits.
 
         Returns:
             list: The results generated by the agent.
@@ -178,18 +752,72 @@ class Agent:
         user_id: str = config["configurable"]["user_id"]
         namespace: tuple = (user_id, "memories")
         results: list = []
+        deadline: Optional[Deadline] = (
+            Deadline(timeout, low_fraction=deadline_low_fraction)
+            if timeout is not None
+            else None
+        )
+        if budget is None:
+            budget = RequestBudget(**self.budget_limits)
 
-        for i, update in enumerate(
-            self.agent.stream(
-                {"task": query, "image_data": image, "max_plans": max_planning_steps},
-                config,
-                stream_mode="updates",
-            )
+        if initial_state is None and self.plan_templates is not None:
+            initial_state = self.plan_templates.plan_state(query)
+            if initial_state is not None:
+                logger.info("Using a plan template, skipping the planner")
+
+        speculative: Optional[SpeculativeVision] = None
+        # with the plan already known there is no planning to overlap
+        if self.speculative_executor is not None and not (initial_state or {}).get(
+            "plan_structure"
         ):
-            logger.info(f"At agent step {i}")
-            self.display_components(update)
-            memory_id: str = str(uuid.uuid4())
-            self.store.put(namespace, memory_id, {"memory": update})
-            results.append(update)
+            speculative = SpeculativeVision(
+                self.specialist_vision,
+                image,
+                speculative_vision_tasks,
+                self.speculative_executor,
+                speculative_vision_timeout,
+                deadline,
+            )
+
+        if self.profiler is not None:
+            self.profiler.start_request(query)
 
+        completed = False
+        try:
+            for i, update in enumerate(
+                self.agent.stream(
+                    {
+                        "task": query,
+                        "image_data": image,
+                        "max_plans": max_planning_steps,
+                        "deadline": deadline,
+                        "speculative": speculative,
+                        "budget": budget,
+                        **(initial_state or {}),
+                    },
+                    config,
+                    stream_mode="updates",
+                )
+            ):
+                logger.info(f"At agent step {i}")
+                self.display_components(update)
+                memory_id: str = str(uuid.uuid4())
+                self.store.put(namespace, memory_id, {"memory": update})
+                results.append(update)
+                early_exit_stats = update.get("response", {}).get("early_exit")
+                if early_exit_stats is not None:
+                    self.early_exit_stats.update(early_exit_stats)
+                if self.profiler is not None:
+                    self.profiler.record_update(update)
+            completed = True
+        finally:
+            if speculative is not None:
+                # stop whatever the plan did not use
+                speculative.cancel()
+                self.speculation_stats.update(speculative.stats)
+                logger.info(f"Speculative vision: {speculative.stats}")
+            self.budget_spent.update(budget.spent)
+            # a failed request must not leave its samples open for the next one
+            if self.profiler is not None:
+                self.profiler.end_request(failed=not completed)
         return results
@@ -7,13 +7,35 @@ class AgentEdges:
     based on the current state of the agent.
 
     Methods:
+        start(state: dict) -> str:
+            Determines where a request enters the graph, depending on whether it already has a plan.
+
         choose_model(state: dict) -> str:
             Determines the next model to execute based on the current plan and step.
 
         back_to_plan(state: dict) -> str:
             Determines the next action based on the assessment of the current answer and iteration.
+
+        exit_early(state: dict) -> str:
+            Determines whether the plan continues after the early-exit check or the request has timed out.
     """
 
+    @staticmethod
+    def start(state: dict) -> str:
+        """
+        Determines where a request enters the graph. A request whose plan was filled from a template
+        already has a plan structure and goes straight to routing.
+
+        Args:
+            state (dict): The initial state of the agent.
+
+        Returns:
+            str: "routing" if the plan structure is already filled, otherwise "planning".
+        """
+        if state.get("plan_structure"):
+            return "routing"
+        return "planning"
+
     @staticmethod
     def choose_model(state: dict) -> str:
         """
@@ -23,8 +45,16 @@ class AgentEdges:
             state (dict): The current state of the agent, containing plan structure and step information.
 
         Returns:
-            str: The name of the tool to execute next, or "finalize" if the maximum step is exceeded.
+            str: The name of the tool to execute next, "finalize" if the maximum step is exceeded,
+                "timeout" if the request deadline has passed, or "over_budget" if a vision step was skipped
+                because the request budget is exhausted.
         """
+        deadline = state.get("deadline")
+        if state.get("timed_out", 0) or (deadline is not None and deadline.expired()):
+            return "timeout"
+        if state.get("over_budget", 0):
+            return "over_budget"
+
         current_plan = json.loads(state.get("plan_structure"))
         current_step = state.get("current_step", 1)
         max_step = state.get("max_steps", 999)
@@ -39,20 +69,48 @@ class AgentEdges:
     def back_to_plan(state: dict) -> str:
         """
         Determines the next action based on the assessment of the current answer and iteration.
+        No further replanning is attempted once the request deadline is running low or the request budget
+        is exhausted.
 
         Args:
             state (dict): The current state of the agent, containing assessment flags and iteration numbers.
 
         Returns:
-            str: The next action to take, which can be "good_answer", "timeout", or "bad_answer".
+            str: The next action to take, which can be "good_answer", "timeout", "over_budget", or
+                "bad_answer".
         """
         assessment_flag = state.get("answer_flag", 0)
         iteration_number = state.get("plan_version", 0)
         max_plans = state.get("max_plans", 1)
+        deadline = state.get("deadline")
+        budget = state.get("budget")
 
         if assessment_flag:
             return "good_answer"
         elif iteration_number > max_plans:
             return "timeout"
+        elif state.get("timed_out", 0) or (deadline is not None and deadline.is_low()):
+            return "timeout"
+        elif budget is not None and budget.exhausted():
+            return "over_budget"
         else:
             return "bad_answer"
+
+    @staticmethod
+    def exit_early(state: dict) -> str:
+        """
+        Determines whether the plan continues after the early-exit check or the request has timed out. An
+        exit has already moved the current step to the end of the plan, so routing goes on to the
+        assessment.
+
+        Args:
+            state (dict): The current state of the agent.
+
+        Returns:
+            str: "timeout" if the request deadline has passed, or "continue".
+        """
+        deadline = state.get("deadline")
+        if state.get("timed_out", 0) or (deadline is not None and deadline.expired()):
+            return "timeout"
+        else:
+            return "continue"
@@ -1,5 +1,24 @@
 import json
-from typing import Any
+import logging
+import re
+import time
+from typing import Any, Dict, Optional
+from image_agent.agent.OutputCompactor import OutputCompactor
+from image_agent.agent.sufficiency import heuristic_sufficiency
+from image_agent.agent.config import (
+    roi_padding,
+    roi_max_regions,
+    roi_max_area_fraction,
+    roi_max_pixels,
+    roi_min_width,
+)
+from image_agent.agent.RequestBudget import price_tokens
+from image_agent.image_tools import crop_regions
+from image_agent.models.config import openai_image_tokens
+from image_agent.deadline import DeadlineExceeded
+
+logger = logging.getLogger("AgentNodes")
+logger.setLevel(logging.INFO)
 
 
 class AgentNodes:
@@ -13,8 +32,22 @@ class AgentNodes:
         llm_assessment (Any): The model for assessing plans.
         florence (Any): The vision model for specialized tasks.
         qwen (Any): The vision model for general tasks.
+        compactor (OutputCompactor): Summarizes tool outputs and keeps prompts within the token budget.
+        sufficiency (Any): The model for the early-exit check, or None to use the local heuristic.
+        step_seconds (Dict[str, float]): A moving average of the duration of each tool mode, used to
+            estimate the model time saved by early exits.
+        roi_vision (bool): Whether general vision inputs are cropped to the regions found by earlier
+            specific object detection steps.
+        roi_stats (Dict[str, int]): Counts of general vision calls and cropped calls, and the pixels of the
+            full images and of the crops sent instead.
+        priced (set): The kinds of calls, "text" and "general_vision", that are billed by OpenAI and
+            charged in dollars to the request budget.
+        group_special_vision (bool): Whether consecutive special vision steps run together on one image
+            encoding.
     """
 
+    STEP_SECONDS_SMOOTHING: float = 0.2
+
     def __init__(
         self,
         planner: Any,
@@ -22,6 +55,11 @@ class AgentNodes:
         assessment: Any,
         special_vision: Any,
         general_vision: Any,
+        compactor: Optional[OutputCompactor] = None,
+        sufficiency: Any = None,
+        roi_vision: bool = False,
+        priced: Optional[set] = None,
+        group_special_vision: bool = True,
     ) -> None:
         """
         Initializes the AgentNodes with the specified models for planning, structuring, assessing, and vision.
@@ -32,12 +70,94 @@ class AgentNodes:
             assessment (Any): The model for assessing plans.
             florence_vision (Any): The vision model for specialized tasks.
             qwen_vision (Any): The vision model for general tasks.
+            compactor (Optional[OutputCompactor]): The output compactor. Defaults to one with the configured budget.
+            sufficiency (Any): The model for the early-exit check. Defaults to the local heuristic.
+            roi_vision (bool): Whether to crop general vision inputs to the regions of interest.
+            priced (Optional[set]): The kinds of calls billed by OpenAI. Defaults to none.
+            group_special_vision (bool): Whether to run consecutive special vision steps together when the
+                caller supports it.
         """
         self.llm_string: Any = planner
         self.llm_structure: Any = structure
         self.llm_assessment: Any = assessment
         self.special_vision: Any = special_vision
         self.general_vision: Any = general_vision
+        self.compactor: OutputCompactor = compactor or OutputCompactor()
+        self.sufficiency: Any = sufficiency
+        self.step_seconds: Dict[str, float] = {}
+        self.roi_vision: bool = roi_vision
+        self.roi_stats: Dict[str, int] = {
+            "calls": 0,
+            "cropped": 0,
+            "full_pixels": 0,
+            "cropped_pixels": 0,
+        }
+        self.priced: set = priced or set()
+        self.group_special_vision: bool = group_special_vision
+
+    @staticmethod
+    def out_of_time(state: dict, error: Optional[Exception] = None) -> bool:
+        """
+        Checks whether the request has run out of time, optionally as the cause of a backend error.
+
+        Args:
+            state (dict): The current state of the agent, containing the request deadline.
+            error (Optional[Exception]): An error raised by a backend call, if any.
+
+        Returns:
+            bool: True if the request has timed out.
+        """
+        if state.get("timed_out", 0) or isinstance(error, DeadlineExceeded):
+            return True
+        deadline = state.get("deadline")
+        return deadline is not None and deadline.expired()
+
+    @staticmethod
+    def over_budget(state: dict) -> bool:
+        """
+        Checks whether the request budget has been exhausted.
+
+        Args:
+            state (dict): The current state of the agent, containing the request budget.
+
+        Returns:
+            bool: True if any capped resource has been used up.
+        """
+        budget = state.get("budget")
+        return budget is not None and bool(budget.exhausted())
+
+    def charge(
+        self, state: dict, kind: str, prompt: str, output: Any, seconds: float
+    ) -> None:
+        """
+        Charges a model call to the request budget, if there is one.
+
+        Tokens are estimated with the compactor's tokenizer. Vision calls count against the vision call
+        cap, and general vision calls billed by OpenAI also pay for the image's tokens.
+
+        Args:
+            state (dict): The current state of the agent, containing the request budget.
+            kind (str): "text", "special_vision" or "general_vision".
+            prompt (str): The text sent to the model.
+            output (Any): The model's output.
+            seconds (float): How long the call took.
+        """
+        budget = state.get("budget")
+        if budget is None:
+            return
+        input_tokens, output_tokens = 0, 0
+        if kind != "special_vision":
+            input_tokens = self.compactor.estimate_tokens(prompt)
+            output_tokens = self.compactor.estimate_tokens(str(output))
+        priced = kind in self.priced
+        if priced and kind == "general_vision":
+            input_tokens += openai_image_tokens
+        budget.charge(
+            tokens=input_tokens + output_tokens,
+            vision_calls=int(kind != "text"),
+            dollars=price_tokens(input_tokens, output_tokens) if priced else 0.0,
+            model_seconds=seconds,
+        )
 
     def plan_node(self, state: dict) -> dict:
         """
@@ -49,17 +169,33 @@ class AgentNodes:
         Returns:
             dict: A dictionary containing the new plan and the updated plan version.
         """
+        if self.out_of_time(state):
+            return {"timed_out": 1}
+
         agent_task = state["task"]
         plan_version = state.get("plan_version", 0)
         previous_response = state.get("answer_assessment", None)
         previous_plan = state.get("plan", None)
 
         if previous_plan and previous_response:
+            # the old plan and feedback share half of the budget, the task itself is never cut
+            section_budget = self.compactor.remaining_budget(agent_task) // 4
+            previous_plan = self.compactor.truncate(previous_plan, section_budget)
+            previous_response = self.compactor.truncate(
+                previous_response, section_budget
+            )
             input_task = f"The task is {agent_task}\nYour old plan was {previous_plan} \n but your answer wasn't good enough. Another system provided this feedback: \n {previous_response}. \n Please revise your plan"
         else:
             input_task = f"The task is {agent_task}"
 
-        response = self.llm_string.call(input_task)
+        try:
+            start = time.perf_counter()
+            response = self.llm_string.call(input_task, deadline=state.get("deadline"))
+        except Exception as e:
+            if self.out_of_time(state, e):
+                return {"timed_out": 1}
+            raise
+        self.charge(state, "text", input_task, response, time.perf_counter() - start)
         return {"plan": response, "plan_version": plan_version + 1}
 
     @staticmethod
@@ -89,10 +225,29 @@ class AgentNodes:
         Returns:
             dict: A dictionary containing the structured plan and step information.
         """
+        no_plan = {"plan_structure": json.dumps({}), "current_step": 0, "max_steps": 0}
+        if self.out_of_time(state):
+            return {**no_plan, "timed_out": 1}
+
         messages = state["plan"]
-        response = self.llm_structure.call(messages)
+        try:
+            start = time.perf_counter()
+            response = self.llm_structure.call(messages, deadline=state.get("deadline"))
+        except Exception as e:
+            if self.out_of_time(state, e):
+                return {**no_plan, "timed_out": 1}
+            if isinstance(e, ValueError):
+                # an invalid or cut-off plan runs no steps, so the assessment asks for a new one
+                logger.warning(f"Could not structure the plan: {e}")
+                return no_plan
+            raise
         final_plan_dict = self.post_process_plan_structure(response)
         final_plan = json.dumps(final_plan_dict)
+        self.charge(state, "text", messages, final_plan, time.perf_counter() - start)
+
+        speculative = state.get("speculative")
+        if speculative is not None:
+            speculative.keep_only(final_plan)
 
         return {
             "plan_structure": final_plan,
@@ -113,55 +268,350 @@ class AgentNodes:
         plan_stage = state.get("current_step", 0)
         return {"current_step": plan_stage + 1}
 
+    def special_vision_group(self, state: dict) -> list:
+        """
+        Collects the current step and, if grouping is enabled and the special vision caller can run several
+        tasks on one image encoding, the consecutive special vision steps that follow it. The group is no
+        larger than the vision calls left in the request budget, since it runs as a whole.
+
+        Args:
+            state (dict): The current state of the agent, containing the plan structure.
+
+        Returns:
+            list: The step number, tool mode and tool input of each step in the group.
+        """
+        steps = json.loads(state.get("plan_structure"))
+        step = state.get("current_step")
+        last_step = step
+        if self.group_special_vision and hasattr(self.special_vision, "call_many"):
+            budget = state.get("budget")
+            calls_left = budget.remaining("vision_calls") if budget is not None else None
+            while (
+                str(last_step + 1) in steps
+                and steps[str(last_step + 1)]["tool_name"] == "special_vision"
+                and (calls_left is None or last_step + 1 - step < calls_left)
+            ):
+                last_step += 1
+
+        group = []
+        for plan_stage in range(step, last_step + 1):
+            florence_input = steps[str(plan_stage)]
+            florence_text = florence_input["tool_input"]
+            if florence_text and len(florence_text) < 1:
+                florence_text = None
+            group.append((plan_stage, florence_input["tool_mode"], florence_text))
+        return group
+
     def call_special_vision_node(self, state: dict) -> dict:
         """
-        Calls the specialized vision model with the current step's input.
+        Calls the specialized vision model with the current step's input, unless the step's result was
+        already computed speculatively while the request was being planned.
+
+        Consecutive special vision steps run together through the caller's `call_many`, when it has one,
+        so that the image is encoded once for all of them. The current step then advances to the last step
+        of the group.
 
         Args:
             state (dict): The current state of the agent, containing the plan structure and image data.
 
         Returns:
-            dict: A dictionary containing the output from the specialized vision model.
+            dict: A dictionary containing the output of each step from the specialized vision model, or the
+                over budget flag if the request budget is exhausted.
         """
-        plan_stage = state.get("current_step")
-        florence_input = json.loads(state.get("plan_structure"))[str(plan_stage)]
+        if self.over_budget(state):
+            return {"over_budget": 1}
+
+        group = self.special_vision_group(state)
+        outputs: dict = {}
+
+        speculative = state.get("speculative")
+        if speculative is not None:
+            for plan_stage, florence_mode, _ in group:
+                try:
+                    hit, florence_output = speculative.take(
+                        florence_mode, deadline=state.get("deadline")
+                    )
+                except DeadlineExceeded:
+                    return {"timed_out": 1}
+                if hit:
+                    # the model time was spent in the background, before the plan asked for it
+                    self.charge(
+                        state, "special_vision", florence_mode, florence_output, 0.0
+                    )
+                    outputs[plan_stage] = florence_output
+
+        remaining = [step for step in group if step[0] not in outputs]
+        try:
+            start = time.perf_counter()
+            if len(remaining) > 1:
+                new_outputs = self.special_vision.call_many(
+                    [(florence_mode, florence_text) for _, florence_mode, florence_text in remaining],
+                    image=state.get("image_data"),
+                    deadline=state.get("deadline"),
+                )
+            else:
+                new_outputs = [
+                    self.special_vision.call(
+                        task_prompt=florence_mode,
+                        image=state.get("image_data"),
+                        text_input=florence_text,
+                        deadline=state.get("deadline"),
+                    )
+                    for _, florence_mode, florence_text in remaining
+                ]
+            seconds = time.perf_counter() - start
+        except Exception as e:
+            if self.out_of_time(state, e):
+                return {"timed_out": 1}
+            raise
+        for (plan_stage, florence_mode, _), florence_output in zip(remaining, new_outputs):
+            # a shared encoding and decode cannot be split, so each task gets an equal share
+            self.record_step_time(florence_mode, seconds / len(remaining))
+            self.charge(
+                state,
+                "special_vision",
+                florence_mode,
+                florence_output,
+                seconds / len(remaining),
+            )
+            outputs[plan_stage] = florence_output
+
+        update: dict = {
+            "plan_output": [
+                {plan_stage: json.dumps(outputs[plan_stage])} for plan_stage, _, _ in group
+            ],
+        }
+        if len(group) > 1:
+            update["current_step"] = group[-1][0]
+        return update
 
-        florence_mode = florence_input["tool_mode"]
-        florence_text = florence_input["tool_input"]
+    @staticmethod
+    def regions_of_interest(state: dict, query: str) -> list:
+        """
+        Collects the boxes found by the specific object detection steps of the current plan that have run.
 
-        if florence_text and len(florence_text) < 1:
-            florence_text = None
+        If the labels of some boxes appear in the query as whole words, optionally plural, only those are
+        kept, so that a question about one of several grounded phrases is asked about that region alone.
 
-        florence_output = self.special_vision.call(
-            task_prompt=florence_mode,
-            image=state.get("image_data"),
-            text_input=florence_text,
+        Args:
+            state (dict): The current state of the agent.
+            query (str): The general vision step's input.
+
+        Returns:
+            list: The [x1, y1, x2, y2] boxes, in pixels of the image.
+        """
+        steps = json.loads(state.get("plan_structure"))
+        previous_steps = state.get("current_step", 1) - 1
+        plan_output = state.get("plan_output", [])
+        # the last entries belong to the current plan, one per step run so far
+        current_outputs = plan_output[len(plan_output) - previous_steps :] if previous_steps else []
+
+        regions = []
+        for entry in current_outputs:
+            for step, raw_output in entry.items():
+                if steps[str(step)]["tool_mode"] != "specific object detection":
+                    continue
+                output = json.loads(raw_output)
+                if isinstance(output, dict):
+                    regions.extend(zip(output.get("bboxes", []), output.get("labels", [])))
+
+        query_text = (query or "").lower()
+        # "cat" must not match "category", but "cat" is mentioned in "the cats"
+        mentioned = [
+            box
+            for box, label in regions
+            if label
+            and label.strip()
+            and re.search(rf"\b{re.escape(label.strip().lower())}(?:e?s)?\b", query_text)
+        ]
+        return mentioned or [box for box, _ in regions]
+
+    def general_vision_input(self, state: dict, query: str) -> tuple:
+        """
+        Prepares the image for a general vision call, cropped to the regions of interest if enabled.
+
+        The crop is sent at its own size, scaled down to the configured pixel budget and up to the configured
+        minimum width, so that small regions keep their detail without large ones costing more than the
+        full image would.
+
+        Args:
+            state (dict): The current state of the agent.
+            query (str): The general vision step's input.
+
+        Returns:
+            tuple: The image and the keyword arguments for the backend's resolution, which are empty when
+                the full image is sent at the backend's default resolution.
+        """
+        image = state.get("image_data")
+        self.roi_stats["calls"] += 1
+        if not self.roi_vision:
+            return image, {}
+
+        boxes = self.regions_of_interest(state, query)
+        if not boxes:
+            return image, {}
+        crop, _ = crop_regions(
+            image, boxes, roi_padding, roi_max_regions, roi_max_area_fraction
         )
-        return {
-            "plan_output": [{plan_stage: json.dumps(florence_output)}],
-        }
+        if crop is None:
+            return image, {}
+
+        scale = min(1.0, (roi_max_pixels / (crop.width * crop.height)) ** 0.5)
+        width = max(roi_min_width, int(crop.width * scale))
+        self.roi_stats["cropped"] += 1
+        self.roi_stats["full_pixels"] += image.width * image.height
+        self.roi_stats["cropped_pixels"] += crop.width * crop.height
+        return crop, {"standard_width": width}
 
     def call_general_vision_node(self, state: dict) -> dict:
         """
-        Calls the general vision model with the current step's input.
+        Calls the general vision model with the current step's input, on the regions of interest found by
+        earlier steps if ROI cropping is enabled.
 
         Args:
             state (dict): The current state of the agent, containing the plan structure and image data.
 
         Returns:
-            dict: A dictionary containing the output from the general vision model.
+            dict: A dictionary containing the output from the general vision model, or the over budget flag
+                if the request budget is exhausted.
         """
         plan_stage = state.get("current_step")
         qwen_input = json.loads(state.get("plan_structure"))[str(plan_stage)]
 
         qwen_text = qwen_input["tool_input"]
-        qwen_output = self.general_vision.call(
-            query=qwen_text, image=state.get("image_data")
-        )
+        if self.over_budget(state):
+            return {"over_budget": 1}
+        image, resolution = self.general_vision_input(state, qwen_text)
+        try:
+            start = time.perf_counter()
+            qwen_output = self.general_vision.call(
+                query=qwen_text,
+                image=image,
+                deadline=state.get("deadline"),
+                **resolution,
+            )
+            seconds = time.perf_counter() - start
+        except Exception as e:
+            if self.out_of_time(state, e):
+                return {"timed_out": 1}
+            raise
+        self.record_step_time(qwen_input["tool_mode"], seconds)
+        self.charge(state, "general_vision", qwen_text, qwen_output, seconds)
         return {
             "plan_output": [{plan_stage: str(qwen_output)}],
         }
 
+    def record_step_time(self, tool_mode: str, seconds: float) -> None:
+        """
+        Updates the moving average duration of a tool mode.
+
+        Args:
+            tool_mode (str): The mode the tool was called in.
+            seconds (float): How long the call took.
+        """
+        previous = self.step_seconds.get(tool_mode)
+        if previous is None:
+            self.step_seconds[tool_mode] = seconds
+        else:
+            alpha = self.STEP_SECONDS_SMOOTHING
+            self.step_seconds[tool_mode] = (1 - alpha) * previous + alpha * seconds
+
+    def check_sufficiency(self, state: dict) -> tuple:
+        """
+        Checks whether the outputs of the steps run so far already answer the question, with the
+        sufficiency model if there is one and the local heuristic otherwise.
+
+        Args:
+            state (dict): The current state of the agent.
+
+        Returns:
+            tuple: Whether the question is answered, and the reason.
+        """
+        if self.sufficiency is None:
+            return heuristic_sufficiency(
+                state.get("task"),
+                state.get("plan_structure"),
+                state.get("plan_output", []),
+                state.get("current_step", 0),
+            )
+
+        model_plan = self.compactor.truncate(
+            state.get("plan"), self.compactor.token_budget // 4
+        )
+        llm_header = f"The question was: {state.get('task')} \nThe plan was:\n {model_plan}\nThe outputs so far are:\n "
+        output_so_far = self.compactor.compact_plan_output(
+            state.get("plan_output", []), self.compactor.remaining_budget(llm_header)
+        )
+        start = time.perf_counter()
+        response = self.sufficiency.call(
+            llm_header + output_so_far, deadline=state.get("deadline")
+        ).model_dump()
+        self.charge(
+            state,
+            "text",
+            llm_header + output_so_far,
+            json.dumps(response),
+            time.perf_counter() - start,
+        )
+        return bool(response["sufficient"]), response["reason"]
+
+    def early_exit_node(self, state: dict) -> dict:
+        """
+        Checks after a vision step whether the remaining steps of the plan can be skipped.
+
+        The check is skipped after the last step, which the full assessment follows anyway. An exit skips
+        the remaining steps by moving the current step to the end of the plan, so the assessment still
+        decides whether the answer is good enough. The request's early-exit statistics count the checks and
+        their duration, and on an exit the steps skipped and an estimate of the model time they would have
+        taken, from the moving average of each tool mode.
+
+        Args:
+            state (dict): The current state of the agent.
+
+        Returns:
+            dict: The updated early-exit statistics and, on an exit, the last step of the plan.
+        """
+        stats = dict(
+            state.get("early_exit")
+            or {
+                "checks": 0,
+                "check_seconds": 0.0,
+                "exited": 0,
+                "skipped_steps": 0,
+                "saved_seconds": 0.0,
+            }
+        )
+        current_step = state.get("current_step", 0)
+        max_steps = state.get("max_steps", 0)
+        if self.out_of_time(state) or current_step >= max_steps:
+            return {"early_exit": stats}
+
+        start = time.perf_counter()
+        try:
+            sufficient, reason = self.check_sufficiency(state)
+        except Exception as e:
+            if self.out_of_time(state, e):
+                return {"early_exit": stats, "timed_out": 1}
+            # the check is an optimisation, so a failing one just lets the plan continue
+            sufficient, reason = False, f"Sufficiency check failed: {e}"
+        stats["checks"] += 1
+        stats["check_seconds"] += time.perf_counter() - start
+        if not sufficient:
+            return {"early_exit": stats}
+
+        steps = json.loads(state.get("plan_structure"))
+        skipped = [steps[str(step)] for step in range(current_step + 1, max_steps + 1)]
+        stats["exited"] += 1
+        stats["skipped_steps"] += len(skipped)
+        # modes that have never run are assumed to take as long as the average mode
+        measured = list(self.step_seconds.values())
+        default_seconds = sum(measured) / len(measured) if measured else 0.0
+        stats["saved_seconds"] += sum(
+            self.step_seconds.get(step["tool_mode"], default_seconds) for step in skipped
+        )
+        logger.info(f"Skipping {len(skipped)} remaining steps: {reason}")
+        return {"early_exit": stats, "current_step": max_steps}
+
     def assessment_node(self, state: dict) -> dict:
         """
         Assesses the generated plan and output based on the user question.
@@ -170,18 +620,44 @@ class AgentNodes:
             state (dict): The current state of the agent, containing the user question and plan information.
 
         Returns:
-            dict: A dictionary containing the assessment of the answer and a flag indicating the result.
+            dict: A dictionary containing the assessment of the answer and a flag indicating the result, and
+                the over budget flag if the answer is not good enough but the exhausted budget rules out a
+                new plan.
         """
         user_question = state.get("task")
-        model_plan = state.get("plan")
-        output_so_far = str(state.get("plan_output", []))
-        llm_input = f"The question was: {user_question} \nThe plan was:\n {model_plan}\nThe output is:\n {output_so_far}"
-        response = self.llm_assessment.call(llm_input).model_dump()
+        model_plan = self.compactor.truncate(
+            state.get("plan"), self.compactor.token_budget // 4
+        )
+        llm_header = f"The question was: {user_question} \nThe plan was:\n {model_plan}\nThe output is:\n "
+        output_so_far = self.compactor.compact_plan_output(
+            state.get("plan_output", []), self.compactor.remaining_budget(llm_header)
+        )
+        llm_input = llm_header + output_so_far
+        try:
+            start = time.perf_counter()
+            response = self.llm_assessment.call(
+                llm_input, deadline=state.get("deadline")
+            ).model_dump()
+        except Exception as e:
+            if self.out_of_time(state, e):
+                return {"answer_flag": 0, "timed_out": 1}
+            raise
+        self.charge(
+            state, "text", llm_input, json.dumps(response), time.perf_counter() - start
+        )
 
-        return {
+        update = {
             "answer_assessment": response["assessment"],
             "answer_flag": response["final_answer"],
         }
+        # a bad answer that would have been replanned ends here, cut short by the budget
+        if (
+            not response["final_answer"]
+            and state.get("plan_version", 0) <= state.get("max_plans", 1)
+            and self.over_budget(state)
+        ):
+            update["over_budget"] = 1
+        return update
 
     def dump_result_node(self, state: dict) -> dict:
         """
@@ -191,8 +667,23 @@ class AgentNodes:
             state (dict): The current state of the agent, containing the output and assessment.
 
         Returns:
-            dict: A dictionary containing the final assessment and output results.
+            dict: A dictionary containing the final assessment, output results, whether the request
+                timed out, in which case the output is partial, the early-exit statistics if early exit is
+                enabled, and the spend of the request budget and whether the request was cut short by it.
+                A request that merely reached a cap while completing is not over budget.
         """
         output_so_far = state.get("plan_output", [])
         final_response = state.get("answer_assessment", "")
-        return {"answer_assessment": final_response, "final_result": output_so_far}
+        result = {
+            "answer_assessment": final_response,
+            "final_result": output_so_far,
+            "timed_out": int(self.out_of_time(state)),
+        }
+        if state.get("early_exit") is not None:
+            result["early_exit"] = state["early_exit"]
+        budget = state.get("budget")
+        if budget is not None:
+            result["budget"] = budget.report()
+            # "exhausted" in the report says which caps were reached, which a complete answer can also do
+            result["over_budget"] = int(bool(state.get("over_budget", 0)))
+        return result
@@ -1,6 +1,5 @@
 from typing_extensions import TypedDict
-from IPython.display import Image
-from typing import List, Dict, Annotated
+from typing import Any, List, Dict, Annotated
 from operator import add
 
 
@@ -11,7 +10,7 @@ class AgentState(TypedDict):
     plan: str
     plan_version: int
     max_plans: int
-    image_data: Image
+    image_data: Any
     plan_structure: str
     current_step: int
     max_steps: int
@@ -19,3 +18,9 @@ class AgentState(TypedDict):
     answer_assessment: str
     answer_flag: int
     final_result: List[str]
+    deadline: Any
+    timed_out: int
+    speculative: Any
+    early_exit: Dict[str, float]
+    budget: Any
+    over_budget: int
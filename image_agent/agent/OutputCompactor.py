@@ -0,0 +1,294 @@
+import json
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from image_agent.agent.config import (
+    prompt_token_budget,
+    compaction_top_labels,
+    compaction_max_boxes_per_label,
+    compaction_max_text_tokens,
+)
+from image_agent.models.config import open_ai_model
+
+logger = logging.getLogger("OutputCompactor")
+
+
+class OutputCompactor:
+    """
+    A class to compact raw tool outputs into short summaries and keep prompts within a token budget.
+
+    Florence detection outputs are reduced to counts, the most common labels and a handful of rounded
+    boxes per label, OCR outputs to their text plus rounded region boxes. Token counts are estimated
+    with the OpenAI tokenizer (tiktoken) when it is installed, or with a characters-per-token heuristic
+    otherwise.
+
+    Attributes:
+        token_budget (int): The maximum number of tokens for a single prompt.
+        top_labels (int): The number of most common labels to report for detection outputs.
+        max_boxes_per_label (int): The number of boxes to keep for each reported label.
+        max_text_tokens (int): The maximum number of tokens kept for any free-text output.
+        model_name (str): The model whose tokenizer is used to estimate prompt sizes.
+    """
+
+    CHARS_PER_TOKEN: int = 4
+    TRUNCATION_MARKER: str = " ...[truncated]"
+    OMITTED_MARKER_TOKENS: int = 12
+
+    def __init__(
+        self,
+        token_budget: int = prompt_token_budget,
+        top_labels: int = compaction_top_labels,
+        max_boxes_per_label: int = compaction_max_boxes_per_label,
+        max_text_tokens: int = compaction_max_text_tokens,
+        model_name: str = open_ai_model,
+    ) -> None:
+        """
+        Initializes the OutputCompactor with the given budget and summary limits.
+
+        Args:
+            token_budget (int): The maximum number of tokens for a single prompt.
+            top_labels (int): The number of most common labels to report for detection outputs.
+            max_boxes_per_label (int): The number of boxes to keep for each reported label.
+            max_text_tokens (int): The maximum number of tokens kept for any free-text output.
+            model_name (str): The model whose tokenizer is used to estimate prompt sizes.
+        """
+        self.token_budget: int = token_budget
+        self.top_labels: int = top_labels
+        self.max_boxes_per_label: int = max_boxes_per_label
+        self.max_text_tokens: int = max_text_tokens
+        self.model_name: str = model_name
+        self._encoder: Any = None
+        self._encoder_loaded: bool = False
+
+    @property
+    def encoder(self) -> Any:
+        """
+        The tiktoken encoder, loaded on first use since reading the encoding takes a noticeable part of
+        startup time.
+        """
+        if not self._encoder_loaded:
+            self._encoder = self._load_encoder(self.model_name)
+            self._encoder_loaded = True
+        return self._encoder
+
+    @staticmethod
+    def _load_encoder(model_name: str) -> Any:
+        """
+        Loads the tiktoken encoder for the given model, if tiktoken is available.
+
+        Args:
+            model_name (str): The name of the OpenAI model.
+
+        Returns:
+            Any: The tiktoken encoding, or None if tiktoken is not installed or its encoding files cannot
+                be fetched (e.g. on hosts without network access).
+        """
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+
+        try:
+            try:
+                return tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(
+                f"Could not load tiktoken encoding ({e}), estimating tokens from characters"
+            )
+            return None
+
+    def estimate_tokens(self, text: str) -> int:
+        """
+        Estimates the number of tokens in a piece of text.
+
+        Args:
+            text (str): The text to measure.
+
+        Returns:
+            int: The estimated number of tokens.
+        """
+        if not text:
+            return 0
+        if self.encoder is not None:
+            return len(self.encoder.encode(text, disallowed_special=()))
+        return -(-len(text) // self.CHARS_PER_TOKEN)
+
+    def truncate(self, text: Optional[str], max_tokens: int) -> str:
+        """
+        Truncates text so that it fits within the given number of tokens.
+
+        Args:
+            text (Optional[str]): The text to truncate.
+            max_tokens (int): The maximum number of tokens to keep.
+
+        Returns:
+            str: The original text if it fits, otherwise a truncated copy ending with a marker, the marker
+                included in the token count. Empty if not even the marker fits.
+        """
+        if not text:
+            return ""
+        text = str(text)
+        if self.estimate_tokens(text) <= max_tokens:
+            return text
+        # the marker is part of the result, so its tokens come out of the text's share
+        kept_tokens = max_tokens - self.estimate_tokens(self.TRUNCATION_MARKER)
+        if kept_tokens <= 0:
+            marker = self.TRUNCATION_MARKER.strip()
+            return marker if self.estimate_tokens(marker) <= max_tokens else ""
+
+        if self.encoder is not None:
+            tokens = self.encoder.encode(text, disallowed_special=())
+            return self.encoder.decode(tokens[:kept_tokens]) + self.TRUNCATION_MARKER
+        return text[: kept_tokens * self.CHARS_PER_TOKEN] + self.TRUNCATION_MARKER
+
+    def remaining_budget(self, *parts: str) -> int:
+        """
+        Computes how many tokens are left in the prompt budget after the given parts.
+
+        Args:
+            *parts (str): The prompt parts that are already fixed.
+
+        Returns:
+            int: The number of tokens still available, never less than zero.
+        """
+        used = sum(self.estimate_tokens(part) for part in parts)
+        return max(self.token_budget - used, 0)
+
+    @staticmethod
+    def _round_box(box: List[float]) -> List[int]:
+        """
+        Rounds a box or quadrilateral to an integer [x1, y1, x2, y2] box.
+
+        Args:
+            box (List[float]): Either [x1, y1, x2, y2] or a flat list of quadrilateral corner coordinates.
+
+        Returns:
+            List[int]: The rounded axis-aligned box.
+        """
+        xs = box[0::2]
+        ys = box[1::2]
+        return [round(min(xs)), round(min(ys)), round(max(xs)), round(max(ys))]
+
+    def summarize_detection(self, output: Dict[str, Any]) -> str:
+        """
+        Summarizes a detection output into counts, top labels and rounded boxes.
+
+        Args:
+            output (Dict[str, Any]): A Florence detection output with "bboxes" and "labels" keys.
+
+        Returns:
+            str: The detection summary.
+        """
+        labels = [label.strip() or "unlabelled" for label in output.get("labels", [])]
+        boxes = output.get("bboxes", [])
+        counts = Counter(labels)
+
+        boxes_by_label: Dict[str, List[List[int]]] = {}
+        for label, box in zip(labels, boxes):
+            boxes_by_label.setdefault(label, []).append(self._round_box(box))
+
+        parts = []
+        for label, count in counts.most_common(self.top_labels):
+            kept = boxes_by_label.get(label, [])[: self.max_boxes_per_label]
+            extra = f" (+{count - len(kept)} more)" if count > len(kept) else ""
+            parts.append(f"{label} x{count}: {kept}{extra}")
+
+        other_labels = len(counts) - min(len(counts), self.top_labels)
+        summary = f"detections: {len(labels)} objects, {len(counts)} labels. " + "; ".join(parts)
+        if other_labels:
+            summary += f"; {other_labels} other labels omitted"
+        return summary
+
+    def summarize_ocr(self, output: Dict[str, Any]) -> str:
+        """
+        Summarizes an OCR output into its text and rounded region boxes.
+
+        Args:
+            output (Dict[str, Any]): A Florence OCR output with "quad_boxes" and "labels" keys.
+
+        Returns:
+            str: The OCR summary.
+        """
+        texts = [text.replace("</s>", "").strip() for text in output.get("labels", [])]
+        regions = [
+            f"'{text}' {self._round_box(box)}"
+            for text, box in zip(texts, output.get("quad_boxes", []))
+            if text
+        ]
+        summary = f"ocr: {len(regions)} text regions. " + "; ".join(regions)
+        return self.truncate(summary, self.max_text_tokens)
+
+    def summarize_output(self, raw_output: Any) -> str:
+        """
+        Summarizes the raw output of a single plan step.
+
+        Args:
+            raw_output (Any): The stored output of a step, usually a JSON string from the special vision
+                node or free text from the general vision node.
+
+        Returns:
+            str: A compact, human-readable summary of the output.
+        """
+        parsed = raw_output
+        if isinstance(raw_output, str):
+            try:
+                parsed = json.loads(raw_output)
+            except json.JSONDecodeError:
+                parsed = raw_output
+
+        if isinstance(parsed, dict) and "quad_boxes" in parsed:
+            return self.summarize_ocr(parsed)
+        if isinstance(parsed, dict) and "bboxes" in parsed:
+            return self.summarize_detection(parsed)
+        if isinstance(parsed, str):
+            return self.truncate(parsed.strip(), self.max_text_tokens)
+        return self.truncate(json.dumps(parsed, default=str), self.max_text_tokens)
+
+    def compact_plan_output(
+        self, plan_output: List[Dict[int, str]], max_tokens: Optional[int] = None
+    ) -> str:
+        """
+        Compacts the accumulated plan outputs into a summary that fits the token budget.
+
+        Outputs are summarized one by one. When the summaries still exceed the budget, the oldest ones
+        (which belong to earlier plan versions) are dropped first.
+
+        Args:
+            plan_output (List[Dict[int, str]]): The plan outputs accumulated in the agent state.
+            max_tokens (Optional[int]): The budget for the compacted outputs. Defaults to the full prompt budget.
+
+        Returns:
+            str: The compacted outputs, one step per line.
+        """
+        if max_tokens is None:
+            max_tokens = self.token_budget
+
+        lines = []
+        for entry in plan_output:
+            for step, raw_output in entry.items():
+                lines.append(f"step {step}: {self.summarize_output(raw_output)}")
+
+        costs = [self.estimate_tokens(line) + 1 for line in lines]
+        if sum(costs) > max_tokens:
+            # leave room for the "omitted" marker line
+            max_tokens -= self.OMITTED_MARKER_TOKENS
+
+        kept: List[str] = []
+        used = 0
+        for line, cost in zip(reversed(lines), reversed(costs)):
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+
+        if lines and not kept:
+            # even the latest output is over budget on its own, so keep a truncated copy of it
+            kept.append(self.truncate(lines[-1], max_tokens))
+
+        dropped = len(lines) - len(kept)
+        if dropped:
+            kept.insert(0, f"[{dropped} earlier step outputs omitted]")
+        return "\n".join(kept)
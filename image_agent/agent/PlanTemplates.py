@@ -0,0 +1,268 @@
+import json
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from image_agent.agent.sufficiency import CLAUSE_BOUNDARY
+from image_agent.prompts.PlanStructure import Plan, TOOL_MODES, TOOL_NAMES
+from image_agent.utils import normalize_query
+
+OBJECT = r"(?:the |all (?:of )?the |all |any |every )?(?P<object>[a-z][a-z0-9 '-]*?)"
+IMAGE = r"(?:this |the )?(?:image|picture|photo|photograph|scene)"
+PLACE = r"(?:in|on|from) (?:this |the |that )?[a-z]+(?: [a-z]+)?"
+
+# words that cannot be part of an object slot: verbs and question words that start a clause ("the dog
+# going", "people who are sitting"), prepositions other than "of" that attach one ("the safest place to
+# stand"), comparisons, pronouns and vague objects, the image itself, and qualities of the image rather
+# than objects in it, which detection cannot find
+NON_SLOT_WORDS = set(
+    """
+    am is are was were be been being do does did have has had can could will would should may might
+    what who whom whose which that how why when where while if
+    to than between with without for from in on at by near under over behind beside into about as like
+    and or but not no
+    more most less least fewer best worst difference differences similarity similarities compared
+    this these those it its they them he she we i you one ones
+    something anything everything nothing someone anyone somebody anybody odd out anomaly anomalies
+    image images picture pictures photo photos photograph photographs pic scene
+    mood atmosphere weather lighting style emotion emotions feeling feelings vibe setting
+    composition tone colour colours color colors background time age year years
+    """.split()
+)
+
+# nouns ending in -ing, -ed or -est, which are otherwise taken for a verb closing the slot ("the dog
+# going") or a superlative ("the safest")
+SUFFIX_NOUNS = set(
+    """
+    awning bedding building ceiling clothing drawing earring icing king painting pudding railing ring
+    sibling sling string swing thing wedding wing bed red shed sled
+    chest contest crest forest guest nest pest quest test vest
+    """.split()
+)
+
+
+def is_object_phrase(text: str) -> bool:
+    """
+    Checks that a slot value is a short plain noun phrase naming an object, such as "red car" or "slices
+    of pizza", rather than the start of a clause, a comparison or a quality of the image.
+
+    Args:
+        text (str): The slot value.
+
+    Returns:
+        bool: False if the value contains a verb, question word, preposition other than a single "of",
+            comparative, superlative, pronoun, vague object or image word, or ends in a word that reads as
+            a verb.
+    """
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if not words or any(word in NON_SLOT_WORDS for word in words):
+        return False
+    if words.count("of") > 1 or "of" in (words[0], words[-1]):
+        return False
+    singular = [word[:-1] if word.endswith("s") else word for word in words]
+    if any(word.endswith("est") and word not in SUFFIX_NOUNS for word in singular):
+        return False
+    last = singular[-1]
+    if last in SUFFIX_NOUNS:
+        return True
+    return not (last.endswith("ing") or (last.endswith("ed") and not last.endswith("eed")))
+
+
+@dataclass
+class PlanTemplate:
+    """
+    A pre-validated plan for one kind of query, with slots for the tool inputs.
+
+    Attributes:
+        name (str): The name of the template.
+        pattern (re.Pattern): The pattern that a whole normalized query must match. Named groups fill the
+            slots of the same name.
+        steps (List[Tuple[str, str, Optional[str]]]): The tool name, tool mode and tool input of each step.
+            The tool input may contain slots in `str.format` syntax.
+        description (str): The plan as the planner would write it, with the same slots.
+    """
+
+    name: str
+    pattern: re.Pattern
+    steps: List[Tuple[str, str, Optional[str]]]
+    description: str
+
+    def fill(self, slots: Dict[str, str]) -> Tuple[str, Plan]:
+        """
+        Fills the slots of the template.
+
+        Args:
+            slots (Dict[str, str]): The value of each slot.
+
+        Returns:
+            Tuple[str, Plan]: The plan description and the structured plan.
+        """
+        plan = Plan.model_validate(
+            {
+                "plan": [
+                    {
+                        "tool_name": tool_name,
+                        "tool_mode": tool_mode,
+                        "tool_input": (
+                            tool_input.format(**slots) if tool_input is not None else None
+                        ),
+                    }
+                    for tool_name, tool_mode, tool_input in self.steps
+                ]
+            }
+        )
+        return self.description.format(**slots), plan
+
+
+DEFAULT_TEMPLATES: List[PlanTemplate] = [
+    PlanTemplate(
+        name="caption",
+        pattern=re.compile(
+            rf"(?:describe|caption|summari[sz]e) {IMAGE}"
+            rf"|what(?:'s| is) (?:in|happening in|going on in) {IMAGE}"
+        ),
+        steps=[("special_vision", "image captioning", None)],
+        description="1. Use special_vision in image captioning mode to describe the image.",
+    ),
+    PlanTemplate(
+        name="read_text",
+        pattern=re.compile(
+            rf"(?:read|transcribe|extract) (?:the |all (?:the )?)?(?:text|words|writing)(?: {PLACE})?"
+            rf"|what (?:does|do) (?:the )?(?:text|sign|signs|label|labels) say"
+            rf"|what(?:'s| is) written(?: {PLACE})?"
+        ),
+        steps=[("special_vision", "OCR", None)],
+        description="1. Use special_vision in OCR mode to read the text in the image.",
+    ),
+    PlanTemplate(
+        name="count",
+        pattern=re.compile(
+            rf"(?:how many|count) {OBJECT}"
+            rf"(?: (?:are|is) there| can you see| do you see| are| is)?(?: in {IMAGE})?"
+        ),
+        steps=[("special_vision", "specific object detection", "{object}")],
+        description=(
+            "1. Use special_vision in specific object detection mode with input '{object}' to find every "
+            "{object}, and count the boxes."
+        ),
+    ),
+    PlanTemplate(
+        name="locate",
+        pattern=re.compile(
+            rf"(?:where (?:is|are)|find|locate|detect|show me) {OBJECT}(?: in {IMAGE})?"
+        ),
+        steps=[("special_vision", "specific object detection", "{object}")],
+        description=(
+            "1. Use special_vision in specific object detection mode with input '{object}' to locate the "
+            "{object}."
+        ),
+    ),
+    PlanTemplate(
+        name="describe_object",
+        pattern=re.compile(rf"describe {OBJECT}(?: in {IMAGE})?"),
+        steps=[
+            ("special_vision", "specific object detection", "{object}"),
+            ("general_vision", "conversation", "Describe the {object} in detail."),
+        ],
+        description=(
+            "1. Use special_vision in specific object detection mode with input '{object}' to locate the "
+            "{object}.\n2. Use general_vision in conversation mode to describe the {object} in detail."
+        ),
+    ),
+]
+
+
+class PlanTemplateLibrary:
+    """
+    A class to match queries to pre-validated plan templates, so that common queries skip the planner.
+
+    A query matches a template only if the whole normalized query fits the template's pattern, it asks
+    for one thing (no second sentence or "... and tell me ..." clause) and every slot is a short noun
+    phrase naming an object. Anything else, e.g. "where is the dog going" or "describe the weather",
+    goes to the LLM planner.
+
+    Attributes:
+        templates (List[PlanTemplate]): The templates, tried in order.
+        max_slot_words (int): The longest slot value accepted, in words.
+        stats (Counter): The number of queries matched by each template, and of queries left to the
+            planner under "planner".
+    """
+
+    def __init__(
+        self, templates: Optional[List[PlanTemplate]] = None, max_slot_words: int = 4
+    ) -> None:
+        """
+        Initializes the PlanTemplateLibrary, validating every template.
+
+        Args:
+            templates (Optional[List[PlanTemplate]]): The templates. Defaults to the built-in ones.
+            max_slot_words (int): The longest slot value accepted, in words.
+
+        Raises:
+            ValueError: If a template uses an unknown tool name or mode.
+        """
+        self.templates: List[PlanTemplate] = (
+            templates if templates is not None else DEFAULT_TEMPLATES
+        )
+        self.max_slot_words: int = max_slot_words
+        self.stats: Counter = Counter()
+        for template in self.templates:
+            for tool_name, tool_mode, _ in template.steps:
+                if tool_name not in TOOL_NAMES or tool_mode not in TOOL_MODES:
+                    raise ValueError(
+                        f"Template {template.name} uses an unknown tool {tool_name} / {tool_mode}"
+                    )
+
+    def match(self, query: str) -> Optional[Tuple[PlanTemplate, Dict[str, str]]]:
+        """
+        Finds the template for a query.
+
+        Args:
+            query (str): The user question.
+
+        Returns:
+            Optional[Tuple[PlanTemplate, Dict[str, str]]]: The template and its slot values, or None if no
+                template matches confidently.
+        """
+        normalized = normalize_query(query)
+        if CLAUSE_BOUNDARY.search(normalized):
+            return None
+        for template in self.templates:
+            found = template.pattern.fullmatch(normalized)
+            if found is None:
+                continue
+            slots = {name: value.strip() for name, value in found.groupdict().items() if value}
+            if any(len(value.split()) > self.max_slot_words for value in slots.values()):
+                return None
+            if not all(is_object_phrase(value) for value in slots.values()):
+                continue
+            return template, slots
+        return None
+
+    def plan_state(self, query: str) -> Optional[dict]:
+        """
+        Builds the planning state for a query from its template, as `plan_node` and
+        `structure_plan_node` would have.
+
+        Args:
+            query (str): The user question.
+
+        Returns:
+            Optional[dict]: The plan, its version, its structure and step counters, or None if no template
+                matches.
+        """
+        matched = self.match(query)
+        if matched is None:
+            self.stats["planner"] += 1
+            return None
+        template, slots = matched
+        self.stats[template.name] += 1
+        plan, structured = template.fill(slots)
+        steps = {i + 1: step for i, step in enumerate(structured.model_dump()["plan"])}
+        return {
+            "plan": plan,
+            "plan_version": 1,
+            "plan_structure": json.dumps(steps),
+            "current_step": 0,
+            "max_steps": len(steps),
+        }
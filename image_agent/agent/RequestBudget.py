@@ -0,0 +1,113 @@
+import threading
+from typing import Dict, List, Optional
+from image_agent.models.config import openai_input_price, openai_output_price
+
+
+def price_tokens(input_tokens: int, output_tokens: int) -> float:
+    """
+    Estimates the OpenAI cost of a call.
+
+    Args:
+        input_tokens (int): The prompt tokens, including image tokens.
+        output_tokens (int): The completion tokens.
+
+    Returns:
+        float: The cost in dollars.
+    """
+    return input_tokens * openai_input_price + output_tokens * openai_output_price
+
+
+class RequestBudget:
+    """
+    A class to cap and account for the work done for one request.
+
+    The budget travels in the agent state. The nodes charge it after every model call, the vision nodes
+    skip their call once it is exhausted and `AgentEdges.back_to_plan` does not replan, so the request
+    ends with the partial results and its spend. A request can go over a cap by the cost of the call that
+    crossed it, since a call's cost is only known once it has run.
+
+    Attributes:
+        RESOURCES (tuple): The resources that are accounted for.
+        limits (Dict[str, Optional[float]]): The cap on each resource, None for no cap.
+        spent (Dict[str, float]): The amount of each resource spent so far.
+    """
+
+    RESOURCES: tuple = ("tokens", "vision_calls", "dollars", "model_seconds")
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        max_vision_calls: Optional[int] = None,
+        max_dollars: Optional[float] = None,
+        max_model_seconds: Optional[float] = None,
+    ) -> None:
+        """
+        Initializes the RequestBudget with nothing spent.
+
+        Args:
+            max_tokens (Optional[int]): The cap on LLM tokens, prompt and completion, including the image
+                tokens of OpenAI vision calls.
+            max_vision_calls (Optional[int]): The cap on special and general vision calls.
+            max_dollars (Optional[float]): The cap on the estimated OpenAI cost.
+            max_model_seconds (Optional[float]): The cap on the time spent in model calls.
+        """
+        self.limits: Dict[str, Optional[float]] = {
+            "tokens": max_tokens,
+            "vision_calls": max_vision_calls,
+            "dollars": max_dollars,
+            "model_seconds": max_model_seconds,
+        }
+        self.spent: Dict[str, float] = {resource: 0 for resource in self.RESOURCES}
+        self._lock = threading.Lock()
+
+    def charge(
+        self,
+        tokens: int = 0,
+        vision_calls: int = 0,
+        dollars: float = 0.0,
+        model_seconds: float = 0.0,
+    ) -> None:
+        """
+        Records the cost of a model call.
+
+        Args:
+            tokens (int): The LLM tokens used.
+            vision_calls (int): The vision calls made.
+            dollars (float): The estimated cost.
+            model_seconds (float): The time the call took.
+        """
+        with self._lock:
+            self.spent["tokens"] += tokens
+            self.spent["vision_calls"] += vision_calls
+            self.spent["dollars"] += dollars
+            self.spent["model_seconds"] += model_seconds
+
+    def remaining(self, resource: str) -> Optional[float]:
+        """
+        Returns how much of a resource is left under its cap, or None if it has no cap.
+        """
+        with self._lock:
+            limit = self.limits[resource]
+            return None if limit is None else max(0, limit - self.spent[resource])
+
+    def exhausted(self) -> List[str]:
+        """
+        Returns the resources whose cap has been reached.
+        """
+        with self._lock:
+            return [
+                resource
+                for resource, limit in self.limits.items()
+                if limit is not None and self.spent[resource] >= limit
+            ]
+
+    def report(self) -> dict:
+        """
+        Returns the spend, the caps and the resources that were exhausted.
+        """
+        exhausted = self.exhausted()
+        with self._lock:
+            spent = dict(self.spent)
+        spent["dollars"] = round(spent["dollars"], 6)
+        spent["model_seconds"] = round(spent["model_seconds"], 3)
+        return {"spent": spent, "limits": dict(self.limits), "exhausted": exhausted}
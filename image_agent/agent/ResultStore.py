@@ -0,0 +1,355 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+from image_agent.agent.config import (
+    result_store_batch_size,
+    result_store_flush_interval,
+)
+
+logger = logging.getLogger("ResultStore")
+logger.setLevel(logging.INFO)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    image_hash TEXT NOT NULL,
+    query_hash TEXT NOT NULL,
+    query TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    timed_out INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    over_budget INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS results_user ON results (user_id, created_at);
+CREATE INDEX IF NOT EXISTS results_request ON results (image_hash, query_hash, user_id, created_at);
+CREATE INDEX IF NOT EXISTS results_created ON results (created_at);
+"""
+
+COLUMNS = (
+    "id",
+    "user_id",
+    "image_hash",
+    "query_hash",
+    "query",
+    "created_at",
+    "timed_out",
+    "over_budget",
+    "results",
+)
+
+
+def has_flag(results: list, flag: str) -> bool:
+    """
+    Whether a run was cut short, by its deadline for the `timed_out` flag or its budget for `over_budget`.
+
+    Args:
+        results (list): The updates streamed by the agent graph.
+        flag (str): The name of the flag.
+
+    Returns:
+        bool: True if any update set the flag.
+    """
+    return any(
+        isinstance(output, dict) and output.get(flag)
+        for update in results
+        for output in update.values()
+    )
+
+
+def _restore_step_keys(obj: dict) -> dict:
+    """
+    Turns the step numbers keying `plan_output` and `final_result` entries back into ints, since JSON
+    object keys are always strings.
+    """
+    if obj and all(isinstance(key, str) and key.isdigit() for key in obj):
+        return {int(key): value for key, value in obj.items()}
+    return obj
+
+
+def decode_results(text: str) -> list:
+    """
+    Decodes stored updates into the shape the agent graph streamed them in, as far as JSON allows.
+
+    Args:
+        text (str): The updates as stored.
+
+    Returns:
+        list: The updates.
+    """
+    return json.loads(text, object_hook=_restore_step_keys)
+
+
+class ResultStore:
+    """
+    A class to keep completed agent results in SQLite, indexed by user, image hash, query hash and time.
+
+    Writes are queued and committed in batches by a background thread, so recording a result never blocks
+    a request on disk. Reads go through their own connection and see every batch committed so far; call
+    `flush` first to also see the queued writes.
+
+    Results are stored as JSON. Step numbers are restored as int keys when they are read back, but any
+    value JSON cannot represent, e.g. a model object, is stored and returned as its string form.
+
+    Attributes:
+        path (str): The SQLite database file.
+        batch_size (int): The most results committed in one transaction.
+        flush_interval (float): The longest a queued result waits before it is committed, in seconds.
+        stats (dict): Counts of results queued, written and failed, and of lookups and lookup hits.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = result_store_batch_size,
+        flush_interval: float = result_store_flush_interval,
+    ) -> None:
+        """
+        Initializes the ResultStore, creating the database and its indexes if needed, and starts the writer.
+
+        Args:
+            path (str): The SQLite database file.
+            batch_size (int): The most results committed in one transaction.
+            flush_interval (float): The longest a queued result waits before it is committed, in seconds.
+        """
+        self.path: str = path
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.stats: dict = {"queued": 0, "written": 0, "failed": 0, "lookups": 0, "hits": 0}
+        self._writer_connection = self._connect()
+        self._writer_connection.executescript(SCHEMA)
+        self._migrate()
+        self._reader_connection = self._connect()
+        self._read_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._closed: bool = False
+        self._writer = threading.Thread(
+            target=self._write_loop, name="result-store-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        # readers do not block the writer, and commits need not wait for a full fsync
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _migrate(self) -> None:
+        """
+        Adds the `over_budget` column to a database created before it existed, flagging the stored results
+        that ran out of budget.
+        """
+        columns = {
+            row[1] for row in self._writer_connection.execute("PRAGMA table_info(results)")
+        }
+        if "over_budget" in columns:
+            return
+        with self._writer_connection:
+            self._writer_connection.execute(
+                "ALTER TABLE results ADD COLUMN over_budget INTEGER NOT NULL DEFAULT 0"
+            )
+            # the text match only narrows the rows down, the flag is checked on the decoded updates
+            candidates = self._writer_connection.execute(
+                "SELECT id, results FROM results WHERE results LIKE '%\"over_budget\"%'"
+            ).fetchall()
+            self._writer_connection.executemany(
+                "UPDATE results SET over_budget = 1 WHERE id = ?",
+                [
+                    (row_id,)
+                    for row_id, results in candidates
+                    if has_flag(json.loads(results), "over_budget")
+                ],
+            )
+
+    def record(
+        self,
+        user_id: str,
+        image_hash: str,
+        query_hash: str,
+        query: str,
+        results: list,
+    ) -> None:
+        """
+        Queues a completed result to be written by the background thread.
+
+        Args:
+            user_id (str): The user the request belongs to.
+            image_hash (str): The content hash of the image.
+            query_hash (str): The hash of the normalized query.
+            query (str): The query as asked.
+            results (list): The updates streamed by the agent graph.
+        """
+        if self._closed:
+            raise RuntimeError("The result store is closed")
+        row = (
+            user_id,
+            image_hash,
+            query_hash,
+            query,
+            time.time(),
+            int(has_flag(results, "timed_out")),
+            int(has_flag(results, "over_budget")),
+            json.dumps(results, default=str),
+        )
+        self.stats["queued"] += 1
+        self._queue.put(row)
+
+    def _write_loop(self) -> None:
+        """
+        Commits queued results in batches until the store is closed.
+        """
+        while True:
+            item = self._queue.get()
+            batch, flushes = [], []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    flushes.append(item)
+                else:
+                    batch.append(item)
+                if stop or flushes or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    with self._writer_connection:
+                        self._writer_connection.executemany(
+                            "INSERT INTO results (user_id, image_hash, query_hash, query, created_at,"
+                            " timed_out, over_budget, results) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            batch,
+                        )
+                    self.stats["written"] += len(batch)
+                except sqlite3.Error as e:
+                    self.stats["failed"] += len(batch)
+                    logger.warning(f"Failed to write {len(batch)} results: {e}")
+            for flushed in flushes:
+                flushed.set()
+            if stop:
+                return
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every result queued so far has been committed.
+
+        Args:
+            timeout (Optional[float]): The longest to wait, in seconds.
+
+        Returns:
+            bool: False if the timeout passed first.
+        """
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def _query(self, sql: str, parameters: tuple) -> List[dict]:
+        with self._read_lock:
+            rows = self._reader_connection.execute(sql, parameters).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def lookup(
+        self,
+        image_hash: str,
+        query_hash: str,
+        user_id: Optional[str] = None,
+        max_age: Optional[float] = None,
+    ) -> Optional[list]:
+        """
+        Returns the most recent complete result for an image and query.
+
+        Args:
+            image_hash (str): The content hash of the image.
+            query_hash (str): The hash of the normalized query.
+            user_id (Optional[str]): Only consider results of this user. Defaults to any user.
+            max_age (Optional[float]): Only consider results at most this old, in seconds.
+
+        Returns:
+            Optional[list]: The stored updates, or None if there is no such result. Results that timed out
+                or ran out of budget are never returned.
+        """
+        sql = (
+            f"SELECT {', '.join(COLUMNS)} FROM results"
+            " WHERE image_hash = ? AND query_hash = ? AND timed_out = 0 AND over_budget = 0"
+        )
+        parameters: tuple = (image_hash, query_hash)
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            parameters += (user_id,)
+        if max_age is not None:
+            sql += " AND created_at >= ?"
+            parameters += (time.time() - max_age,)
+        sql += " ORDER BY created_at DESC LIMIT 1"
+
+        self.stats["lookups"] += 1
+        rows = self._query(sql, parameters)
+        if not rows:
+            return None
+        self.stats["hits"] += 1
+        return decode_results(rows[0]["results"])
+
+    def history(
+        self,
+        user_id: Optional[str] = None,
+        image_hash: Optional[str] = None,
+        query_hash: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[dict]:
+        """
+        Returns stored results matching the given filters, newest first.
+
+        Args:
+            user_id (Optional[str]): The user the requests belong to.
+            image_hash (Optional[str]): The content hash of the image.
+            query_hash (Optional[str]): The hash of the normalized query.
+            since (Optional[float]): The earliest creation time, as a Unix timestamp.
+            until (Optional[float]): The latest creation time, as a Unix timestamp.
+            limit (int): The most rows returned.
+
+        Returns:
+            List[dict]: One dict per result with the stored columns, the updates decoded from JSON.
+        """
+        filters = {
+            "user_id = ?": user_id,
+            "image_hash = ?": image_hash,
+            "query_hash = ?": query_hash,
+            "created_at >= ?": since,
+            "created_at <= ?": until,
+        }
+        conditions = [sql for sql, value in filters.items() if value is not None]
+        parameters = tuple(value for value in filters.values() if value is not None)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM results"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+
+        rows = self._query(sql, parameters + (limit,))
+        for row in rows:
+            row["results"] = decode_results(row["results"])
+            row["timed_out"] = bool(row["timed_out"])
+            row["over_budget"] = bool(row["over_budget"])
+        return rows
+
+    def close(self) -> None:
+        """
+        Commits the queued results, stops the writer and closes the database.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._writer_connection.close()
+        self._reader_connection.close()
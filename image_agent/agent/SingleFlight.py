@@ -0,0 +1,112 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Flight:
+    """
+    A single in-progress execution that duplicate callers can wait on.
+    """
+
+    def __init__(self) -> None:
+        self.done: threading.Event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    A class to collapse concurrent identical calls into a single execution.
+
+    The first caller for a key runs the function; callers arriving with the same key while it is running
+    wait for it and receive the same result (or exception). With a positive `result_ttl`, successful
+    results are also kept for that many seconds so that retries arriving just after completion are served
+    without re-running. Results rejected by the `cacheable` check passed to `do` are shared with the
+    callers already waiting but not kept.
+
+    Attributes:
+        result_ttl (float): How long successful results are cached, in seconds. 0 disables the cache.
+        stats (Dict[str, int]): Counts of executions, callers attached to an in-flight execution and
+            result cache hits.
+    """
+
+    def __init__(self, result_ttl: float = 0.0) -> None:
+        """
+        Initializes the SingleFlight with no executions in progress.
+
+        Args:
+            result_ttl (float): How long successful results are cached, in seconds. 0 disables the cache.
+        """
+        self.result_ttl: float = result_ttl
+        self.stats: Dict[str, int] = {"executions": 0, "shared": 0, "cache_hits": 0}
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _purge_expired(self, now: float) -> None:
+        """
+        Drops cached results whose time to live has passed. Must be called with the lock held.
+        """
+        expired = [key for key, (expires, _) in self._results.items() if expires <= now]
+        for key in expired:
+            del self._results[key]
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Any],
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Runs `fn` unless an identical call is already in flight or recently completed.
+
+        Args:
+            key (Hashable): The key that identifies identical calls.
+            fn (Callable[[], Any]): The function to run.
+            cacheable (Optional[Callable[[Any], bool]]): Decides whether a result may be kept for
+                `result_ttl`. Defaults to keeping every successful result.
+
+        Returns:
+            Any: The result of `fn`, possibly from another caller's execution.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._purge_expired(now)
+            if key in self._results:
+                self.stats["cache_hits"] += 1
+                return self._results[key][1]
+
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.stats["executions"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if (
+                    self.result_ttl > 0
+                    and flight.error is None
+                    and (cacheable is None or cacheable(flight.result))
+                ):
+                    self._results[key] = (
+                        time.monotonic() + self.result_ttl,
+                        flight.result,
+                    )
+            flight.done.set()
+        return flight.result
@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, Executor, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterable, Optional
+from image_agent.deadline import Deadline, DeadlineExceeded
+
+logger = logging.getLogger("SpeculativeVision")
+logger.setLevel(logging.INFO)
+
+
+class SpeculativeVision:
+    """
+    A class to run the most likely Florence tasks for a request in the background while it is planned.
+
+    One instance is created per request and carried in the agent state. `call_special_vision_node` takes
+    finished (or running) results from it before calling Florence itself, and tasks the plan does not use
+    are cancelled once the plan is structured: queued tasks never start and running tasks stop at their
+    next generation step, since each runs under its own cancellable deadline.
+
+    Only tasks that take no text input are speculated, so a speculative result is exactly what the plan's
+    step would have computed.
+
+    Attributes:
+        TEXT_FREE_TASKS (tuple): The Florence tasks whose output depends on the image alone.
+        stats (Dict[str, float]): Counts of submitted, started, used and cancelled tasks, and the seconds
+            saved.
+    """
+
+    TEXT_FREE_TASKS: tuple = ("general object detection", "image captioning", "OCR")
+
+    def __init__(
+        self,
+        caller: Any,
+        image: Any,
+        tasks: Iterable[str],
+        executor: Executor,
+        timeout: float,
+        deadline: Optional[Deadline] = None,
+    ) -> None:
+        """
+        Initializes the SpeculativeVision and submits its tasks to the executor.
+
+        Args:
+            caller (Any): The special vision caller.
+            image (Any): The request image.
+            tasks (Iterable[str]): The Florence tasks to speculate, most likely first.
+            executor (Executor): The background worker pool.
+            timeout (float): The longest a speculative task may run, in seconds.
+            deadline (Optional[Deadline]): The request deadline, which also bounds the speculative tasks.
+        """
+        self.caller: Any = caller
+        self.image: Any = image
+        self.stats: Dict[str, float] = {
+            "submitted": 0,
+            "started": 0,
+            "hits": 0,
+            "cancelled": 0,
+            "saved_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._deadlines: Dict[str, Deadline] = {}
+        self._timings: Dict[str, list] = {}
+        self._cancelled: set = set()
+
+        if deadline is not None:
+            timeout = min(timeout, deadline.remaining())
+        for task in tasks:
+            if task not in self.TEXT_FREE_TASKS or task in self._futures:
+                continue
+            self._deadlines[task] = Deadline(timeout)
+            self._timings[task] = [None, None]
+            self._futures[task] = executor.submit(self._run, task)
+            self.stats["submitted"] += 1
+
+    def _run(self, task: str) -> Any:
+        """
+        Runs one speculative task, recording when it started and finished.
+        """
+        timing = self._timings[task]
+        timing[0] = time.perf_counter()
+        with self._lock:
+            self.stats["started"] += 1
+        try:
+            return self.caller.call(
+                task_prompt=task, image=self.image, deadline=self._deadlines[task]
+            )
+        finally:
+            timing[1] = time.perf_counter()
+
+    def take(self, task: str, deadline: Optional[Deadline] = None) -> tuple:
+        """
+        Returns the speculative result of a task, waiting for it if it is still running.
+
+        Args:
+            task (str): The Florence task of the plan step.
+            deadline (Optional[Deadline]): The request deadline, which bounds the wait.
+
+        Returns:
+            tuple: Whether a result was available and the result.
+
+        Raises:
+            DeadlineExceeded: If the request deadline passes while waiting.
+        """
+        future = self._futures.get(task)
+        if future is None or future.cancelled():
+            return False, None
+
+        asked_at = time.perf_counter()
+        try:
+            output = future.result(
+                timeout=deadline.remaining() if deadline is not None else None
+            )
+        except FutureTimeoutError:
+            raise DeadlineExceeded("Request deadline passed waiting for a speculative result")
+        except (CancelledError, Exception) as e:
+            logger.info(f"Speculative {task} unavailable ({e!r}), calling Florence instead")
+            return False, None
+
+        started, finished = self._timings[task]
+        # the part of the task that ran before the plan asked for it is latency saved
+        saved = max(0.0, min(finished, asked_at) - started)
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += saved
+        return True, output
+
+    def keep_only(self, plan_structure: str) -> None:
+        """
+        Cancels the speculative tasks that a structured plan does not use.
+
+        Args:
+            plan_structure (str): The JSON plan structure produced by `structure_plan_node`.
+        """
+        used = {
+            step["tool_mode"]
+            for step in json.loads(plan_structure).values()
+            if step["tool_name"] == "special_vision"
+        }
+        self.cancel(task for task in self._futures if task not in used)
+
+    def cancel(self, tasks: Optional[Iterable[str]] = None) -> None:
+        """
+        Cancels speculative tasks that have not finished.
+
+        Args:
+            tasks (Optional[Iterable[str]]): The tasks to cancel. Defaults to all of them.
+        """
+        for task in list(tasks if tasks is not None else self._futures):
+            future = self._futures[task]
+            if future.done() or task in self._cancelled:
+                continue
+            self._cancelled.add(task)
+            if not future.cancel():
+                # already running, so stop its generation early
+                self._deadlines[task].cancel()
+            with self._lock:
+                self.stats["cancelled"] += 1
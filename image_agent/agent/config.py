@@ -3,3 +3,63 @@ dummy_agent_config = {
     "configurable": {"thread_id": "1", "user_id": dummy_user_id},
     "recursion_limit": 50,
 }
+
+# prompt compaction
+prompt_token_budget = 3000
+compaction_top_labels = 10
+compaction_max_boxes_per_label = 5
+compaction_max_text_tokens = 500
+
+# request deadlines, None disables them
+request_timeout = None
+deadline_low_fraction = 0.25
+
+# deduplication of identical concurrent requests
+single_flight = False
+single_flight_result_ttl = 0.0
+
+# dataset mode, applying one plan to many images
+dataset_batch_size = 8
+dataset_prefetch = 16
+dataset_decode_workers = 4
+dataset_vision_workers = 1
+dataset_max_image_width = 1024
+dataset_assess = "needed"
+
+# speculative Florence calls started while the request is being planned
+speculative_vision = False
+speculative_vision_tasks = ["general object detection", "image captioning"]
+speculative_vision_workers = 1
+speculative_vision_timeout = 60.0
+
+# durable store of completed results, None keeps only the in-memory store
+result_store_path = None
+result_store_batch_size = 64
+result_store_flush_interval = 1.0
+# serve repeated questions about the same image from the store if the stored answer is at most this old,
+# in seconds. None never serves from history
+result_store_max_age = None
+
+# run consecutive special vision steps of a plan together, encoding the image once. Ignored when early
+# exit is enabled, which needs to check the outputs after each step
+group_special_vision = True
+
+# early exit after each vision step, None disables it, "heuristic" checks the outputs locally and "llm"
+# asks a structured model call whether the remaining steps are needed
+early_exit = None
+
+# region-of-interest cropping of general vision inputs to the boxes of earlier specific object detections
+roi_vision = False
+roi_padding = 0.15
+roi_max_regions = 4
+roi_max_area_fraction = 0.6
+# crops are sent at their own size, scaled down to at most this many pixels (a 4:3 image at the default
+# 512px width) and up to at least this width
+roi_max_pixels = 512 * 384
+roi_min_width = 224
+
+# default per-request budget, None leaves a resource uncapped. The spend is reported either way
+budget_max_tokens = None
+budget_max_vision_calls = None
+budget_max_dollars = None
+budget_max_model_seconds = None
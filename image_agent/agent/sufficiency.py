@@ -0,0 +1,228 @@
+import json
+import re
+from typing import Dict, List, Set, Tuple
+
+# what a question asks for, recognised from its wording
+INTENT_PATTERNS: Dict[str, re.Pattern] = {
+    "text": re.compile(
+        r"\b(read|text|written|writing|says?|signs?|labels?|words?|ocr)\b", re.IGNORECASE
+    ),
+    "locate": re.compile(
+        r"\b(how many|count|number of|where|locate|find|detect|position)\b", re.IGNORECASE
+    ),
+    "describe": re.compile(
+        r"\b(describe|description|caption|what is in|what's in|what is happening|scene)\b",
+        re.IGNORECASE,
+    ),
+}
+
+# sentence ends, and conjunctions that start a new request ("... and tell me what they are doing")
+CLAUSE_BOUNDARY = re.compile(
+    r"[.?!;]+|\b(?:and|also|then)\s+(?=(?:tell|what|how|where|who|which|why|is|are|does|do|describe"
+    r"|read|count|find)\b)",
+    re.IGNORECASE,
+)
+
+# words of a locating clause that do not name what is to be located
+NON_OBJECT_WORDS: Set[str] = set(
+    """
+    a all an any are can count detect do does each every find for how i image in is it locate many me
+    number of on photo picture please position see show the their there these they this those to what
+    where which you
+    """.split()
+)
+
+# words that ask for every object, which any detection answers
+GENERIC_OBJECT_WORDS: Set[str] = {"object", "thing", "item"}
+
+IRREGULAR_PLURALS: Dict[str, str] = {
+    "people": "person",
+    "men": "man",
+    "women": "woman",
+    "children": "child",
+    "mice": "mouse",
+    "feet": "foot",
+    "teeth": "tooth",
+}
+
+# text the question quotes, e.g. does the sign say "stop"
+QUOTED_TEXT = re.compile(r"[\"\u201c]([^\"\u201d]+)[\"\u201d]|'([^']+)'")
+
+
+def noun_forms(word: str) -> Set[str]:
+    """
+    Returns the word and its possible singular forms, so that "boxes" and "box" or "people" and "person"
+    share a form.
+    """
+    forms = {word}
+    if word in IRREGULAR_PLURALS:
+        forms.add(IRREGULAR_PLURALS[word])
+    if word.endswith("ies"):
+        forms.add(word[:-3] + "y")
+    if word.endswith("es"):
+        forms.add(word[:-2])
+    if word.endswith("s"):
+        forms.add(word[:-1])
+    return forms
+
+
+def word_forms(text: str, exclude: Set[str] = frozenset()) -> Set[str]:
+    """
+    Returns the forms of every lower case word of the text that is not excluded.
+    """
+    return set().union(
+        *(noun_forms(word) for word in re.findall(r"[a-z]+", text.lower()) if word not in exclude)
+    )
+
+
+def query_clauses(query: str) -> List[str]:
+    """
+    Splits a query into the clauses that each ask for one thing.
+
+    Args:
+        query (str): The user question.
+
+    Returns:
+        List[str]: The non-empty clauses.
+    """
+    return [c for c in CLAUSE_BOUNDARY.split(query) if c.strip(" ,")]
+
+
+def query_intents(query: str) -> List[Set[str]]:
+    """
+    Recognises what each clause of a query asks for.
+
+    Args:
+        query (str): The user question.
+
+    Returns:
+        List[Set[str]]: The intents of each clause. A clause with no recognised intent gets an empty set.
+    """
+    return [
+        {intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(clause)}
+        for clause in query_clauses(query)
+    ]
+
+
+def clause_objects(clause: str) -> Set[str]:
+    """
+    Finds the words of a locating clause that name what is to be located.
+
+    Args:
+        clause (str): One clause of the user question.
+
+    Returns:
+        Set[str]: The forms of the object words, e.g. {"cats", "cat"} for "how many cats are there".
+    """
+    return word_forms(clause, exclude=NON_OBJECT_WORDS)
+
+
+def output_labels(tool_mode: str, raw_output: str) -> List[str]:
+    """
+    Returns the labels of a detection output, or the lines read by an OCR output.
+
+    Args:
+        tool_mode (str): The mode the tool was called in.
+        raw_output (str): The output as stored in the plan output.
+
+    Returns:
+        List[str]: The non-empty labels. Empty for other modes.
+    """
+    if tool_mode not in ("OCR", "general object detection", "specific object detection"):
+        return []
+    try:
+        output = json.loads(raw_output)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(output, dict):
+        return []
+    labels = [str(label).replace("</s>", "").strip() for label in output.get("labels", [])]
+    return [label for label in labels if label]
+
+
+def output_intents(tool_mode: str, raw_output: str) -> Set[str]:
+    """
+    Determines which intents a step's output answers.
+
+    Args:
+        tool_mode (str): The mode the tool was called in.
+        raw_output (str): The output as stored in the plan output.
+
+    Returns:
+        Set[str]: The intents the output answers. Empty outputs answer nothing.
+    """
+    try:
+        output = json.loads(raw_output)
+    except (TypeError, ValueError):
+        output = raw_output
+
+    if tool_mode in ("image captioning", "conversation"):
+        return {"describe"} if isinstance(output, str) and output.strip() else set()
+    if not isinstance(output, dict):
+        return set()
+    if tool_mode == "OCR":
+        labels = [label.replace("</s>", "").strip() for label in output.get("labels", [])]
+        return {"text"} if any(labels) else set()
+    if tool_mode in ("general object detection", "specific object detection"):
+        return {"locate"} if output.get("bboxes") else set()
+    return set()
+
+
+def heuristic_sufficiency(
+    query: str, plan_structure: str, plan_output: List[Dict[int, str]], current_step: int
+) -> Tuple[bool, str]:
+    """
+    Decides, without a model, whether the outputs of the steps run so far already answer the query.
+
+    The check is deliberately conservative: every clause of the query must ask for something it
+    recognises (reading text, locating or counting objects, describing the scene), and each of those must
+    be covered by a non-empty output of the current plan. A locating clause is only covered by detections
+    whose labels or grounded phrases name one of the objects it asks about, and a clause quoting text only
+    by OCR output that contains it. Anything else, such as a question about the weather, is left to the
+    remaining steps and the full assessment.
+
+    Args:
+        query (str): The user question.
+        plan_structure (str): The JSON plan structure of the current plan.
+        plan_output (List[Dict[int, str]]): The plan outputs accumulated in the agent state.
+        current_step (int): The last step of the current plan that has run.
+
+    Returns:
+        Tuple[bool, str]: Whether the query is answered, and the reason.
+    """
+    intents = query_intents(query)
+    if not intents or not all(intents):
+        return False, "Part of the question is not recognised by the heuristic"
+
+    steps = json.loads(plan_structure)
+    covered: Set[str] = set()
+    detected: Set[str] = set()
+    read_text = []
+    # the last entries belong to the current plan, one per step run so far
+    for entry in plan_output[-current_step:]:
+        for step, raw_output in entry.items():
+            tool_mode = steps[str(step)]["tool_mode"]
+            covered |= output_intents(tool_mode, raw_output)
+            labels = output_labels(tool_mode, raw_output)
+            if tool_mode == "OCR":
+                read_text.extend(label.lower() for label in labels)
+            else:
+                detected |= set().union(*map(word_forms, labels))
+
+    missing = set().union(*intents) - covered
+    for clause, clause_intents in zip(query_clauses(query), intents):
+        if "locate" in clause_intents:
+            objects = clause_objects(clause)
+            if not objects or not (
+                objects & detected or (objects & GENERIC_OBJECT_WORDS and detected)
+            ):
+                missing.add("locate")
+        if "text" in clause_intents:
+            quoted = [a or b for a, b in QUOTED_TEXT.findall(clause)]
+            if any(
+                not any(text.lower() in line for line in read_text) for text in quoted
+            ):
+                missing.add("text")
+    if missing:
+        return False, f"No output yet for: {', '.join(sorted(missing))}"
+    return True, f"The outputs so far cover: {', '.join(sorted(covered))}"
@@ -0,0 +1,485 @@
+"""
+Dataset mode for the agent.
+
+Asks the same question of every image in a directory or stream (e.g. sampled video frames). The query is
+planned once, then images are decoded and resized on a thread pool ahead of the vision steps, Florence
+steps run in batches and one JSON line is written per image as soon as it is done. Only images whose
+outputs look insufficient are assessed, and only those the assessment rejects are replanned.
+
+    python -m image_agent.dataset --images example_images --query "How many dogs are there?" --output dogs.jsonl
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterator, List, Optional, Tuple
+from PIL import Image
+from image_agent.agent.config import (
+    dummy_agent_config,
+    dataset_batch_size,
+    dataset_prefetch,
+    dataset_decode_workers,
+    dataset_vision_workers,
+    dataset_max_image_width,
+    dataset_assess,
+)
+from image_agent.image_tools import resize_maintain_aspect
+
+logger = logging.getLogger("DatasetRunner")
+logger.setLevel(logging.INFO)
+
+IMAGE_EXTENSIONS: tuple = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+
+def list_images(directory: str) -> List[str]:
+    """
+    Lists the image files in a directory, sorted by name.
+
+    Args:
+        directory (str): The directory to list.
+
+    Returns:
+        List[str]: The paths of the image files.
+    """
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def load_image(source: Any, max_width: Optional[int] = None) -> Image.Image:
+    """
+    Decodes an image and shrinks it to a maximum width, keeping its aspect ratio.
+
+    Args:
+        source (Any): An image path or an already opened PIL image.
+        max_width (Optional[int]): The maximum width. None keeps the original size.
+
+    Returns:
+        Image.Image: The decoded RGB image.
+    """
+    image = Image.open(source) if isinstance(source, (str, os.PathLike)) else source
+    image = image.convert("RGB")
+    if max_width is not None and image.width > max_width:
+        image = resize_maintain_aspect(image, max_width)
+    return image
+
+
+def is_empty_output(output: Any) -> bool:
+    """
+    Checks whether a vision step produced nothing, e.g. no boxes or an empty caption.
+
+    Args:
+        output (Any): The output of a vision call.
+
+    Returns:
+        bool: True if the output holds no information.
+    """
+    if isinstance(output, dict):
+        return all(is_empty_output(value) for value in output.values())
+    if isinstance(output, (list, tuple, str)):
+        return len(output) == 0 or (isinstance(output, str) and not output.strip())
+    return output is None
+
+
+class DatasetRunner:
+    """
+    A class to apply one plan to many images, running the agent's full loop only where it is needed.
+
+    Attributes:
+        agent (Any): The agent whose models and nodes are used.
+        batch_size (int): The number of images in each batch of vision calls.
+        prefetch (int): The number of images decoded ahead of the vision steps.
+        decode_workers (int): The number of threads decoding and resizing images.
+        vision_workers (int): The number of concurrent general vision calls. Local models should use 1.
+        max_image_width (Optional[int]): Images wider than this are shrunk before any model sees them.
+        assess (str): "needed" assesses only images with failed or empty steps, "all" assesses every
+            image and "none" never assesses or replans.
+        max_planning_steps (int): The planning limit for images that are replanned.
+        config (dict): Configuration options for the agent.
+        stats (dict): Counts of images, errors, assessments and replans, and the total time.
+    """
+
+    ASSESS_MODES: tuple = ("needed", "all", "none")
+
+    def __init__(
+        self,
+        agent: Any,
+        batch_size: int = dataset_batch_size,
+        prefetch: int = dataset_prefetch,
+        decode_workers: int = dataset_decode_workers,
+        vision_workers: int = dataset_vision_workers,
+        max_image_width: Optional[int] = dataset_max_image_width,
+        assess: str = dataset_assess,
+        max_planning_steps: int = 2,
+        config: dict = dummy_agent_config,
+    ) -> None:
+        """
+        Initializes the DatasetRunner.
+
+        Args:
+            agent (Any): The agent whose models and nodes are used.
+            batch_size (int): The number of images in each batch of vision calls.
+            prefetch (int): The number of images decoded ahead of the vision steps.
+            decode_workers (int): The number of threads decoding and resizing images.
+            vision_workers (int): The number of concurrent general vision calls.
+            max_image_width (Optional[int]): Images wider than this are shrunk. None keeps every size.
+            assess (str): Which images are assessed, one of "needed", "all" or "none".
+            max_planning_steps (int): The planning limit for images that are replanned.
+            config (dict): Configuration options for the agent.
+        """
+        if assess not in self.ASSESS_MODES:
+            raise ValueError("Assess mode must be needed, all or none")
+        self.agent: Any = agent
+        self.batch_size: int = batch_size
+        self.prefetch: int = max(prefetch, batch_size)
+        self.decode_workers: int = decode_workers
+        self.vision_workers: int = vision_workers
+        self.max_image_width: Optional[int] = max_image_width
+        self.assess: str = assess
+        self.max_planning_steps: int = max_planning_steps
+        self.config: dict = config
+        self.stats: dict = {
+            "images": 0,
+            "errors": 0,
+            "assessed": 0,
+            "replanned": 0,
+            "seconds": 0.0,
+        }
+
+    def plan(self, query: str) -> dict:
+        """
+        Plans the query once for the whole dataset.
+
+        Args:
+            query (str): The query asked of every image.
+
+        Returns:
+            dict: The planning state, with the plan, its structure and the number of steps.
+        """
+        state: dict = {"task": query}
+        if self.agent.plan_templates is not None:
+            template_state = self.agent.plan_templates.plan_state(query)
+            if template_state is not None:
+                state.update(template_state)
+                logger.info(f"Dataset plan from a template has {state['max_steps']} steps")
+                return state
+        state.update(self.agent.nodes.plan_node(state))
+        state.update(self.agent.nodes.structure_plan_node(state))
+        logger.info(f"Dataset plan has {state['max_steps']} steps")
+        return state
+
+    @staticmethod
+    def iter_sources(source: Any) -> Iterator[Tuple[str, Any]]:
+        """
+        Enumerates the images of a dataset.
+
+        Args:
+            source (Any): A directory, or an iterable of image paths, PIL images or (id, image) pairs.
+
+        Returns:
+            Iterator[Tuple[str, Any]]: The id and the path or image of each item.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            for path in list_images(source):
+                yield path, path
+            return
+        for i, entry in enumerate(source):
+            if isinstance(entry, tuple):
+                yield str(entry[0]), entry[1]
+            elif isinstance(entry, (str, os.PathLike)):
+                yield str(entry), entry
+            else:
+                yield str(i), entry
+
+    def iter_images(self, source: Any) -> Iterator[dict]:
+        """
+        Decodes and resizes images on a thread pool, keeping up to `prefetch` images in flight.
+
+        Args:
+            source (Any): The dataset, as accepted by `iter_sources`.
+
+        Returns:
+            Iterator[dict]: An item with its id and image, or the decoding error, in dataset order.
+        """
+        with ThreadPoolExecutor(self.decode_workers) as pool:
+            pending: deque = deque()
+            for item_id, entry in self.iter_sources(source):
+                pending.append(
+                    (item_id, pool.submit(load_image, entry, self.max_image_width))
+                )
+                if len(pending) >= self.prefetch:
+                    yield self._resolve(*pending.popleft())
+            while pending:
+                yield self._resolve(*pending.popleft())
+
+    @staticmethod
+    def _resolve(item_id: str, future: Future) -> dict:
+        """
+        Waits for a decoded image and wraps it in a dataset item.
+        """
+        item: dict = {"id": item_id, "image": None, "plan_output": [], "errors": {}}
+        try:
+            item["image"] = future.result()
+        except Exception as e:
+            item["errors"]["load"] = repr(e)
+        return item
+
+    def iter_batches(self, source: Any) -> Iterator[List[dict]]:
+        """
+        Groups the decoded images into batches.
+
+        Args:
+            source (Any): The dataset, as accepted by `iter_sources`.
+
+        Returns:
+            Iterator[List[dict]]: Lists of up to `batch_size` items.
+        """
+        batch: List[dict] = []
+        for item in self.iter_images(source):
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _call_special_vision(self, step: dict, images: list) -> list:
+        """
+        Runs a Florence step on a batch of images, one image at a time if batching is unavailable or fails.
+
+        Returns:
+            list: The output, or the raised exception, for each image.
+        """
+        caller = self.agent.specialist_vision
+        text_input = step["tool_input"] or None
+        call_batch = getattr(caller, "call_batch", None)
+        if call_batch is not None and len(images) > 1:
+            try:
+                return call_batch(
+                    task_prompt=step["tool_mode"], images=images, text_input=text_input
+                )
+            except Exception as e:
+                logger.warning(f"Batched {step['tool_mode']} failed, retrying per image: {e}")
+
+        outputs = []
+        for image in images:
+            try:
+                outputs.append(
+                    caller.call(
+                        task_prompt=step["tool_mode"], image=image, text_input=text_input
+                    )
+                )
+            except Exception as e:
+                outputs.append(e)
+        return outputs
+
+    def _call_general_vision(self, step: dict, images: list) -> list:
+        """
+        Runs a general vision step on a batch of images, `vision_workers` at a time.
+
+        Returns:
+            list: The output, or the raised exception, for each image.
+        """
+
+        def call(image: Any) -> Any:
+            try:
+                return self.agent.general_vision.call(query=step["tool_input"], image=image)
+            except Exception as e:
+                return e
+
+        if self.vision_workers <= 1:
+            return [call(image) for image in images]
+        with ThreadPoolExecutor(self.vision_workers) as pool:
+            return list(pool.map(call, images))
+
+    def run_steps(self, plan_state: dict, batch: List[dict]) -> None:
+        """
+        Runs every step of the plan on a batch, adding the outputs to each item.
+
+        Args:
+            plan_state (dict): The planning state returned by `plan`.
+            batch (List[dict]): The items of the batch.
+        """
+        items = [item for item in batch if item["image"] is not None]
+        if not items:
+            return
+        images = [item["image"] for item in items]
+        plan_structure = json.loads(plan_state["plan_structure"])
+
+        for step_number in range(1, plan_state["max_steps"] + 1):
+            step = plan_structure[str(step_number)]
+            if step["tool_name"] == "special_vision":
+                outputs = self._call_special_vision(step, images)
+            else:
+                outputs = self._call_general_vision(step, images)
+
+            for item, output in zip(items, outputs):
+                if isinstance(output, Exception):
+                    item["errors"][step_number] = repr(output)
+                    continue
+                # formatted as the graph's vision nodes do
+                formatted = (
+                    json.dumps(output)
+                    if step["tool_name"] == "special_vision"
+                    else str(output)
+                )
+                item["plan_output"].append({step_number: formatted})
+                if is_empty_output(output):
+                    item["empty_steps"] = item.get("empty_steps", 0) + 1
+
+    def needs_assessment(self, item: dict) -> bool:
+        """
+        Decides whether an item's outputs should be assessed.
+
+        Args:
+            item (dict): The item, after its steps have run.
+
+        Returns:
+            bool: True if the item should be assessed.
+        """
+        if self.assess == "none":
+            return False
+        if self.assess == "all":
+            return True
+        return bool(item["errors"]) or bool(item.get("empty_steps")) or not item["plan_output"]
+
+    def finish(self, query: str, plan_state: dict, item: dict) -> dict:
+        """
+        Assesses and replans an item if needed, then builds its result record.
+
+        Args:
+            query (str): The query asked of every image.
+            plan_state (dict): The planning state returned by `plan`.
+            item (dict): The item, after its steps have run.
+
+        Returns:
+            dict: The result record of the item.
+        """
+        record: dict = {
+            "id": item["id"],
+            "query": query,
+            "image_size": list(item["image"].size) if item["image"] is not None else None,
+            "plan_version": plan_state.get("plan_version", 1),
+            "final_result": item["plan_output"],
+            "answer_assessment": None,
+            "answer_flag": None,
+            "assessed": False,
+            "replanned": False,
+            "errors": item["errors"],
+        }
+        if item["image"] is None or not self.needs_assessment(item):
+            return record
+
+        self.stats["assessed"] += 1
+        assessment = self.agent.nodes.assessment_node(
+            {"task": query, "plan": plan_state["plan"], "plan_output": item["plan_output"]}
+        )
+        record["assessed"] = True
+        record["answer_assessment"] = assessment.get("answer_assessment")
+        record["answer_flag"] = assessment.get("answer_flag", 0)
+        if record["answer_flag"]:
+            return record
+
+        self.stats["replanned"] += 1
+        record["replanned"] = True
+        results = self.agent.replan(
+            query,
+            item["image"],
+            plan=plan_state["plan"],
+            feedback=record["answer_assessment"] or "",
+            config=self.config,
+            max_planning_steps=self.max_planning_steps,
+        )
+        for update in results:
+            for node, values in update.items():
+                values = values or {}
+                if node == "planning" and "plan_version" in values:
+                    record["plan_version"] = values["plan_version"]
+                elif node == "assessment":
+                    record["answer_flag"] = values.get("answer_flag", 0)
+                elif node == "response":
+                    record["final_result"] = values.get("final_result", [])
+                    record["answer_assessment"] = values.get("answer_assessment")
+        return record
+
+    def iter_results(self, query: str, source: Any) -> Iterator[dict]:
+        """
+        Runs the query on every image of a dataset, yielding each result as soon as it is done.
+
+        Args:
+            query (str): The query asked of every image.
+            source (Any): A directory, or an iterable of image paths, PIL images or (id, image) pairs.
+
+        Returns:
+            Iterator[dict]: The result record of each image, in dataset order.
+        """
+        start = time.perf_counter()
+        plan_state = self.plan(query)
+        for batch in self.iter_batches(source):
+            self.run_steps(plan_state, batch)
+            for item in batch:
+                record = self.finish(query, plan_state, item)
+                self.stats["images"] += 1
+                self.stats["errors"] += int(bool(record["errors"]))
+                self.stats["seconds"] = round(time.perf_counter() - start, 3)
+                yield record
+
+    def run(self, query: str, source: Any, output_path: Optional[str] = None) -> dict:
+        """
+        Runs the query on every image of a dataset, writing one JSON line per image as it completes.
+
+        Args:
+            query (str): The query asked of every image.
+            source (Any): A directory, or an iterable of image paths, PIL images or (id, image) pairs.
+            output_path (Optional[str]): The JSON Lines file to write. None only collects the stats.
+
+        Returns:
+            dict: The run stats.
+        """
+        f = open(output_path, "w", encoding="utf-8") if output_path else None
+        try:
+            for record in self.iter_results(query, source):
+                if f is not None:
+                    f.write(json.dumps(record, default=str) + "\n")
+                    f.flush()
+        finally:
+            if f is not None:
+                f.close()
+        logger.info(f"Dataset run stats: {self.stats}")
+        return self.stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ask one question of every image in a directory.")
+    parser.add_argument("--images", required=True)
+    parser.add_argument("--query", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--vision-mode", default="gpt")
+    parser.add_argument("--batch-size", type=int, default=dataset_batch_size)
+    parser.add_argument("--vision-workers", type=int, default=dataset_vision_workers)
+    parser.add_argument("--assess", choices=DatasetRunner.ASSESS_MODES, default=dataset_assess)
+    args = parser.parse_args()
+
+    from image_agent.agent.Agent import Agent
+    from image_agent.utils import load_secrets
+
+    agent = Agent(
+        openai_api_key=load_secrets()["OPENAI_API_KEY"], vision_mode=args.vision_mode
+    )
+    runner = DatasetRunner(
+        agent,
+        batch_size=args.batch_size,
+        vision_workers=args.vision_workers,
+        assess=args.assess,
+    )
+    print(json.dumps(runner.run(args.query, args.images, args.output), indent=2))
+
+
+if __name__ == "__main__":
+    main()
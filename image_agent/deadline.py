@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request runs past its deadline."""
+
+
+class Deadline:
+    """
+    A class to represent the end-to-end deadline of a single agent request.
+
+    The deadline is measured on the monotonic clock. It is considered "low" once less than `low_fraction`
+    of the original timeout remains, at which point the agent switches to cheaper decoding and stops
+    replanning.
+
+    Attributes:
+        timeout (float): The total time allowed for the request, in seconds.
+        low_fraction (float): The fraction of the timeout below which the remaining budget counts as low.
+        expires_at (float): The monotonic time at which the deadline passes.
+    """
+
+    def __init__(self, timeout: float, low_fraction: float = 0.25) -> None:
+        """
+        Initializes the Deadline, starting the clock immediately.
+
+        Args:
+            timeout (float): The total time allowed for the request, in seconds.
+            low_fraction (float): The fraction of the timeout below which the remaining budget counts as low.
+        """
+        self.timeout: float = timeout
+        self.low_fraction: float = low_fraction
+        self.expires_at: float = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """
+        Returns the time left before the deadline, in seconds. Never negative.
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        """
+        Returns True once the deadline has passed.
+        """
+        return time.monotonic() >= self.expires_at
+
+    def is_low(self) -> bool:
+        """
+        Returns True when less than `low_fraction` of the timeout remains.
+        """
+        return self.remaining() < self.low_fraction * self.timeout
+
+    def check(self) -> None:
+        """
+        Raises DeadlineExceeded if the deadline has passed.
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"Request exceeded its {self.timeout:.1f}s deadline")
+
+    def cancel(self) -> None:
+        """
+        Expires the deadline immediately, so that calls honouring it stop as soon as they next check.
+        """
+        self.expires_at = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"Deadline(timeout={self.timeout}, remaining={self.remaining():.2f})"
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "image_agent_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """
+    Returns the deadline of the backend call currently in progress, if any.
+
+    This is how layers without an explicit deadline argument, such as the shared HTTP transport,
+    find out how long they may take.
+    """
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Makes `deadline` the current deadline for the duration of the block.
+
+    Args:
+        deadline (Optional[Deadline]): The deadline to apply. None leaves the block unbounded.
+
+    Yields:
+        Optional[Deadline]: The deadline in effect.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
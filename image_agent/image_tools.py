@@ -1,6 +1,5 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 import base64
+import hashlib
 from io import BytesIO
 from PIL import Image
 
@@ -17,6 +16,14 @@ def convert_PIL_to_base64(image: Image, format="jpeg"):
     return base64_encoded.decode("utf-8")
 
 
+def hash_image(image: Image) -> str:
+    # hash the decoded pixels so that the same image gets the same key however it was encoded
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
 def resize_maintain_aspect(image: Image, new_width: int):
     old_w, old_h = image.size
     ratio = new_width / old_w
@@ -26,6 +33,10 @@ def resize_maintain_aspect(image: Image, new_width: int):
 
 
 def plot_bbox(image, data):
+    # matplotlib is slow to import and only needed for plotting
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+
     fig, ax = plt.subplots()
     ax.imshow(image)
     for bbox, label in zip(data["bboxes"], data["labels"]):
@@ -44,3 +55,86 @@ def plot_bbox(image, data):
         )
     ax.axis("off")
     return fig
+
+
+def pad_box(box: list, padding: float, image_size: tuple) -> tuple:
+    # grow the box by a fraction of its size on every side, so the crop keeps some context
+    x1, y1, x2, y2 = box
+    pad_x, pad_y = padding * (x2 - x1), padding * (y2 - y1)
+    width, height = image_size
+    return (
+        max(0, int(x1 - pad_x)),
+        max(0, int(y1 - pad_y)),
+        min(width, int(x2 + pad_x) + 1),
+        min(height, int(y2 + pad_y) + 1),
+    )
+
+
+def box_area(box: tuple) -> float:
+    return max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+
+
+def union_box(boxes: list) -> tuple:
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+def tile_images(images: list, gap: int = 8, background: tuple = (128, 128, 128)) -> Image:
+    # place the images side by side, top aligned, separated by a neutral gap
+    width = sum(image.width for image in images) + gap * (len(images) - 1)
+    height = max(image.height for image in images)
+    mosaic = Image.new("RGB", (width, height), background)
+    x = 0
+    for image in images:
+        mosaic.paste(image.convert("RGB"), (x, 0))
+        x += image.width + gap
+    return mosaic
+
+
+def crop_regions(
+    image: Image,
+    boxes: list,
+    padding: float,
+    max_regions: int,
+    max_area_fraction: float,
+) -> tuple:
+    """
+    Crops an image to the regions of interest given by detection boxes.
+
+    Regions close together are cropped as one, padded rectangle around all of them. Regions far apart are
+    cropped separately, the largest first, and tiled side by side so that the background between them is
+    not sent.
+
+    Args:
+        image (Image): The full image.
+        boxes (list): The [x1, y1, x2, y2] boxes of the regions, in pixels of the full image.
+        padding (float): The context kept around each box, as a fraction of its size.
+        max_regions (int): The most regions tiled when they are cropped separately.
+        max_area_fraction (float): The largest share of the image a crop may cover to be worth sending
+            instead of the full image.
+
+    Returns:
+        tuple: The cropped image and the padded boxes used, or None and an empty list if cropping would
+            not save enough.
+    """
+    padded = [pad_box(box, padding, image.size) for box in boxes]
+    padded = [box for box in padded if box_area(box) > 0]
+    if not padded:
+        return None, []
+
+    image_area = image.width * image.height
+    union = union_box(padded)
+    # a single crop is better unless it is mostly background between separate regions
+    if len(padded) == 1 or box_area(union) <= 1.5 * sum(box_area(box) for box in padded):
+        if box_area(union) > max_area_fraction * image_area:
+            return None, []
+        return image.crop(union), [union]
+
+    padded = sorted(padded, key=box_area, reverse=True)[:max_regions]
+    if sum(box_area(box) for box in padded) > max_area_fraction * image_area:
+        return None, []
+    return tile_images([image.crop(box) for box in padded]), padded
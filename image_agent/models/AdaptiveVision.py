@@ -0,0 +1,347 @@
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from image_agent.deadline import Deadline, DeadlineExceeded
+from image_agent.models.HTTPClient import LatencyTracker
+from image_agent.models.config import (
+    adaptive_vision_slo,
+    adaptive_vision_quantile,
+    adaptive_vision_min_samples,
+    adaptive_vision_default_latency,
+    adaptive_vision_max_concurrency,
+    adaptive_vision_error_cooldown,
+    adaptive_vision_window,
+)
+
+logger = logging.getLogger("AdaptiveVision")
+logger.setLevel(logging.INFO)
+
+
+class BackendStats:
+    """
+    A class to keep live latency, queue depth and error statistics for one general vision backend.
+
+    Attributes:
+        latencies (LatencyTracker): The latencies of the most recent successful calls.
+        default_latency (float): The latency assumed until enough calls have been measured.
+        max_concurrency (int): The number of calls the backend serves at once. Further calls queue.
+        depth (int): The number of calls running or queued on the backend.
+        routed (int): The number of steps first routed to the backend.
+        calls (int): The number of calls made to the backend, including fallbacks.
+        errors (int): The number of failed calls.
+        last_error (float): The monotonic time of the last failure.
+        penalty (float): The latency assumed after a failed or timed-out call, until `penalty_until`.
+        penalty_until (float): The monotonic time at which the penalty expires.
+    """
+
+    def __init__(
+        self, default_latency: float, max_concurrency: int, window_size: int
+    ) -> None:
+        """
+        Initializes the BackendStats.
+
+        Args:
+            default_latency (float): The latency assumed until enough calls have been measured.
+            max_concurrency (int): The number of calls the backend serves at once.
+            window_size (int): The number of recent latencies kept.
+        """
+        self.latencies: LatencyTracker = LatencyTracker(window_size)
+        self.default_latency: float = default_latency
+        self.max_concurrency: int = max_concurrency
+        self.depth: int = 0
+        self.routed: int = 0
+        self.calls: int = 0
+        self.errors: int = 0
+        self.last_error: float = float("-inf")
+        self.penalty: float = 0.0
+        self.penalty_until: float = float("-inf")
+        self.slots: threading.Semaphore = threading.Semaphore(max_concurrency)
+
+    def penalize(self, latency: float, duration: float) -> None:
+        """
+        Assumes at least the given latency for the backend for a while after a failed or timed-out call.
+
+        The penalty is kept out of the latency window and expires, since a backend that is predicted to
+        miss the SLO is no longer routed to and so would never record the calls that replace it.
+
+        Args:
+            latency (float): The latency assumed.
+            duration (float): How long the penalty lasts, in seconds.
+        """
+        self.penalty = latency
+        self.penalty_until = time.monotonic() + duration
+
+    def service_time(self, quantile: float, min_samples: int) -> float:
+        """
+        Estimates the time the backend takes to serve one call once it starts, or the failure penalty if
+        that is larger and has not expired.
+
+        Args:
+            quantile (float): The latency quantile used once enough calls have been measured.
+            min_samples (int): The number of measured calls needed to trust the quantile.
+
+        Returns:
+            float: The estimated service time, in seconds.
+        """
+        penalty = self.penalty if time.monotonic() < self.penalty_until else 0.0
+        measured = self.latencies.quantile(quantile, min_samples)
+        if measured is not None:
+            return max(measured, penalty)
+        # too few samples for a tail quantile, so never be more optimistic than the default
+        median = self.latencies.quantile(0.5)
+        return max(self.default_latency, median or 0.0, penalty)
+
+    def expected_latency(self, quantile: float, min_samples: int) -> float:
+        """
+        Estimates the latency of a new call, including the time spent queued behind calls in progress.
+
+        Args:
+            quantile (float): The latency quantile used once enough calls have been measured.
+            min_samples (int): The number of measured calls needed to trust the quantile.
+
+        Returns:
+            float: The estimated latency, in seconds.
+        """
+        service_time = self.service_time(quantile, min_samples)
+        queued_ahead = max(0, self.depth - self.max_concurrency + 1)
+        return service_time * (1 + queued_ahead / self.max_concurrency)
+
+
+class AdaptiveVisionRouter:
+    """
+    A class to route each general vision call to the backend expected to meet a latency SLO.
+
+    Backends are tried in preference order and the first whose expected latency, at the configured
+    quantile and including its queue, fits within the SLO (or the time left before the request deadline)
+    is chosen. If none fits, the backend with the lowest expected latency is chosen. A backend that
+    fails is skipped for a cooldown period and the call falls back to the next backend. A failed or
+    timed-out call also raises the backend's expected latency for the same period, after which it is
+    judged on its measured calls again.
+
+    Attributes:
+        backends (Dict[str, Any]): The general vision callers, in preference order.
+        slo (float): The latency objective for a general vision call, in seconds.
+        quantile (float): The latency quantile compared against the SLO.
+        min_samples (int): The number of measured calls needed to trust a backend's quantile.
+        error_cooldown (float): How long a failed backend is skipped, in seconds.
+        stats (Dict[str, BackendStats]): The live statistics of each backend.
+        decisions (Counter): Counts of routing decisions by reason.
+        FAILURE_PENALTY (float): The multiple of the SLO assumed as the latency of a backend whose last call
+            failed, until its cooldown ends.
+    """
+
+    FAILURE_PENALTY: float = 2.0
+
+    def __init__(
+        self,
+        backends: Dict[str, Any],
+        slo: float = adaptive_vision_slo,
+        quantile: float = adaptive_vision_quantile,
+        min_samples: int = adaptive_vision_min_samples,
+        default_latency: Optional[Dict[str, float]] = None,
+        max_concurrency: Optional[Dict[str, int]] = None,
+        error_cooldown: float = adaptive_vision_error_cooldown,
+        window_size: int = adaptive_vision_window,
+    ) -> None:
+        """
+        Initializes the AdaptiveVisionRouter.
+
+        Args:
+            backends (Dict[str, Any]): The general vision callers, keyed by name in preference order.
+            slo (float): The latency objective for a general vision call, in seconds.
+            quantile (float): The latency quantile compared against the SLO.
+            min_samples (int): The number of measured calls needed to trust a backend's quantile.
+            default_latency (Optional[Dict[str, float]]): The latency assumed for each backend until it has
+                been measured. Defaults to the values in the models config.
+            max_concurrency (Optional[Dict[str, int]]): The number of calls each backend serves at once.
+                Defaults to the values in the models config.
+            error_cooldown (float): How long a failed backend is skipped, in seconds.
+            window_size (int): The number of recent latencies kept for each backend.
+        """
+        if not backends:
+            raise ValueError("At least one general vision backend is needed")
+        default_latency = {**adaptive_vision_default_latency, **(default_latency or {})}
+        max_concurrency = {**adaptive_vision_max_concurrency, **(max_concurrency or {})}
+        self.backends: Dict[str, Any] = backends
+        self.slo: float = slo
+        self.quantile: float = quantile
+        self.min_samples: int = min_samples
+        self.error_cooldown: float = error_cooldown
+        self.stats: Dict[str, BackendStats] = {
+            name: BackendStats(
+                default_latency.get(name, slo),
+                max_concurrency.get(name, 1),
+                window_size,
+            )
+            for name in backends
+        }
+        self.decisions: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def expected_latency(self, name: str) -> float:
+        """
+        Estimates the latency of a new call on a backend.
+        """
+        return self.stats[name].expected_latency(self.quantile, self.min_samples)
+
+    def _cooling_down(self, name: str) -> bool:
+        return time.monotonic() - self.stats[name].last_error < self.error_cooldown
+
+    def route(self, deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Orders the backends for a call, the chosen backend first and the fallbacks after it.
+
+        Args:
+            deadline (Optional[Deadline]): The request deadline, which can tighten the SLO.
+
+        Returns:
+            List[str]: The backend names in the order they should be tried.
+        """
+        target = self.slo
+        if deadline is not None:
+            target = min(target, deadline.remaining())
+
+        with self._lock:
+            expected = {name: self.expected_latency(name) for name in self.backends}
+            healthy = [name for name in self.backends if not self._cooling_down(name)]
+            candidates = healthy or list(self.backends)
+
+            chosen = next((name for name in candidates if expected[name] <= target), None)
+            reason = "within_slo"
+            if chosen is None:
+                chosen = min(candidates, key=lambda name: expected[name])
+                reason = "fastest"
+            self.decisions[f"{reason}:{chosen}"] += 1
+            self.stats[chosen].routed += 1
+
+        fallbacks = sorted(
+            (name for name in self.backends if name != chosen),
+            key=lambda name: (self._cooling_down(name), expected[name]),
+        )
+        logger.info(f"Routing general vision to {chosen} ({reason}, expected {expected})")
+        return [chosen] + fallbacks
+
+    def _penalize(self, stats: BackendStats, start: float) -> None:
+        """
+        Penalizes a backend whose call, started at `start`, failed or was cut off by the deadline.
+        """
+        latency = max(time.perf_counter() - start, self.FAILURE_PENALTY * self.slo)
+        with self._lock:
+            stats.penalize(latency, self.error_cooldown)
+
+    def _call_backend(
+        self,
+        name: str,
+        query: str,
+        image: Any,
+        deadline: Optional[Deadline],
+        standard_width: Optional[int] = None,
+    ) -> Any:
+        """
+        Calls one backend, waiting for a free slot and recording its latency, queue depth and errors.
+
+        A call that fails or is cut off by the deadline makes the backend expected to take at least
+        `FAILURE_PENALTY` times the SLO until the error cooldown has passed, so a backend that times out
+        or fails stops being predicted to meet it for that long.
+        """
+        stats = self.stats[name]
+        with self._lock:
+            stats.depth += 1
+            stats.calls += 1
+        start = None
+        try:
+            with stats.slots:
+                start = time.perf_counter()
+                # backends keep their own default resolution unless one is asked for
+                resolution = {} if standard_width is None else {"standard_width": standard_width}
+                output = self.backends[name].call(
+                    query=query, image=image, deadline=deadline, **resolution
+                )
+                stats.latencies.record(time.perf_counter() - start)
+                return output
+        except DeadlineExceeded:
+            if start is not None:
+                self._penalize(stats, start)
+            raise
+        except Exception:
+            if start is not None:
+                self._penalize(stats, start)
+            with self._lock:
+                stats.errors += 1
+                stats.last_error = time.monotonic()
+            raise
+        finally:
+            with self._lock:
+                stats.depth -= 1
+
+    def call(
+        self,
+        query: str,
+        image: Any,
+        deadline: Optional[Deadline] = None,
+        standard_width: Optional[int] = None,
+    ) -> Any:
+        """
+        Runs a general vision call on the backend expected to meet the SLO, falling back to the other
+        backends if it fails.
+
+        Args:
+            query (str): The question about the image.
+            image (Any): The input image.
+            deadline (Optional[Deadline]): The request deadline.
+            standard_width (Optional[int]): The width the image is resized to. Defaults to each backend's
+                own resolution.
+
+        Returns:
+            Any: The output of the first backend that succeeds.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes.
+            Exception: The error of the last backend if every backend fails.
+        """
+        order = self.route(deadline)
+        for attempt, name in enumerate(order):
+            if deadline is not None:
+                deadline.check()
+            try:
+                output = self._call_backend(
+                    name, query, image, deadline, standard_width
+                )
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if attempt == len(order) - 1:
+                    raise
+                logger.warning(f"General vision backend {name} failed, falling back: {e}")
+                with self._lock:
+                    self.decisions[f"fallback_from:{name}"] += 1
+                continue
+            return output
+
+    def metrics(self) -> dict:
+        """
+        Returns the routing decisions and the live statistics of each backend.
+        """
+        with self._lock:
+            backends = {
+                name: {
+                    "routed": stats.routed,
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "queue_depth": stats.depth,
+                    "cooling_down": self._cooling_down(name),
+                    "expected_latency_s": round(self.expected_latency(name), 3),
+                    "p50_s": stats.latencies.quantile(0.5),
+                    "p_slo_s": stats.latencies.quantile(self.quantile),
+                    "samples": len(stats.latencies.window),
+                }
+                for name, stats in self.stats.items()
+            }
+            return {
+                "slo_s": self.slo,
+                "quantile": self.quantile,
+                "decisions": dict(self.decisions),
+                "backends": backends,
+            }
@@ -0,0 +1,123 @@
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+from image_agent.models.config import florence_warmup_tasks
+
+logger = logging.getLogger("CPUProfile")
+logger.setLevel(logging.INFO)
+
+
+@dataclass
+class CPUPerformanceProfile:
+    """
+    Performance settings for running the local backends on CPU.
+
+    Thread counts apply to PyTorch backends (Florence) and are process-wide. `inference_mode`, `compile`
+    and `channels_last` only affect PyTorch models. Warmup applies to every local backend, including the
+    MLX ones.
+
+    Attributes:
+        num_threads (Optional[int]): The number of intra-op threads. None keeps the PyTorch default.
+        num_interop_threads (Optional[int]): The number of inter-op threads. None keeps the PyTorch default.
+            This can only be set before the first parallel operation in the process.
+        inference_mode (bool): Whether to run generation under `torch.inference_mode`.
+        compile (bool): Whether to `torch.compile` the vision encoder.
+        compile_mode (str): The `torch.compile` mode.
+        channels_last (bool): Whether to use the channels-last memory format for convolution weights and inputs.
+        warmup (bool): Whether to run warmup calls right after loading.
+        warmup_tasks (List[str]): The tasks run during warmup.
+        warmup_image_size (tuple): The (width, height) of the synthetic warmup image.
+    """
+
+    num_threads: Optional[int] = None
+    num_interop_threads: Optional[int] = None
+    inference_mode: bool = True
+    compile: bool = False
+    compile_mode: str = "default"
+    channels_last: bool = False
+    warmup: bool = True
+    warmup_tasks: List[str] = field(default_factory=lambda: list(florence_warmup_tasks))
+    warmup_image_size: tuple = (768, 768)
+
+    def apply_threads(self) -> None:
+        """
+        Applies the thread settings to PyTorch.
+        """
+        import torch
+
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        if self.num_interop_threads is not None:
+            try:
+                torch.set_num_interop_threads(self.num_interop_threads)
+            except RuntimeError as e:
+                # raised once any inter-op parallel work has started in this process
+                logger.warning(f"Could not set inter-op threads: {e}")
+        logger.info(
+            f"Torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}"
+        )
+
+    def inference_context(self) -> Any:
+        """
+        Returns the context manager under which model calls should run.
+        """
+        if not self.inference_mode:
+            return nullcontext()
+        import torch
+
+        return torch.inference_mode()
+
+    def optimize_model(self, model: Any) -> Any:
+        """
+        Applies the memory-format and compilation settings to a loaded PyTorch model.
+
+        Args:
+            model (Any): The loaded model.
+
+        Returns:
+            Any: The optimized model.
+        """
+        import torch
+
+        model.eval()
+        if self.channels_last:
+            model.to(memory_format=torch.channels_last)
+        if self.compile:
+            # only the vision encoder has static input shapes, the decoder is left eager
+            if hasattr(model, "vision_tower"):
+                model.vision_tower = torch.compile(
+                    model.vision_tower, mode=self.compile_mode
+                )
+            else:
+                logger.warning(f"{type(model).__name__} has no vision_tower, skipping compile")
+        return model
+
+    def prepare_inputs(self, inputs: Any) -> Any:
+        """
+        Converts image inputs to the configured memory format.
+
+        Args:
+            inputs (Any): The processor outputs, containing "pixel_values".
+
+        Returns:
+            Any: The prepared inputs.
+        """
+        if self.channels_last and "pixel_values" in inputs:
+            import torch
+
+            inputs["pixel_values"] = inputs["pixel_values"].contiguous(
+                memory_format=torch.channels_last
+            )
+        return inputs
+
+    def warmup_image(self) -> Any:
+        """
+        Builds a synthetic noise image for warmup calls.
+
+        Returns:
+            Any: A PIL RGB image of `warmup_image_size`.
+        """
+        from PIL import Image
+
+        return Image.effect_noise(self.warmup_image_size, 64).convert("RGB")
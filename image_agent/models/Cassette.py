@@ -0,0 +1,442 @@
+import atexit
+import gzip
+import hashlib
+import importlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from image_agent.deadline import Deadline
+
+logger = logging.getLogger("Cassette")
+logger.setLevel(logging.INFO)
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a call was never recorded."""
+
+
+def _normalize(value: Any) -> Any:
+    """
+    Converts call arguments into a JSON-serializable form that is stable across runs.
+
+    Images are replaced by their content hash and pydantic models by their fields.
+
+    Args:
+        value (Any): An argument value.
+
+    Returns:
+        Any: The JSON-serializable form of the value.
+    """
+    if hasattr(value, "tobytes") and hasattr(value, "size") and hasattr(value, "mode"):
+        from image_agent.image_tools import hash_image
+
+        return {"__image__": hash_image(value)}
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+def _signature(fn: Callable, method: str) -> dict:
+    """
+    Describes the parameters of a caller method, so that calls can be keyed by argument name.
+
+    Wrappers that only forward `*args, **kwargs`, such as the perceptual cache, are looked through to the
+    caller they wrap.
+
+    Args:
+        fn (Callable): The bound method.
+        method (str): The name of the method.
+
+    Returns:
+        dict: The parameter names in positional order and the normalized defaults.
+    """
+    signature = inspect.signature(fn)
+    forwards = any(
+        parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD)
+        for parameter in signature.parameters.values()
+    )
+    wrapped = getattr(getattr(fn, "__self__", None), "caller", None)
+    if forwards and wrapped is not None and hasattr(wrapped, method):
+        return _signature(getattr(wrapped, method), method)
+    parameters = [
+        parameter
+        for parameter in signature.parameters.values()
+        if parameter.kind not in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD)
+    ]
+    return {
+        "parameters": [parameter.name for parameter in parameters],
+        "defaults": {
+            parameter.name: _normalize(parameter.default)
+            for parameter in parameters
+            if parameter.default is not parameter.empty
+        },
+    }
+
+
+def _serialize_output(output: Any) -> Any:
+    """
+    Converts a call output into JSON, tagging pydantic models so that they can be rebuilt.
+
+    Args:
+        output (Any): The output of a model call.
+
+    Returns:
+        Any: The JSON-serializable output.
+    """
+    if hasattr(output, "model_dump"):
+        model = type(output)
+        return {
+            "__model__": f"{model.__module__}:{model.__qualname__}",
+            "data": output.model_dump(),
+        }
+    return output
+
+
+def _deserialize_output(output: Any) -> Any:
+    """
+    Rebuilds a call output written by `_serialize_output`.
+
+    Args:
+        output (Any): The stored output.
+
+    Returns:
+        Any: The original output.
+    """
+    if isinstance(output, dict) and "__model__" in output:
+        module_name, class_name = output["__model__"].split(":")
+        model = getattr(importlib.import_module(module_name), class_name)
+        return model.model_validate(output["data"])
+    return output
+
+
+class Cassette:
+    """
+    A class to record model calls to disk and replay them later.
+
+    Calls are keyed by a stable hash of the caller name, method and arguments bound to the method's
+    parameter names, with defaults filled in (images are hashed by content, deadlines are ignored). The
+    parameters of each recorded method are stored in the cassette, so replay binds arguments the same way
+    without the real caller. Identical calls made several times in a run are replayed in the order they
+    were recorded. The cassette is a gzipped JSON Lines file, kept open and appended to as calls are
+    recorded; `close` it, or use it as a context manager, to finish the file. It is also closed when the
+    interpreter exits.
+
+    Attributes:
+        path (str): The path of the cassette file.
+        mode (str): Either "record" or "replay".
+        emulate_latency (bool): Whether replayed calls sleep for their recorded latency.
+        stats (Dict[str, int]): Counts of recorded calls, replayed calls and replay misses.
+    """
+
+    MODES: tuple = ("record", "replay")
+
+    def __init__(self, path: str, mode: str = "replay", emulate_latency: bool = False) -> None:
+        """
+        Initializes the Cassette and, in replay mode, loads the recorded calls.
+
+        Args:
+            path (str): The path of the cassette file.
+            mode (str): Either "record" to append calls to the cassette or "replay" to serve them from it.
+            emulate_latency (bool): Whether replayed calls sleep for their recorded latency.
+        """
+        if mode not in self.MODES:
+            raise ValueError("Cassette mode must be record or replay")
+        self.path: str = path
+        self.mode: str = mode
+        self.emulate_latency: bool = emulate_latency
+        self.stats: Dict[str, int] = {"recorded": 0, "replayed": 0, "misses": 0}
+        self._entries: Dict[str, List[dict]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+        self._signatures: Dict[str, dict] = {}
+        self._file: Optional[gzip.GzipFile] = None
+        self._lock = threading.Lock()
+
+        if self.mode == "replay":
+            self._load()
+        else:
+            atexit.register(self.close)
+
+    @property
+    def replaying(self) -> bool:
+        """
+        True if calls are served from the cassette rather than the real backends.
+        """
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        """
+        Reads all recorded calls from the cassette file.
+        """
+        calls = 0
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    if "signature" in entry:
+                        self._signatures[entry["signature"]] = entry
+                    else:
+                        self._entries[entry["key"]].append(entry)
+                        calls += 1
+            except EOFError:
+                # a recording that was never closed still holds every flushed call
+                logger.warning(f"{self.path} was not closed after recording")
+        logger.info(f"Loaded {calls} calls from {self.path}")
+
+    def has_method(self, caller_name: str, method: str) -> bool:
+        """
+        Whether calls of a method were recorded for a caller.
+
+        Args:
+            caller_name (str): The name of the wrapped caller.
+            method (str): The name of the method.
+
+        Returns:
+            bool: True if the cassette holds the method's parameters.
+        """
+        return f"{caller_name}.{method}" in self._signatures
+
+    def make_key(
+        self,
+        caller_name: str,
+        method: str,
+        args: tuple,
+        kwargs: dict,
+        fn: Optional[Callable] = None,
+    ) -> tuple:
+        """
+        Builds the stable key and normalized inputs for a call.
+
+        Positional and keyword arguments are bound to the method's parameter names, so `call("x")` and
+        `call(query="x")` share a key. In record mode the parameters are read from the real method and
+        written to the cassette the first time the method is called.
+
+        Args:
+            caller_name (str): The name of the wrapped caller, e.g. "planner".
+            method (str): The name of the called method.
+            args (tuple): The positional arguments.
+            kwargs (dict): The keyword arguments.
+            fn (Optional[Callable]): The real method, required in record mode.
+
+        Returns:
+            tuple: The hex digest key and the normalized inputs.
+        """
+        name = f"{caller_name}.{method}"
+        with self._lock:
+            signature = self._signatures.get(name)
+            if signature is None and fn is not None:
+                signature = {"signature": name, **_signature(fn, method)}
+                self._signatures[name] = signature
+                self._write(signature)
+
+        if signature is None:
+            # never recorded, so the call misses whatever its key
+            arguments = {"args": list(args), **kwargs}
+        else:
+            parameters = signature["parameters"]
+            if len(args) > len(parameters):
+                raise TypeError(f"{name} takes {len(parameters)} positional arguments")
+            arguments = dict(signature["defaults"])
+            arguments.update(zip(parameters, args))
+            arguments.update(kwargs)
+
+        inputs = {
+            "caller": caller_name,
+            "method": method,
+            "arguments": _normalize(
+                {
+                    k: v
+                    for k, v in arguments.items()
+                    if k != "deadline" and not isinstance(v, Deadline)
+                }
+            ),
+        }
+        encoded = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest(), inputs
+
+    def _write(self, entry: dict) -> None:
+        """
+        Appends one line to the cassette file, opening it on first use. Must be called with the lock held.
+
+        Args:
+            entry (dict): The call or signature to write.
+        """
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # one gzip member per recording session, so the whole session shares one compression stream
+            self._file = gzip.open(self.path, "ab")
+        line = json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+        self._file.write(line.encode("utf-8"))
+        # flushed so that a crashed recording keeps the calls made so far
+        self._file.flush()
+
+    def record(self, key: str, inputs: dict, output: Any, latency: float) -> None:
+        """
+        Appends a call to the cassette file.
+
+        Args:
+            key (str): The call key.
+            inputs (dict): The normalized inputs.
+            output (Any): The call output.
+            latency (float): The call latency, in seconds.
+        """
+        entry = {
+            "key": key,
+            "inputs": inputs,
+            "output": _serialize_output(output),
+            "latency": round(latency, 4),
+        }
+        with self._lock:
+            self._write(entry)
+            self.stats["recorded"] += 1
+
+    def close(self) -> None:
+        """
+        Finishes the cassette file. Calls recorded afterwards start a new gzip member.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "Cassette":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def replay(self, key: str, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Serves the next recorded output for a call key.
+
+        Args:
+            key (str): The call key.
+            deadline (Optional[Deadline]): The request deadline, honoured when emulating latency.
+
+        Returns:
+            Any: The recorded output.
+
+        Raises:
+            CassetteMiss: If the call was never recorded.
+        """
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                raise CassetteMiss(key)
+            position = self._positions[key]
+            # repeat the last recording if the call happens more often than it was recorded
+            entry = entries[min(position, len(entries) - 1)]
+            self._positions[key] = position + 1
+            self.stats["replayed"] += 1
+
+        if self.emulate_latency:
+            latency = entry["latency"]
+            if deadline is not None:
+                latency = min(latency, deadline.remaining())
+            time.sleep(latency)
+            if deadline is not None:
+                deadline.check()
+        return _deserialize_output(entry["output"])
+
+    def play(
+        self,
+        caller_name: str,
+        method: str,
+        fn: Optional[Callable],
+        args: tuple,
+        kwargs: dict,
+    ) -> Any:
+        """
+        Records or replays a single call.
+
+        Args:
+            caller_name (str): The name of the wrapped caller.
+            method (str): The name of the called method.
+            fn (Optional[Callable]): The real method, required in record mode.
+            args (tuple): The positional arguments.
+            kwargs (dict): The keyword arguments.
+
+        Returns:
+            Any: The call output.
+        """
+        key, inputs = self.make_key(caller_name, method, args, kwargs, fn)
+        if self.replaying:
+            return self.replay(key, kwargs.get("deadline"))
+
+        start = time.perf_counter()
+        output = fn(*args, **kwargs)
+        self.record(key, inputs, output, time.perf_counter() - start)
+        return output
+
+
+class CassetteCaller:
+    """
+    A class to wrap any model caller so that its calls go through a cassette.
+
+    In replay mode no real caller is needed, so no model is loaded and no API is called. The optional
+    methods, such as `call_many`, are only available if the wrapped caller has them when recording, or
+    if the cassette holds recordings of them when replaying.
+
+    Attributes:
+        name (str): The name under which calls are recorded, e.g. "planner".
+        cassette (Cassette): The cassette to record to or replay from.
+        caller (Optional[Any]): The wrapped caller. None in replay mode.
+    """
+
+    RECORDED_METHODS: tuple = ("call", "call_batch", "call_many")
+
+    def __init__(self, name: str, cassette: Cassette, caller: Optional[Any] = None) -> None:
+        """
+        Initializes the CassetteCaller.
+
+        Args:
+            name (str): The name under which calls are recorded.
+            cassette (Cassette): The cassette to record to or replay from.
+            caller (Optional[Any]): The wrapped caller, required in record mode.
+        """
+        if caller is None and not cassette.replaying:
+            raise ValueError("A caller is required to record a cassette")
+        self.name: str = name
+        self.cassette: Cassette = cassette
+        self.caller: Optional[Any] = caller
+
+    def call(self, *args, **kwargs) -> Any:
+        """
+        Records or replays a call of the wrapped caller's `call` method.
+        """
+        fn = self.caller.call if self.caller is not None else None
+        return self.cassette.play(self.name, "call", fn, args, kwargs)
+
+    def __getattr__(self, attribute: str) -> Any:
+        caller = self.__dict__.get("caller")
+        if attribute in self.RECORDED_METHODS:
+            cassette = self.__dict__.get("cassette")
+            if caller is not None:
+                fn = getattr(caller, attribute)
+            elif cassette is not None and cassette.has_method(self.__dict__.get("name"), attribute):
+                fn = None
+            else:
+                raise AttributeError(
+                    f"{attribute} was not recorded for the replayed {self.__dict__.get('name')} caller"
+                )
+            return lambda *args, **kwargs: self.cassette.play(
+                self.name, attribute, fn, args, kwargs
+            )
+        if caller is None:
+            raise AttributeError(
+                f"{attribute} is not available on a replayed {self.__dict__.get('name')} caller"
+            )
+        return getattr(caller, attribute)
@@ -1,9 +1,36 @@
-from transformers import AutoModelForCausalLM, AutoProcessor
+from transformers import (
+    AutoModelForCausalLM,
+    AutoProcessor,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
 from transformers.dynamic_module_utils import get_imports
 from unittest.mock import patch
+from contextlib import nullcontext
 import os
-from image_agent.models.config import florence_path
+from image_agent.models.config import (
+    florence_path,
+    florence_torch_dtype,
+    florence_mmap_weights,
+    florence_skip_modules,
+    florence_checkpoint_cache,
+)
+from image_agent.models.WeightLoading import (
+    build_empty_model,
+    drop_modules,
+    load_mmap_weights,
+    mmap_checkpoint_path,
+    resolve_dtype,
+    save_mmap_checkpoint,
+)
+from image_agent.deadline import Deadline
+from image_agent.models.CPUProfile import CPUPerformanceProfile
 from typing import Optional, Any
+import logging
+import time
+
+logger = logging.getLogger("FlorenceCaller")
+logger.setLevel(logging.INFO)
 
 
 def fixed_get_imports(filename: str | os.PathLike) -> list[str]:
@@ -28,6 +55,28 @@ def get_device_type():
             return "cpu"
 
 
+class DeadlineStoppingCriteria(StoppingCriteria):
+    """
+    Stops generation once the request deadline has passed.
+
+    Attributes:
+        deadline (Deadline): The deadline of the current request.
+    """
+
+    def __init__(self, deadline: Deadline) -> None:
+        self.deadline: Deadline = deadline
+
+    def __call__(self, input_ids: Any, scores: Any, **kwargs) -> Any:
+        import torch
+
+        return torch.full(
+            (input_ids.shape[0],),
+            self.deadline.expired(),
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
 class FlorenceCaller:
     """
     A class to interact with the Florence model for various vision-language tasks.
@@ -35,6 +84,10 @@ class FlorenceCaller:
     Attributes:
         MODEL_PATH (str): Path to the pre-trained Florence model.
         TASK_DICT (dict): A dictionary mapping task names to task codes.
+        NUM_BEAMS (int): The beam width used for generation.
+        MAX_NEW_TOKENS (int): The maximum number of generated tokens.
+        LOW_BUDGET_NUM_BEAMS (int): The beam width used when the request deadline is running low.
+        LOW_BUDGET_MAX_NEW_TOKENS (int): The maximum number of generated tokens when the deadline is running low.
     """
 
     MODEL_PATH: str = florence_path  # Replace `florence_path` with the actual path or variable definition.
@@ -44,26 +97,129 @@ class FlorenceCaller:
         "image captioning": "<MORE_DETAILED_CAPTION>",
         "OCR": "<OCR_WITH_REGION>",
     }
+    NUM_BEAMS: int = 3
+    MAX_NEW_TOKENS: int = 1024
+    LOW_BUDGET_NUM_BEAMS: int = 1
+    LOW_BUDGET_MAX_NEW_TOKENS: int = 256
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        cpu_profile: Optional[CPUPerformanceProfile] = None,
+        torch_dtype: Optional[str] = florence_torch_dtype,
+        mmap_weights: bool = florence_mmap_weights,
+        skip_modules: Optional[list[str]] = None,
+    ) -> None:
         """
         Initializes the FlorenceCaller instance by loading the model and processor.
 
         The model and processor are loaded using the specified `MODEL_PATH` and moved to the appropriate device.
+
+        Args:
+            cpu_profile (Optional[CPUPerformanceProfile]): Thread, compilation, memory-format and warmup
+                settings. Defaults to the PyTorch defaults with no warmup.
+            torch_dtype (Optional[str]): The weight dtype, e.g. "bfloat16" or "float16". Defaults to float32.
+            mmap_weights (bool): On CPU, whether to memory-map the weights from a converted safetensors
+                checkpoint so that worker processes share one read-only copy through the page cache.
+            skip_modules (Optional[list[str]]): Dotted names of submodules that are never used and are
+                not loaded, e.g. "language_model.lm_head".
         """
         self.device: str = (
             get_device_type()
         )  # Function to determine the device type (e.g., 'cpu' or 'cuda').
+        self.cpu_profile: Optional[CPUPerformanceProfile] = cpu_profile
+        if self.cpu_profile is not None:
+            self.cpu_profile.apply_threads()
+        self.torch_dtype: Any = resolve_dtype(torch_dtype)
+        self.mmap_weights: bool = mmap_weights and self.device == "cpu"
+        self.skip_modules: list[str] = list(
+            skip_modules if skip_modules is not None else florence_skip_modules
+        )
 
         with patch("transformers.dynamic_module_utils.get_imports", fixed_get_imports):
-            self.model: AutoModelForCausalLM = AutoModelForCausalLM.from_pretrained(
-                self.MODEL_PATH, trust_remote_code=True
-            )
+            self.model: AutoModelForCausalLM = self._load_model()
             self.processor: AutoProcessor = AutoProcessor.from_pretrained(
                 self.MODEL_PATH, trust_remote_code=True
             )
             self.model.to(self.device)
 
+        if self.cpu_profile is not None:
+            self.model = self.cpu_profile.optimize_model(self.model)
+            if self.cpu_profile.warmup:
+                self.warmup()
+
+    def _load_pretrained(self) -> AutoModelForCausalLM:
+        """
+        Loads the model from its HuggingFace checkpoint in the configured dtype.
+
+        Returns:
+            AutoModelForCausalLM: The loaded model without the skipped modules.
+        """
+        kwargs: dict[str, Any] = {"trust_remote_code": True}
+        if self.torch_dtype is not None:
+            kwargs["torch_dtype"] = self.torch_dtype
+            kwargs["low_cpu_mem_usage"] = True
+        model = AutoModelForCausalLM.from_pretrained(self.MODEL_PATH, **kwargs)
+        return drop_modules(model, self.skip_modules)
+
+    def _load_model(self) -> AutoModelForCausalLM:
+        """
+        Loads the model weights with the configured dtype, memory mapping and skipped modules.
+
+        With memory mapping, the first load converts the checkpoint into a safetensors file in the cache
+        directory; later loads build the model on the meta device and map that file without copying it.
+
+        Returns:
+            AutoModelForCausalLM: The loaded model.
+        """
+        if not self.mmap_weights:
+            return self._load_pretrained()
+
+        path = mmap_checkpoint_path(
+            florence_checkpoint_cache,
+            self.MODEL_PATH,
+            self.torch_dtype,
+            self.skip_modules,
+        )
+        if os.path.exists(path):
+            try:
+                model = build_empty_model(
+                    AutoModelForCausalLM, self.MODEL_PATH, self.torch_dtype
+                )
+                model = drop_modules(model, self.skip_modules)
+                return load_mmap_weights(model, path).eval()
+            except Exception as e:
+                logger.warning(
+                    f"Memory-mapped loading from {path} failed, converting again: {e}"
+                )
+
+        model = self._load_pretrained()
+        save_mmap_checkpoint(model, path)
+        # re-point the weights at the file so this process holds no private copy either
+        return load_mmap_weights(model, path)
+
+    def warmup(self, tasks: Optional[list[str]] = None) -> dict[str, float]:
+        """
+        Runs each task once on a synthetic image so that lazy initialization, kernel selection and
+        compilation happen before the first real request.
+
+        Args:
+            tasks (Optional[list[str]]): The tasks to run. Defaults to the profile's warmup tasks.
+
+        Returns:
+            dict[str, float]: The latency of each warmup call, in seconds.
+        """
+        profile = self.cpu_profile or CPUPerformanceProfile()
+        tasks = tasks if tasks is not None else profile.warmup_tasks
+        image = profile.warmup_image()
+
+        latencies: dict[str, float] = {}
+        for task in tasks:
+            start = time.perf_counter()
+            self.call(task_prompt=task, image=image, text_input="object")
+            latencies[task] = time.perf_counter() - start
+        logger.info(f"Warmup latencies: {latencies}")
+        return latencies
+
     def translate_task(self, task_name: str) -> str:
         """
         Translates a human-readable task name into its corresponding task code.
@@ -76,19 +232,50 @@ class FlorenceCaller:
         """
         return self.TASK_DICT.get(task_name, "<DETAILED_CAPTION>")
 
-    def call(
-        self, task_prompt: str, image: Any, text_input: Optional[str] = None
-    ) -> Any:
+    def _inference_context(self) -> Any:
         """
-        Executes a vision-language task using the Florence model.
+        Returns the context manager for model calls, as set by the CPU profile.
+        """
+        if self.cpu_profile is None:
+            return nullcontext()
+        return self.cpu_profile.inference_context()
+
+    def generation_kwargs(self, deadline: Optional[Deadline] = None) -> dict:
+        """
+        Chooses the decoding settings for a call, switching to cheaper greedy decoding when the
+        request deadline is running low and stopping generation once it has passed.
+
+        Args:
+            deadline (Optional[Deadline]): The deadline of the current request, if any.
+
+        Returns:
+            dict: Keyword arguments for `generate`.
+        """
+        kwargs: dict[str, Any] = {
+            "max_new_tokens": self.MAX_NEW_TOKENS,
+            "early_stopping": False,
+            "do_sample": False,
+            "num_beams": self.NUM_BEAMS,
+        }
+        if deadline is not None:
+            if deadline.is_low():
+                kwargs["max_new_tokens"] = self.LOW_BUDGET_MAX_NEW_TOKENS
+                kwargs["num_beams"] = self.LOW_BUDGET_NUM_BEAMS
+            kwargs["stopping_criteria"] = StoppingCriteriaList(
+                [DeadlineStoppingCriteria(deadline)]
+            )
+        return kwargs
+
+    def build_prompt(self, task_prompt: str, text_input: Optional[str] = None) -> tuple:
+        """
+        Builds the Florence prompt for a task.
 
         Args:
             task_prompt (str): The name of the task to perform (e.g., "image captioning").
-            image (Any): The input image for the task (e.g., a PIL Image object).
-            text_input (Optional[str]): Additional text input for tasks that require it. Defaults to None.
+            text_input (Optional[str]): Additional text input for tasks that require it.
 
         Returns:
-            Any: The parsed output of the task as processed by the Florence model.
+            tuple: The task code and the full prompt.
         """
         # Get the corresponding task code for the given prompt
         task_code: str = self.translate_task(task_prompt)
@@ -104,29 +291,180 @@ class FlorenceCaller:
 
         # Construct the prompt based on whether text_input is provided
         prompt: str = task_code if text_input is None else task_code + text_input
+        return task_code, prompt
+
+    def call(
+        self,
+        task_prompt: str,
+        image: Any,
+        text_input: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Any:
+        """
+        Executes a vision-language task using the Florence model.
+
+        Args:
+            task_prompt (str): The name of the task to perform (e.g., "image captioning").
+            image (Any): The input image for the task (e.g., a PIL Image object).
+            text_input (Optional[str]): Additional text input for tasks that require it. Defaults to None.
+            deadline (Optional[Deadline]): The request deadline. Generation is cut short once it passes.
+
+        Returns:
+            Any: The parsed output of the task as processed by the Florence model.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
+        """
+        return self.call_batch(task_prompt, [image], text_input, deadline)[0]
+
+    def call_batch(
+        self,
+        task_prompt: str,
+        images: list,
+        text_input: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> list:
+        """
+        Executes the same vision-language task on several images in one batched generation.
+
+        Every image gets the same prompt, so the prompts need no padding.
+
+        Args:
+            task_prompt (str): The name of the task to perform (e.g., "image captioning").
+            images (list): The input images (e.g., PIL Image objects).
+            text_input (Optional[str]): Additional text input for tasks that require it. Defaults to None.
+            deadline (Optional[Deadline]): The request deadline. Generation is cut short once it passes.
+
+        Returns:
+            list: The parsed output of the task for each image, in order.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
+        """
+        if deadline is not None:
+            deadline.check()
+
+        task_code, prompt = self.build_prompt(task_prompt, text_input)
 
         # Preprocess inputs for the model
-        inputs = self.processor(text=prompt, images=image, return_tensors="pt").to(
-            self.device
-        )
+        inputs = self.processor(
+            text=[prompt] * len(images), images=images, return_tensors="pt"
+        ).to(self.device, self.model.dtype)
+        if self.cpu_profile is not None:
+            inputs = self.cpu_profile.prepare_inputs(inputs)
 
         # Generate predictions using the model
-        generated_ids = self.model.generate(
-            input_ids=inputs["input_ids"],
-            pixel_values=inputs["pixel_values"],
-            max_new_tokens=1024,
-            early_stopping=False,
-            do_sample=False,
-            num_beams=3,
-        )
+        with self._inference_context():
+            generated_ids = self.model.generate(
+                input_ids=inputs["input_ids"],
+                pixel_values=inputs["pixel_values"],
+                **self.generation_kwargs(deadline),
+            )
+
+        # a generation stopped by the deadline is incomplete and cannot be parsed
+        if deadline is not None:
+            deadline.check()
 
         # Decode and process generated output
-        generated_text: str = self.processor.batch_decode(
+        generated_texts: list[str] = self.processor.batch_decode(
             generated_ids, skip_special_tokens=False
-        )[0]
+        )
+
+        outputs = []
+        for generated_text, image in zip(generated_texts, images):
+            parsed_answer: dict[str, Any] = self.processor.post_process_generation(
+                generated_text, task=task_code, image_size=(image.width, image.height)
+            )
+            outputs.append(parsed_answer[task_code])
+        return outputs
+
+    def call_many(
+        self,
+        requests: list,
+        image: Any,
+        deadline: Optional[Deadline] = None,
+    ) -> list:
+        """
+        Executes several vision-language tasks on one image, encoding the image once.
+
+        The vision encoder runs once and its features are shared by every task. The task prompts are padded
+        to a common length and decoded together as one batch, with an attention mask that hides the padding.
+        Models without the Florence-2 encoder hooks fall back to one call per task.
+
+        Args:
+            requests (list): The (task_prompt, text_input) pair of each task, e.g.
+                [("general object detection", None), ("specific object detection", "a dog")].
+            image (Any): The input image (e.g., a PIL Image object).
+            deadline (Optional[Deadline]): The request deadline. Generation is cut short once it passes.
+
+        Returns:
+            list: The parsed output of each task, in order.
 
-        parsed_answer: dict[str, Any] = self.processor.post_process_generation(
-            generated_text, task=task_code, image_size=(image.width, image.height)
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
+        """
+        import torch
+
+        if not all(
+            hasattr(self.model, hook)
+            for hook in ("_encode_image", "_merge_input_ids_with_image_features", "language_model")
+        ):
+            return [
+                self.call(task_prompt, image, text_input, deadline)
+                for task_prompt, text_input in requests
+            ]
+
+        if deadline is not None:
+            deadline.check()
+
+        task_codes, prompts = zip(
+            *(self.build_prompt(task_prompt, text_input) for task_prompt, text_input in requests)
         )
 
-        return parsed_answer[task_code]
+        # one image for all the prompts, so the pixels are preprocessed once
+        inputs = self.processor(
+            text=list(prompts), images=[image], return_tensors="pt", padding=True
+        ).to(self.device, self.model.dtype)
+        if self.cpu_profile is not None:
+            inputs = self.cpu_profile.prepare_inputs(inputs)
+
+        with self._inference_context(), torch.no_grad():
+            image_features = self.model._encode_image(inputs["pixel_values"])
+            image_features = image_features.expand(len(prompts), -1, -1)
+            inputs_embeds = self.model.get_input_embeddings()(inputs["input_ids"])
+            inputs_embeds, _ = self.model._merge_input_ids_with_image_features(
+                image_features, inputs_embeds
+            )
+            # the merged mask covers the prompt padding too, so build one that hides it
+            attention_mask = torch.cat(
+                [
+                    torch.ones(
+                        image_features.shape[:2],
+                        dtype=inputs["attention_mask"].dtype,
+                        device=inputs_embeds.device,
+                    ),
+                    inputs["attention_mask"],
+                ],
+                dim=1,
+            )
+            generated_ids = self.model.language_model.generate(
+                input_ids=None,
+                inputs_embeds=inputs_embeds,
+                attention_mask=attention_mask,
+                **self.generation_kwargs(deadline),
+            )
+
+        # a generation stopped by the deadline is incomplete and cannot be parsed
+        if deadline is not None:
+            deadline.check()
+
+        generated_texts: list[str] = self.processor.batch_decode(
+            generated_ids, skip_special_tokens=False
+        )
+        outputs = []
+        for generated_text, task_code in zip(generated_texts, task_codes):
+            parsed_answer: dict[str, Any] = self.processor.post_process_generation(
+                generated_text, task=task_code, image_size=(image.width, image.height)
+            )
+            outputs.append(parsed_answer[task_code])
+        return outputs
@@ -0,0 +1,378 @@
+import httpx
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional
+from image_agent.deadline import Deadline, DeadlineExceeded, current_deadline
+from image_agent.models.config import (
+    http_pool_size,
+    http_timeout,
+    http_max_retries,
+    http_backoff_base,
+    http_backoff_max,
+    http_hedge_requests,
+    http_hedge_quantile,
+    http_hedge_min_samples,
+)
+
+logger = logging.getLogger("HTTPClient")
+logger.setLevel(logging.INFO)
+
+RETRY_STATUS_CODES: tuple = (429, 500, 502, 503, 504)
+
+
+class LatencyTracker:
+    """
+    A class to keep a rolling window of request latencies and report quantiles.
+
+    Attributes:
+        window (deque): The most recent latencies, in seconds.
+    """
+
+    def __init__(self, window_size: int = 200) -> None:
+        """
+        Initializes the LatencyTracker with an empty window.
+
+        Args:
+            window_size (int): The number of most recent latencies to keep.
+        """
+        self.window: deque = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """
+        Records a single latency.
+
+        Args:
+            latency (float): The latency in seconds.
+        """
+        with self._lock:
+            self.window.append(latency)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Computes a quantile of the recorded latencies.
+
+        Args:
+            q (float): The quantile to compute, between 0 and 1.
+            min_samples (int): The minimum number of samples needed to report a quantile.
+
+        Returns:
+            Optional[float]: The quantile in seconds, or None if there are not enough samples.
+        """
+        with self._lock:
+            samples = sorted(self.window)
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(int(q * len(samples)), len(samples) - 1)
+        return samples[index]
+
+
+class DeadlineByteStream(httpx.SyncByteStream):
+    """
+    A response body stream that stops once the request deadline passes.
+
+    The httpx timeouts derived from the deadline bound each read, not the whole body, so a response that
+    trickles in slowly could otherwise run past the deadline.
+
+    Attributes:
+        stream (httpx.SyncByteStream): The underlying response body stream.
+        deadline (Deadline): The request deadline.
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream, deadline: Deadline) -> None:
+        """
+        Initializes the DeadlineByteStream.
+
+        Args:
+            stream (httpx.SyncByteStream): The underlying response body stream.
+            deadline (Deadline): The request deadline.
+        """
+        self.stream: httpx.SyncByteStream = stream
+        self.deadline: Deadline = deadline
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.stream:
+            if self.deadline.expired():
+                raise DeadlineExceeded("Request deadline passed while reading the response")
+            yield chunk
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class RetryingTransport(httpx.BaseTransport):
+    """
+    An httpx transport that adds jittered exponential backoff and optional request hedging on top of a
+    pooled keep-alive connection transport.
+
+    Responses with a status in `retry_statuses` (429 and 5xx by default) and connection errors are retried.
+    When hedging is enabled, a duplicate request is sent if the first has not completed after the observed
+    p95 latency, and whichever response arrives first is used.
+
+    Attributes:
+        transport (httpx.HTTPTransport): The underlying pooled transport.
+        max_retries (int): The maximum number of retries per request.
+        backoff_base (float): The base delay for exponential backoff, in seconds.
+        backoff_max (float): The maximum delay between retries, in seconds.
+        hedge (bool): Whether to send hedged duplicate requests.
+        hedge_quantile (float): The latency quantile after which a hedged request is sent.
+        hedge_min_samples (int): The number of successful requests to observe before hedging.
+        latency (LatencyTracker): The tracker of successful request latencies.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = http_pool_size,
+        max_retries: int = http_max_retries,
+        backoff_base: float = http_backoff_base,
+        backoff_max: float = http_backoff_max,
+        hedge: bool = http_hedge_requests,
+        hedge_quantile: float = http_hedge_quantile,
+        hedge_min_samples: int = http_hedge_min_samples,
+        retry_statuses: Iterable[int] = RETRY_STATUS_CODES,
+    ) -> None:
+        """
+        Initializes the RetryingTransport and its connection pool.
+
+        Args:
+            pool_size (int): The maximum number of pooled keep-alive connections.
+            max_retries (int): The maximum number of retries per request.
+            backoff_base (float): The base delay for exponential backoff, in seconds.
+            backoff_max (float): The maximum delay between retries, in seconds.
+            hedge (bool): Whether to send hedged duplicate requests.
+            hedge_quantile (float): The latency quantile after which a hedged request is sent.
+            hedge_min_samples (int): The number of successful requests to observe before hedging.
+            retry_statuses (Iterable[int]): The response status codes that trigger a retry.
+        """
+        self.transport: httpx.HTTPTransport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            )
+        )
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.hedge: bool = hedge
+        self.hedge_quantile: float = hedge_quantile
+        self.hedge_min_samples: int = hedge_min_samples
+        self.retry_statuses: set = set(retry_statuses)
+        self.latency: LatencyTracker = LatencyTracker()
+        self.executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="hedge")
+            if hedge
+            else None
+        )
+
+    def backoff_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """
+        Computes the delay before the next retry using full-jitter exponential backoff.
+
+        A numeric Retry-After header on the response takes precedence when present.
+
+        Args:
+            attempt (int): The zero-based number of the attempt that just failed.
+            response (Optional[httpx.Response]): The failed response, if one was received.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except (TypeError, ValueError):
+                pass
+        ceiling = min(self.backoff_max, self.backoff_base * (2**attempt))
+        return random.uniform(0, ceiling)
+
+    def _timed_send(
+        self, request: httpx.Request, deadline: Optional[Deadline] = None
+    ) -> httpx.Response:
+        """
+        Sends a request over the pooled transport, reads the body and records its latency.
+
+        Args:
+            request (httpx.Request): The request to send.
+            deadline (Optional[Deadline]): The request deadline, checked between body chunks.
+
+        Returns:
+            httpx.Response: The fully read response.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes while the body is being read.
+        """
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        if deadline is not None:
+            response.stream = DeadlineByteStream(response.stream, deadline)
+        try:
+            response.read()
+        finally:
+            response.close()
+        if response.status_code < 400:
+            self.latency.record(time.perf_counter() - start)
+        return response
+
+    def _hedged_send(
+        self, request: httpx.Request, deadline: Optional[Deadline] = None
+    ) -> httpx.Response:
+        """
+        Sends a request, firing a duplicate if it is slower than the configured latency quantile.
+
+        Args:
+            request (httpx.Request): The request to send.
+            deadline (Optional[Deadline]): The request deadline, checked between body chunks.
+
+        Returns:
+            httpx.Response: The first successful response, or the last failure if both attempts fail.
+        """
+        hedge_delay = self.latency.quantile(self.hedge_quantile, self.hedge_min_samples)
+        if hedge_delay is None:
+            return self._timed_send(request, deadline)
+
+        primary: Future = self.executor.submit(self._timed_send, request, deadline)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        logger.info(f"Sending hedged request after {hedge_delay:.2f}s")
+        secondary: Future = self.executor.submit(self._timed_send, request, deadline)
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        response: Optional[httpx.Response] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                response = future.result()
+                if response.status_code not in self.retry_statuses:
+                    # the losing request finishes in the background and its response is discarded
+                    return response
+        if response is not None:
+            return response
+        raise error
+
+    @staticmethod
+    def _apply_deadline(request: httpx.Request) -> None:
+        """
+        Caps the request timeouts at the time left before the current deadline, if there is one.
+
+        Args:
+            request (httpx.Request): The request about to be sent.
+
+        Raises:
+            DeadlineExceeded: If the deadline has already passed.
+        """
+        deadline = current_deadline()
+        if deadline is None:
+            return
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline passed before the HTTP request was sent")
+
+        timeouts = dict(request.extensions.get("timeout", {}))
+        for key in ("connect", "read", "write", "pool"):
+            current = timeouts.get(key)
+            timeouts[key] = remaining if current is None else min(current, remaining)
+        request.extensions["timeout"] = timeouts
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        """
+        Sends a request, retrying on retryable statuses and connection errors.
+
+        Retries stop early when the next attempt would start after the current request deadline.
+
+        Args:
+            request (httpx.Request): The request to send.
+
+        Returns:
+            httpx.Response: The final response.
+
+        Raises:
+            DeadlineExceeded: If the request deadline passes before an attempt is sent or while its
+                response is being read.
+        """
+        # buffer the body so that it can be sent more than once
+        request.read()
+        send = self._hedged_send if self.hedge else self._timed_send
+        deadline = current_deadline()
+
+        for attempt in range(self.max_retries + 1):
+            self._apply_deadline(request)
+            is_last = attempt == self.max_retries
+            try:
+                response = send(request, deadline)
+            except httpx.TransportError as e:
+                delay = self.backoff_delay(attempt)
+                if is_last or (deadline is not None and delay >= deadline.remaining()):
+                    raise
+                logger.info(f"Request failed with {type(e).__name__}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code in self.retry_statuses and not is_last:
+                delay = self.backoff_delay(attempt, response)
+                if deadline is not None and delay >= deadline.remaining():
+                    return response
+                logger.info(f"Request returned {response.status_code}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            return response
+
+    def close(self) -> None:
+        """
+        Closes the connection pool and the hedging workers.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.transport.close()
+
+
+def build_http_client(
+    pool_size: int = http_pool_size,
+    timeout: float = http_timeout,
+    max_retries: int = http_max_retries,
+    hedge: bool = http_hedge_requests,
+    **transport_kwargs,
+) -> httpx.Client:
+    """
+    Builds a keep-alive httpx client with retries and optional hedging.
+
+    Args:
+        pool_size (int): The maximum number of pooled connections.
+        timeout (float): The default request timeout, in seconds.
+        max_retries (int): The maximum number of retries per request.
+        hedge (bool): Whether to send hedged duplicate requests.
+        **transport_kwargs: Additional arguments for RetryingTransport.
+
+    Returns:
+        httpx.Client: The configured client.
+    """
+    transport = RetryingTransport(
+        pool_size=pool_size, max_retries=max_retries, hedge=hedge, **transport_kwargs
+    )
+    return httpx.Client(transport=transport, timeout=timeout)
+
+
+_shared_client: Optional[httpx.Client] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_http_client() -> httpx.Client:
+    """
+    Returns the process-wide HTTP client shared by all OpenAI callers, creating it on first use.
+
+    Returns:
+        httpx.Client: The shared client, configured from `image_agent.models.config`.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None or _shared_client.is_closed:
+            _shared_client = build_http_client()
+        return _shared_client
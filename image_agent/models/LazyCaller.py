@@ -0,0 +1,64 @@
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("LazyCaller")
+logger.setLevel(logging.INFO)
+
+
+class LazyCaller:
+    """
+    A class to defer creating a model caller until it is first used.
+
+    Loading a local model imports its framework and reads its weights, which is wasted work for agents
+    that never run the model's steps, e.g. a GPT-only agent answering questions that need no Florence
+    step. The wrapped caller is created on the first call or attribute access, once, even when several
+    threads use it at the same time.
+
+    Attributes:
+        name (str): The name of the wrapped caller, used in log messages.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]) -> None:
+        """
+        Initializes the LazyCaller without creating the wrapped caller.
+
+        Args:
+            name (str): The name of the wrapped caller.
+            factory (Callable[[], Any]): Creates the wrapped caller.
+        """
+        self.name: str = name
+        self._factory: Callable[[], Any] = factory
+        self._caller: Optional[Any] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """
+        True once the wrapped caller has been created.
+        """
+        return self._caller is not None
+
+    @property
+    def caller(self) -> Any:
+        """
+        The wrapped caller, created on first access.
+        """
+        if self._caller is None:
+            with self._lock:
+                if self._caller is None:
+                    logger.info(f"Loading the {self.name} caller on first use")
+                    self._caller = self._factory()
+        return self._caller
+
+    def call(self, *args, **kwargs) -> Any:
+        """
+        Calls the wrapped caller's `call` method, creating the caller first if needed.
+        """
+        return self.caller.call(*args, **kwargs)
+
+    def __getattr__(self, attribute: str) -> Any:
+        # dunder lookups (copy, pickle) must not load the model
+        if attribute.startswith("__") or "_factory" not in self.__dict__:
+            raise AttributeError(attribute)
+        return getattr(self.caller, attribute)
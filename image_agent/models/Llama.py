@@ -3,7 +3,10 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.llms.mlx_pipeline import MLXPipeline
 from langchain_community.chat_models.mlx import ChatMLX
 from image_agent.models.config import llama_path
-from typing import Any
+from image_agent.deadline import Deadline, DeadlineExceeded
+from image_agent.models.CPUProfile import CPUPerformanceProfile
+from typing import Any, Optional
+import time
 
 
 class LlamaCaller:
@@ -18,12 +21,18 @@ class LlamaCaller:
         temperature (float): The sampling temperature for response generation.
         max_tokens (int): The maximum number of tokens to generate in a response.
         chain (Any): The processing chain for handling queries.
+        cpu_profile (Optional[CPUPerformanceProfile]): The warmup settings. MLX manages its own threads,
+            so only the warmup settings of the profile apply.
     """
 
     MODEL_PATH = llama_path
 
     def __init__(
-        self, system_prompt: Any, temperature: float = 0, max_tokens: int = 1000
+        self,
+        system_prompt: Any,
+        temperature: float = 0,
+        max_tokens: int = 1000,
+        cpu_profile: Optional[CPUPerformanceProfile] = None,
     ) -> None:
         """
         Initializes the LlamaCaller with the specified system prompt, temperature, and max tokens.
@@ -32,6 +41,7 @@ class LlamaCaller:
             system_prompt (Any): The system prompt for the model.
             temperature (float): The sampling temperature for response generation.
             max_tokens (int): The maximum number of tokens to generate in a response.
+            cpu_profile (Optional[CPUPerformanceProfile]): The warmup settings. Defaults to no warmup.
         """
         self.system_prompt: Any = system_prompt
         self.loaded_model: MLXPipeline = MLXPipeline.from_model_id(
@@ -46,6 +56,9 @@ class LlamaCaller:
         self.temperature: float = temperature
         self.max_tokens: int = max_tokens
         self.chain: Any = self._set_up_chain()
+        self.cpu_profile: Optional[CPUPerformanceProfile] = cpu_profile
+        if self.cpu_profile is not None and self.cpu_profile.warmup:
+            self.warmup()
 
     def _set_up_chain(self) -> Any:
         """
@@ -63,17 +76,64 @@ class LlamaCaller:
         chain = prompt | self.llm | StrOutputParser()
         return chain
 
-    def call(self, query: str) -> Any:
+    def warmup(self, query: str = "Reply with the single word ready.") -> float:
+        """
+        Runs one short query so that the first real request does not pay for lazy initialization.
+
+        Args:
+            query (str): The warmup query.
+
+        Returns:
+            float: The warmup latency in seconds.
+        """
+        start = time.perf_counter()
+        self.chain.invoke({"query": query})
+        return time.perf_counter() - start
+
+    def call(self, query: str, deadline: Optional[Deadline] = None) -> Any:
         """
         Invokes the model with the specified query.
 
+        With a deadline, the response is streamed so that generation can be abandoned as soon as the
+        deadline passes, as the Qwen caller does.
+
         Args:
             query (str): The query to process.
+            deadline (Optional[Deadline]): The request deadline. The call is refused once it has passed.
 
         Returns:
             Any: The response generated by the model.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
+        """
+        if deadline is None:
+            return self.chain.invoke({"query": query})
+        return self._stream_text(self.chain, query, deadline)
+
+    @staticmethod
+    def _stream_text(chain: Any, query: str, deadline: Deadline) -> str:
+        """
+        Streams the text of a chain's response, abandoning generation as soon as the deadline passes.
+
+        Args:
+            chain (Any): A chain that ends in a string output parser.
+            query (str): The query to process.
+            deadline (Deadline): The request deadline.
+
+        Returns:
+            str: The full response text.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
         """
-        return self.chain.invoke({"query": query})
+        deadline.check()
+        chunks = []
+        for chunk in chain.stream({"query": query}):
+            if deadline.expired():
+                raise DeadlineExceeded("Llama generation exceeded the request deadline")
+            chunks.append(chunk)
+        return "".join(chunks)
 
 
 class StructuredLlamaCaller(LlamaCaller):
@@ -84,6 +144,8 @@ class StructuredLlamaCaller(LlamaCaller):
 
     Attributes:
         output_model (Any): The output model for structured responses.
+        parser (PydanticOutputParser): Parses the response text into the output model.
+        text_chain (Any): The chain up to the response text, which is streamed when there is a deadline.
     """
 
     def __init__(
@@ -92,6 +154,7 @@ class StructuredLlamaCaller(LlamaCaller):
         output_model: Any,
         temperature: float = 0,
         max_tokens: int = 1000,
+        cpu_profile: Optional[CPUPerformanceProfile] = None,
     ) -> None:
         """
         Initializes the StructuredLlamaCaller with the specified system prompt, output model, temperature, and max tokens.
@@ -101,6 +164,7 @@ class StructuredLlamaCaller(LlamaCaller):
             output_model (Any): The output model for structured responses.
             temperature (float): The sampling temperature for response generation.
             max_tokens (int): The maximum number of tokens to generate in a response.
+            cpu_profile (Optional[CPUPerformanceProfile]): The warmup settings. Defaults to no warmup.
         """
         self.system_prompt = system_prompt
         self.output_model = output_model
@@ -116,6 +180,9 @@ class StructuredLlamaCaller(LlamaCaller):
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.chain = self._set_up_chain()
+        self.cpu_profile = cpu_profile
+        if self.cpu_profile is not None and self.cpu_profile.warmup:
+            self.warmup()
 
     def _set_up_chain(self) -> Any:
         """
@@ -138,5 +205,30 @@ class StructuredLlamaCaller(LlamaCaller):
             ]
         ).partial(format_instructions=parser.get_format_instructions())
 
-        chain = prompt | self.llm | parser
+        self.parser: PydanticOutputParser = parser
+        self.text_chain: Any = prompt | self.llm | StrOutputParser()
+        chain = self.text_chain | parser
         return chain
+
+    def call(self, query: str, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Invokes the model with the specified query and parses the response into the output model.
+
+        With a deadline, the response text is streamed so that generation can be abandoned as soon as the
+        deadline passes, and parsed once it is complete.
+
+        Args:
+            query (str): The query to process.
+            deadline (Optional[Deadline]): The request deadline. The call is refused once it has passed.
+
+        Returns:
+            Any: An instance of the output model.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
+            OutputParserException: If the response is empty or is not valid JSON for the output model.
+        """
+        if deadline is None:
+            return self.chain.invoke({"query": query})
+        # parsing the stream as it arrives accepts any JSON prefix, so only the complete text is parsed
+        return self.parser.parse(self._stream_text(self.text_chain, query, deadline))
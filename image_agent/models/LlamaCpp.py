@@ -0,0 +1,192 @@
+import json
+from llama_cpp import Llama, LlamaGrammar
+from image_agent.models.config import llama_cpp_repo, llama_cpp_file, llama_cpp_context
+from image_agent.deadline import Deadline, DeadlineExceeded
+from typing import Any, Optional, Tuple
+
+
+def load_llama_cpp_model(
+    n_threads: Optional[int] = None, n_ctx: int = llama_cpp_context
+) -> Llama:
+    """
+    Loads the GGUF model used by the llama.cpp callers, downloading it from HuggingFace if needed.
+
+    The returned model can be shared by several callers so that the weights are loaded only once.
+
+    Args:
+        n_threads (Optional[int]): The number of CPU threads. None lets llama.cpp decide.
+        n_ctx (int): The context window size.
+
+    Returns:
+        Llama: The loaded model.
+    """
+    return Llama.from_pretrained(
+        repo_id=llama_cpp_repo,
+        filename=llama_cpp_file,
+        n_ctx=n_ctx,
+        n_threads=n_threads,
+        verbose=False,
+    )
+
+
+class LlamaCppCaller:
+    """
+    A class to interact with a llama.cpp model on CPU for generating responses based on a system prompt.
+
+    Attributes:
+        system_prompt (Any): The system prompt used for the model.
+        llm (Llama): The loaded llama.cpp model.
+        temperature (float): The sampling temperature for response generation.
+        max_tokens (int): The maximum number of tokens to generate in a response.
+    """
+
+    def __init__(
+        self,
+        system_prompt: Any,
+        temperature: float = 0,
+        max_tokens: int = 1000,
+        llm: Optional[Llama] = None,
+    ) -> None:
+        """
+        Initializes the LlamaCppCaller with the specified system prompt, temperature, and max tokens.
+
+        Args:
+            system_prompt (Any): The system prompt for the model.
+            temperature (float): The sampling temperature for response generation.
+            max_tokens (int): The maximum number of tokens to generate in a response.
+            llm (Optional[Llama]): An already loaded model to share. Defaults to loading a new one.
+        """
+        self.system_prompt: Any = system_prompt
+        self.llm: Llama = llm or load_llama_cpp_model()
+        self.temperature: float = temperature
+        self.max_tokens: int = max_tokens
+
+    def _generate(
+        self,
+        query: str,
+        grammar: Optional[LlamaGrammar] = None,
+        deadline: Optional[Deadline] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Streams a chat completion, stopping as soon as the deadline passes.
+
+        Args:
+            query (str): The query to process.
+            grammar (Optional[LlamaGrammar]): A grammar that constrains the generated tokens.
+            deadline (Optional[Deadline]): The request deadline.
+            max_tokens (Optional[int]): The token limit for this call. Defaults to `max_tokens`.
+
+        Returns:
+            Tuple[str, Optional[str]]: The generated text and the finish reason, "length" if the text was
+                cut off at the token limit.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before or during generation.
+        """
+        if deadline is not None:
+            deadline.check()
+
+        messages = [
+            {"role": "system", "content": self.system_prompt.system_template},
+            {"role": "user", "content": query},
+        ]
+        chunks = []
+        finish_reason = None
+        for chunk in self.llm.create_chat_completion(
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens or self.max_tokens,
+            grammar=grammar,
+            stream=True,
+        ):
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded("llama.cpp generation exceeded the request deadline")
+            choice = chunk["choices"][0]
+            chunks.append(choice["delta"].get("content") or "")
+            finish_reason = choice.get("finish_reason") or finish_reason
+        return "".join(chunks), finish_reason
+
+    def call(self, query: str, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Invokes the model with the specified query.
+
+        Args:
+            query (str): The query to process.
+            deadline (Optional[Deadline]): The request deadline.
+
+        Returns:
+            Any: The response generated by the model.
+        """
+        response, _ = self._generate(query, deadline=deadline)
+        return response
+
+
+class StructuredLlamaCppCaller(LlamaCppCaller):
+    """
+    A class to interact with a llama.cpp model on CPU for generating structured responses.
+
+    Decoding is constrained by a grammar compiled from the output model's JSON schema, so every complete
+    response parses into the output model in a single pass, including any enum restrictions in the
+    schema. A response cut off at the token limit is retried once with a larger limit.
+
+    Attributes:
+        output_model (Any): The output model for structured responses.
+        grammar (LlamaGrammar): The grammar compiled from the output model's JSON schema.
+        TRUNCATION_RETRY_FACTOR (int): How much the token limit is raised when retrying a cut-off response.
+    """
+
+    TRUNCATION_RETRY_FACTOR: int = 4
+
+    def __init__(
+        self,
+        system_prompt: Any,
+        output_model: Any,
+        temperature: float = 0,
+        max_tokens: int = 1000,
+        llm: Optional[Llama] = None,
+    ) -> None:
+        """
+        Initializes the StructuredLlamaCppCaller and compiles the grammar for the output model.
+
+        Args:
+            system_prompt (Any): The system prompt for the model.
+            output_model (Any): The pydantic output model for structured responses.
+            temperature (float): The sampling temperature for response generation.
+            max_tokens (int): The maximum number of tokens to generate in a response.
+            llm (Optional[Llama]): An already loaded model to share. Defaults to loading a new one.
+        """
+        super().__init__(system_prompt, temperature, max_tokens, llm)
+        self.output_model: Any = output_model
+        self.grammar: LlamaGrammar = LlamaGrammar.from_json_schema(
+            json.dumps(self.output_model.model_json_schema()), verbose=False
+        )
+
+    def call(self, query: str, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Invokes the model with the specified query and parses the constrained output.
+
+        Args:
+            query (str): The query to process.
+            deadline (Optional[Deadline]): The request deadline.
+
+        Returns:
+            Any: An instance of the output model.
+
+        Raises:
+            ValueError: If the response is still cut off at the larger token limit.
+        """
+        response, finish_reason = self._generate(
+            query, grammar=self.grammar, deadline=deadline
+        )
+        if finish_reason == "length":
+            # the grammar only guarantees valid JSON once generation is allowed to finish
+            max_tokens = min(self.max_tokens * self.TRUNCATION_RETRY_FACTOR, self.llm.n_ctx())
+            response, finish_reason = self._generate(
+                query, grammar=self.grammar, deadline=deadline, max_tokens=max_tokens
+            )
+            if finish_reason == "length":
+                raise ValueError(
+                    f"Structured response was cut off at {max_tokens} tokens before the JSON was complete"
+                )
+        return self.output_model.model_validate_json(response)
@@ -2,12 +2,22 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from image_agent.models.config import open_ai_model
+from image_agent.models.HTTPClient import get_shared_http_client
+from image_agent.deadline import deadline_scope
 
 
 class OpenAICaller:
     MODEL_NAME = open_ai_model
 
-    def __init__(self, api_key, system_prompt, temperature=0, max_tokens=1000):
+    def __init__(
+        self,
+        api_key,
+        system_prompt,
+        temperature=0,
+        max_tokens=1000,
+        http_client=None,
+        base_url=None,
+    ):
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.system_prompt = system_prompt
@@ -16,6 +26,10 @@ class OpenAICaller:
             api_key=api_key,
             temperature=temperature,
             max_tokens=max_tokens,
+            base_url=base_url,
+            # retries are handled by the shared client's transport
+            http_client=http_client or get_shared_http_client(),
+            max_retries=0,
         )
         self.chain = self._set_up_chain()
 
@@ -29,13 +43,22 @@ class OpenAICaller:
         chain = prompt | self.llm | StrOutputParser()
         return chain
 
-    def call(self, query):
-        return self.chain.invoke({"query": query})
+    def call(self, query, deadline=None):
+        # the shared HTTP client caps request timeouts at the deadline
+        with deadline_scope(deadline):
+            return self.chain.invoke({"query": query})
 
 
 class StructuredOpenAICaller(OpenAICaller):
     def __init__(
-        self, api_key, system_prompt, output_model, temperature=0, max_tokens=1000
+        self,
+        api_key,
+        system_prompt,
+        output_model,
+        temperature=0,
+        max_tokens=1000,
+        http_client=None,
+        base_url=None,
     ):
         self.temperature = temperature
         self.max_tokens = max_tokens
@@ -46,6 +69,10 @@ class StructuredOpenAICaller(OpenAICaller):
             api_key=api_key,
             temperature=temperature,
             max_tokens=max_tokens,
+            base_url=base_url,
+            # retries are handled by the shared client's transport
+            http_client=http_client or get_shared_http_client(),
+            max_retries=0,
         )
         self.chain = self._set_up_chain()
 
@@ -2,13 +2,23 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from image_agent.models.config import open_ai_model
+from image_agent.models.HTTPClient import get_shared_http_client
+from image_agent.deadline import deadline_scope
 from image_agent.image_tools import convert_PIL_to_base64, resize_maintain_aspect
 
 
 class OpenAIVisionCaller:
     MODEL_NAME = open_ai_model
 
-    def __init__(self, api_key, system_prompt, temperature=0, max_tokens=1000):
+    def __init__(
+        self,
+        api_key,
+        system_prompt,
+        temperature=0,
+        max_tokens=1000,
+        http_client=None,
+        base_url=None,
+    ):
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.system_prompt = system_prompt
@@ -17,6 +27,10 @@ class OpenAIVisionCaller:
             api_key=api_key,
             temperature=temperature,
             max_tokens=max_tokens,
+            base_url=base_url,
+            # retries are handled by the shared client's transport
+            http_client=http_client or get_shared_http_client(),
+            max_retries=0,
         )
         self.chain = self._set_up_chain()
 
@@ -40,8 +54,10 @@ class OpenAIVisionCaller:
         chain = prompt | self.llm | StrOutputParser()
         return chain
 
-    def call(self, query, image, standard_width=512):
+    def call(self, query, image, standard_width=512, deadline=None):
         image = resize_maintain_aspect(image, standard_width)
         base64image = convert_PIL_to_base64(image)
 
-        return self.chain.invoke({"query": query, "image_data": base64image})
+        # the shared HTTP client caps request timeouts at the deadline
+        with deadline_scope(deadline):
+            return self.chain.invoke({"query": query, "image_data": base64image})
@@ -0,0 +1,452 @@
+import inspect
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from image_agent.deadline import Deadline
+from image_agent.models.config import (
+    perceptual_cache_threshold,
+    perceptual_cache_algorithm,
+    perceptual_cache_max_entries,
+    perceptual_cache_max_aspect_difference,
+)
+
+logger = logging.getLogger("PerceptualCache")
+logger.setLevel(logging.INFO)
+
+# output keys holding image coordinates, as alternating x and y values
+COORDINATE_KEYS: tuple = ("bboxes", "quad_boxes", "polygons")
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    """
+    Packs a boolean array into an integer, most significant bit first.
+    """
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Computes the difference hash of an image, which compares the brightness of neighbouring pixels.
+
+    Args:
+        image (Image.Image): The image to hash.
+        hash_size (int): The hash is hash_size * hash_size bits.
+
+    Returns:
+        int: The hash.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS),
+        dtype=np.float32,
+    )
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Image.Image, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """
+    Computes the perceptual hash of an image from the low frequencies of its discrete cosine transform.
+
+    Args:
+        image (Image.Image): The image to hash.
+        hash_size (int): The hash is hash_size * hash_size bits.
+        highfreq_factor (int): How much larger than the hash the transformed image is.
+
+    Returns:
+        int: The hash.
+    """
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(
+        image.convert("L").resize((size, size), Image.Resampling.LANCZOS),
+        dtype=np.float64,
+    )
+    # orthogonal DCT-II matrix, applied to rows and columns
+    n = np.arange(size)
+    dct = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    dct[0] /= np.sqrt(2)
+    low_frequencies = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return _bits_to_int(low_frequencies > np.median(low_frequencies))
+
+
+HASH_FUNCTIONS: Dict[str, Callable[[Image.Image], int]] = {"dhash": dhash, "phash": phash}
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """
+    Counts the bits that differ between two hashes.
+    """
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree to find the hashes within a Hamming distance of a query hash without
+    comparing against every stored hash.
+
+    Each node stores a hash, its values and its children keyed by their distance to the node's hash.
+    By the triangle inequality, only children whose distance is within the search radius of the query's
+    distance to the node can hold matches.
+    """
+
+    def __init__(self) -> None:
+        self._root: Optional[list] = None
+        self.size: int = 0
+
+    def add(self, hash_value: int, value: Any) -> None:
+        """
+        Adds a value under a hash.
+
+        Args:
+            hash_value (int): The hash.
+            value (Any): The stored value.
+        """
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, [value], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [value], {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """
+        Finds the values whose hashes are within a Hamming distance of a hash.
+
+        Args:
+            hash_value (int): The query hash.
+            max_distance (int): The maximum Hamming distance.
+
+        Returns:
+            List[Tuple[int, Any]]: The distance and value of each match, closest first.
+        """
+        matches: List[Tuple[int, Any]] = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, value) for value in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+def rescale_output(output: Any, from_size: tuple, to_size: tuple) -> Any:
+    """
+    Rescales the box coordinates of a vision output from one image resolution to another.
+
+    Args:
+        output (Any): The output of a vision call. Only dicts with coordinate keys are changed.
+        from_size (tuple): The (width, height) the output was computed for.
+        to_size (tuple): The (width, height) of the image the output is reused for.
+
+    Returns:
+        Any: The output in the coordinates of the new image.
+    """
+    if not isinstance(output, dict) or tuple(from_size) == tuple(to_size):
+        return output
+    scale_x = to_size[0] / from_size[0]
+    scale_y = to_size[1] / from_size[1]
+
+    def scale(values: Any) -> Any:
+        if values and all(isinstance(v, (int, float)) for v in values):
+            return [v * (scale_y if i % 2 else scale_x) for i, v in enumerate(values)]
+        return [scale(v) for v in values]
+
+    return {
+        key: scale(value) if key in COORDINATE_KEYS and isinstance(value, list) else value
+        for key, value in output.items()
+    }
+
+
+class PerceptualCache:
+    """
+    A class to reuse vision results for near-duplicate images, such as consecutive video frames, re-encoded
+    uploads or thumbnails, which an exact content hash never matches.
+
+    Images are indexed by a perceptual hash in a BK-tree per call (caller, method and non-image arguments).
+    A lookup returns the closest stored result within the Hamming distance threshold whose image has the
+    same aspect ratio, with its box coordinates rescaled to the new resolution.
+
+    Attributes:
+        threshold (int): The maximum Hamming distance between the hashes of near-duplicate images.
+        algorithm (str): Either "dhash" or "phash".
+        max_entries (int): The number of stored results, beyond which the oldest are dropped.
+        max_aspect_difference (float): The maximum relative difference between aspect ratios of matches.
+        stats (Dict[str, int]): Counts of hits, misses and stored results.
+    """
+
+    def __init__(
+        self,
+        threshold: int = perceptual_cache_threshold,
+        algorithm: str = perceptual_cache_algorithm,
+        max_entries: int = perceptual_cache_max_entries,
+        max_aspect_difference: float = perceptual_cache_max_aspect_difference,
+    ) -> None:
+        """
+        Initializes the PerceptualCache.
+
+        Args:
+            threshold (int): The maximum Hamming distance between the hashes of near-duplicate images.
+            algorithm (str): Either "dhash" or "phash".
+            max_entries (int): The number of stored results, beyond which the oldest are dropped.
+            max_aspect_difference (float): The maximum relative difference between aspect ratios of matches.
+        """
+        if algorithm not in HASH_FUNCTIONS:
+            raise ValueError("Perceptual hash algorithm must be dhash or phash")
+        self.threshold: int = threshold
+        self.algorithm: str = algorithm
+        self.max_entries: int = max_entries
+        self.max_aspect_difference: float = max_aspect_difference
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "stored": 0}
+        self._hash: Callable[[Image.Image], int] = HASH_FUNCTIONS[algorithm]
+        self._trees: Dict[str, BKTree] = {}
+        self._entries: deque = deque()
+        self._lock = threading.Lock()
+
+    def hash_image(self, image: Image.Image) -> int:
+        """
+        Computes the perceptual hash of an image with the configured algorithm.
+        """
+        return self._hash(image)
+
+    def same_aspect(self, size: tuple, other_size: tuple) -> bool:
+        """
+        Checks whether two image sizes have the same aspect ratio, within the configured tolerance.
+        """
+        aspect = size[0] / size[1]
+        other_aspect = other_size[0] / other_size[1]
+        return abs(aspect - other_aspect) <= self.max_aspect_difference * other_aspect
+
+    def lookup(self, key: str, image: Image.Image, hash_value: Optional[int] = None) -> tuple:
+        """
+        Finds the result of a call on a near-duplicate image.
+
+        Args:
+            key (str): The call key, without the image.
+            image (Image.Image): The image of the call.
+            hash_value (Optional[int]): The image's perceptual hash, if already computed.
+
+        Returns:
+            tuple: Whether there was a hit and the rescaled result.
+        """
+        hash_value = self.hash_image(image) if hash_value is None else hash_value
+        with self._lock:
+            tree = self._trees.get(key)
+            matches = tree.search(hash_value, self.threshold) if tree is not None else []
+            for _, (size, output) in matches:
+                if self.same_aspect(size, image.size):
+                    self.stats["hits"] += 1
+                    return True, rescale_output(output, size, image.size)
+            self.stats["misses"] += 1
+        return False, None
+
+    def store(
+        self, key: str, image: Image.Image, output: Any, hash_value: Optional[int] = None
+    ) -> None:
+        """
+        Stores the result of a call.
+
+        Args:
+            key (str): The call key, without the image.
+            image (Image.Image): The image of the call.
+            output (Any): The call output.
+            hash_value (Optional[int]): The image's perceptual hash, if already computed.
+        """
+        hash_value = self.hash_image(image) if hash_value is None else hash_value
+        with self._lock:
+            self._trees.setdefault(key, BKTree()).add(hash_value, (image.size, output))
+            self._entries.append((key, hash_value, (image.size, output)))
+            self.stats["stored"] += 1
+            if len(self._entries) > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        Drops the oldest tenth of the results and rebuilds the trees, since BK-trees cannot remove nodes.
+        """
+        for _ in range(max(1, self.max_entries // 10)):
+            self._entries.popleft()
+        self._trees = {}
+        for key, hash_value, value in self._entries:
+            self._trees.setdefault(key, BKTree()).add(hash_value, value)
+
+
+class PerceptualCacheCaller:
+    """
+    A class to wrap a vision caller so that its results are reused for near-duplicate images.
+
+    Attributes:
+        name (str): The name of the wrapped caller, part of every cache key.
+        cache (PerceptualCache): The shared cache.
+        caller (Any): The wrapped caller.
+    """
+
+    CACHED_METHODS: tuple = ("call", "call_batch", "call_many")
+
+    def __init__(self, name: str, cache: PerceptualCache, caller: Any) -> None:
+        """
+        Initializes the PerceptualCacheCaller.
+
+        Args:
+            name (str): The name of the wrapped caller, e.g. "special_vision".
+            cache (PerceptualCache): The shared cache.
+            caller (Any): The wrapped caller.
+        """
+        self.name: str = name
+        self.cache: PerceptualCache = cache
+        self.caller: Any = caller
+
+    def _bind(self, method: str, args: tuple, kwargs: dict) -> inspect.BoundArguments:
+        bound = inspect.signature(getattr(self.caller, method)).bind(*args, **kwargs)
+        bound.apply_defaults()
+        return bound
+
+    def _key(self, method: str, bound: inspect.BoundArguments) -> str:
+        """
+        Builds the cache key of a call from everything but its images and deadline.
+        """
+        arguments = {
+            name: value
+            for name, value in bound.arguments.items()
+            if name not in ("image", "images", "deadline") and not isinstance(value, Deadline)
+        }
+        return json.dumps(
+            [self.name, method.replace("call_batch", "call"), arguments],
+            sort_keys=True,
+            default=repr,
+        )
+
+    @staticmethod
+    def _degraded(bound: inspect.BoundArguments) -> bool:
+        """
+        Whether a call runs with a low deadline budget, in which case the callers switch to cheaper
+        decoding (greedy search, shorter outputs). Such results are served to the current request but not
+        cached, so later requests with time to spare get a full-quality result.
+        """
+        deadline = bound.arguments.get("deadline")
+        return isinstance(deadline, Deadline) and deadline.is_low()
+
+    def call(self, *args, **kwargs) -> Any:
+        """
+        Returns the result for a near-duplicate image if there is one, or calls the wrapped caller.
+        """
+        bound = self._bind("call", args, kwargs)
+        key = self._key("call", bound)
+        image = bound.arguments["image"]
+        hash_value = self.cache.hash_image(image)
+        hit, output = self.cache.lookup(key, image, hash_value)
+        if hit:
+            return output
+        degraded = self._degraded(bound)
+        output = self.caller.call(*args, **kwargs)
+        if not degraded:
+            self.cache.store(key, image, output, hash_value)
+        return output
+
+    def call_batch(self, *args, **kwargs) -> list:
+        """
+        Serves the near-duplicate images of a batch from the cache and calls the wrapped caller on the rest.
+        """
+        bound = self._bind("call_batch", args, kwargs)
+        key = self._key("call_batch", bound)
+        images = list(bound.arguments["images"])
+        hashes = [self.cache.hash_image(image) for image in images]
+
+        outputs: list = [None] * len(images)
+        missing: List[int] = []
+        for i, (image, hash_value) in enumerate(zip(images, hashes)):
+            hit, output = self.cache.lookup(key, image, hash_value)
+            if hit:
+                outputs[i] = output
+            else:
+                missing.append(i)
+
+        # near-duplicates within the batch, e.g. consecutive frames, share one call
+        representatives: Dict[int, int] = {}
+        for position, i in enumerate(missing):
+            representatives[i] = i
+            for j in missing[:position]:
+                if (
+                    representatives[j] == j
+                    and hamming_distance(hashes[i], hashes[j]) <= self.cache.threshold
+                    and self.cache.same_aspect(images[i].size, images[j].size)
+                ):
+                    representatives[i] = j
+                    break
+        to_call = [i for i in missing if representatives[i] == i]
+
+        if to_call:
+            bound.arguments["images"] = [images[i] for i in to_call]
+            degraded = self._degraded(bound)
+            new_outputs = self.caller.call_batch(*bound.args, **bound.kwargs)
+            for i, output in zip(to_call, new_outputs):
+                outputs[i] = output
+                if not degraded:
+                    self.cache.store(key, images[i], output, hashes[i])
+        for i in missing:
+            j = representatives[i]
+            if j != i:
+                outputs[i] = rescale_output(outputs[j], images[j].size, images[i].size)
+        return outputs
+
+    def call_many(
+        self, requests: list, image: Any, deadline: Optional[Deadline] = None
+    ) -> list:
+        """
+        Serves the tasks already cached for a near-duplicate image and runs the rest on the wrapped caller
+        together. Each task shares its cache entry with the equivalent `call`.
+        """
+        hash_value = self.cache.hash_image(image)
+        keys = [
+            self._key(
+                "call",
+                self._bind(
+                    "call",
+                    (),
+                    {"task_prompt": task_prompt, "image": image, "text_input": text_input},
+                ),
+            )
+            for task_prompt, text_input in requests
+        ]
+
+        outputs: list = [None] * len(requests)
+        missing: List[int] = []
+        for i, key in enumerate(keys):
+            hit, output = self.cache.lookup(key, image, hash_value)
+            if hit:
+                outputs[i] = output
+            else:
+                missing.append(i)
+
+        if missing:
+            to_call = [requests[i] for i in missing]
+            degraded = deadline is not None and deadline.is_low()
+            if hasattr(self.caller, "call_many"):
+                new_outputs = self.caller.call_many(to_call, image, deadline)
+            else:
+                new_outputs = [
+                    self.caller.call(task_prompt, image, text_input, deadline)
+                    for task_prompt, text_input in to_call
+                ]
+            for i, output in zip(missing, new_outputs):
+                outputs[i] = output
+                if not degraded:
+                    self.cache.store(keys[i], image, output, hash_value)
+        return outputs
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.__dict__["caller"], attribute)
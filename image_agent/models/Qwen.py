@@ -1,18 +1,45 @@
-from mlx_vlm import load, apply_chat_template, generate
+from mlx_vlm import load, apply_chat_template, generate, stream_generate
 from image_agent.models.config import qwen_path
 from image_agent.prompts.ImageInterpretation import ImageInterpretationPrompt
+from image_agent.deadline import DeadlineExceeded
+from image_agent.models.CPUProfile import CPUPerformanceProfile
+from image_agent.image_tools import resize_maintain_aspect
+import time
 
 
 class QwenCaller:
     MODEL_PATH = qwen_path
+    LOW_BUDGET_MAX_TOKENS = 200
+    WARMUP_MAX_TOKENS = 8
 
-    def __init__(self, max_tokens=1000, temperature=0):
+    def __init__(self, max_tokens=1000, temperature=0, cpu_profile=None):
         self.model, self.processor = load(self.MODEL_PATH)
         self.config = self.model.config
         self.max_tokens = max_tokens
         self.temperature = temperature
+        # MLX manages its own threads, so only the warmup settings of the profile apply
+        self.cpu_profile = cpu_profile
+        if self.cpu_profile is not None and self.cpu_profile.warmup:
+            self.warmup()
 
-    def call(self, query, image):
+    def warmup(self):
+        """
+        Runs a short generation on a synthetic image so that the first real request does not pay for
+        lazy initialization. Returns the warmup latency in seconds.
+        """
+        profile = self.cpu_profile or CPUPerformanceProfile()
+        max_tokens = self.max_tokens
+        self.max_tokens = self.WARMUP_MAX_TOKENS
+        start = time.perf_counter()
+        try:
+            self.call("Describe this image.", profile.warmup_image())
+        finally:
+            self.max_tokens = max_tokens
+        return time.perf_counter() - start
+
+    def call(self, query, image, deadline=None, standard_width=None):
+        if standard_width is not None:
+            image = resize_maintain_aspect(image, standard_width)
         messages = [
             {
                 "role": "system",
@@ -21,12 +48,30 @@ class QwenCaller:
             {"role": "user", "content": query},
         ]
         prompt = apply_chat_template(self.processor, self.config, messages)
-        output = generate(
+        if deadline is None:
+            output = generate(
+                self.model,
+                self.processor,
+                image,
+                prompt,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+            )
+            return output
+
+        deadline.check()
+        max_tokens = self.LOW_BUDGET_MAX_TOKENS if deadline.is_low() else self.max_tokens
+        chunks = []
+        # stream so that generation can be abandoned as soon as the deadline passes
+        for chunk in stream_generate(
             self.model,
             self.processor,
             image,
             prompt,
-            max_tokens=self.max_tokens,
+            max_tokens=max_tokens,
             temperature=self.temperature,
-        )
-        return output
+        ):
+            if deadline.expired():
+                raise DeadlineExceeded("Qwen generation exceeded the request deadline")
+            chunks.append(chunk if isinstance(chunk, str) else chunk.text)
+        return "".join(chunks)
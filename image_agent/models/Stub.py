@@ -0,0 +1,108 @@
+import time
+from typing import Any, Optional
+from image_agent.deadline import Deadline
+
+
+class StubFlorenceCaller:
+    """
+    A stand-in for FlorenceCaller that returns canned outputs in the Florence formats without loading a model.
+
+    Useful together with StubChatCompletionsServer to exercise and profile the agent graph offline.
+
+    Attributes:
+        latency (float): The delay added to every call, in seconds.
+        calls (list): The (task_prompt, text_input) of every call so far.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """
+        Initializes the StubFlorenceCaller.
+
+        Args:
+            latency (float): The delay added to every call, in seconds.
+        """
+        self.latency: float = latency
+        self.calls: list = []
+
+    def call(
+        self,
+        task_prompt: str,
+        image: Any,
+        text_input: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Any:
+        """
+        Returns a canned output for the task, scaled to the image size.
+
+        Args:
+            task_prompt (str): The name of the task to perform.
+            image (Any): The input image.
+            text_input (Optional[str]): Additional text input for tasks that require it.
+            deadline (Optional[Deadline]): The request deadline.
+
+        Returns:
+            Any: A caption string, or a dict of boxes and labels.
+        """
+        if deadline is not None:
+            deadline.check()
+        self.calls.append((task_prompt, text_input))
+        if self.latency:
+            time.sleep(self.latency)
+
+        width, height = image.size
+        if task_prompt == "image captioning":
+            return "A stub caption describing the image."
+        if task_prompt == "OCR":
+            x1, y1, x2, y2 = 0.1 * width, 0.1 * height, 0.4 * width, 0.2 * height
+            return {
+                "quad_boxes": [[x1, y1, x2, y1, x2, y2, x1, y2]],
+                "labels": ["</s>STUB TEXT"],
+            }
+        label = text_input or "object"
+        return {
+            "bboxes": [[0.1 * width, 0.2 * height, 0.5 * width, 0.9 * height]],
+            "labels": [label],
+        }
+
+    def call_batch(
+        self,
+        task_prompt: str,
+        images: list,
+        text_input: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> list:
+        """
+        Returns a canned output for each image, as FlorenceCaller.call_batch does.
+
+        Args:
+            task_prompt (str): The name of the task to perform.
+            images (list): The input images.
+            text_input (Optional[str]): Additional text input for tasks that require it.
+            deadline (Optional[Deadline]): The request deadline.
+
+        Returns:
+            list: The output for each image, in order.
+        """
+        return [self.call(task_prompt, image, text_input, deadline) for image in images]
+
+    def call_many(
+        self,
+        requests: list,
+        image: Any,
+        deadline: Optional[Deadline] = None,
+    ) -> list:
+        """
+        Returns a canned output for each task on one image, as FlorenceCaller.call_many does.
+
+        Args:
+            requests (list): The (task_prompt, text_input) pair of each task.
+            image (Any): The input image.
+            deadline (Optional[Deadline]): The request deadline.
+
+        Returns:
+            list: The output of each task, in order.
+        """
+        return [
+            self.call(task_prompt, image, text_input, deadline)
+            for task_prompt, text_input in requests
+        ]
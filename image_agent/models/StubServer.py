@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List, Optional
+
+
+class StubChatCompletionsServer:
+    """
+    A local HTTP server that mimics the OpenAI chat completions endpoint, for exercising the OpenAI callers
+    and the shared HTTP client without network access.
+
+    Requests for structured output (via `tools` or a `json_schema` response format) are answered with
+    `structured_response`, all other requests with `text_response`. Failures and latency can be injected
+    to exercise retries and hedging.
+
+    Attributes:
+        text_response (str): The content returned for plain chat requests.
+        structured_response (dict): The JSON object returned for structured output requests.
+        latency (float): The delay added to every successful response, in seconds.
+        failure_statuses (List[int]): Status codes returned, in order, before any successful response.
+        responder (Optional[Callable[[dict], Any]]): A function of the request payload that overrides the
+            canned responses. A str return value is used as text content, anything else as structured output.
+        requests (List[dict]): The payloads of all requests received so far.
+    """
+
+    def __init__(
+        self,
+        text_response: str = "stub response",
+        structured_response: Optional[dict] = None,
+        latency: float = 0.0,
+        failure_statuses: Optional[List[int]] = None,
+        responder: Optional[Callable[[dict], Any]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        """
+        Initializes the stub server. The server is not started until `start` is called.
+
+        Args:
+            text_response (str): The content returned for plain chat requests.
+            structured_response (Optional[dict]): The JSON object returned for structured output requests.
+            latency (float): The delay added to every successful response, in seconds.
+            failure_statuses (Optional[List[int]]): Status codes returned, in order, before succeeding.
+            responder (Optional[Callable[[dict], Any]]): A function of the request payload that overrides
+                the canned responses.
+            host (str): The host to bind to.
+            port (int): The port to bind to. Defaults to 0, which picks a free port.
+        """
+        self.text_response: str = text_response
+        self.structured_response: dict = structured_response or {}
+        self.latency: float = latency
+        self.failure_statuses: List[int] = list(failure_statuses or [])
+        self.responder: Optional[Callable[[dict], Any]] = responder
+        self.requests: List[dict] = []
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer = ThreadingHTTPServer(
+            (host, port), self._make_handler()
+        )
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """
+        The base URL to pass to the OpenAI callers.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubChatCompletionsServer":
+        """
+        Starts serving requests on a background thread.
+
+        Returns:
+            StubChatCompletionsServer: The running server.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the server and releases its socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubChatCompletionsServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _next_failure(self) -> Optional[int]:
+        """
+        Pops the next injected failure status, if any remain.
+
+        Returns:
+            Optional[int]: The status code to fail with, or None to succeed.
+        """
+        with self._lock:
+            return self.failure_statuses.pop(0) if self.failure_statuses else None
+
+    def build_completion(self, payload: dict) -> dict:
+        """
+        Builds a chat completion response body for a request payload.
+
+        Args:
+            payload (dict): The JSON body of the chat completions request.
+
+        Returns:
+            dict: The chat completion response body.
+        """
+        wants_tool = bool(payload.get("tools"))
+        wants_json = (payload.get("response_format") or {}).get("type") == "json_schema"
+
+        if self.responder is not None:
+            answer = self.responder(payload)
+        elif wants_tool or wants_json:
+            answer = self.structured_response
+        else:
+            answer = self.text_response
+
+        message: dict = {"role": "assistant", "content": None}
+        if isinstance(answer, str):
+            message["content"] = answer
+        elif wants_tool:
+            tool_name = payload["tools"][0]["function"]["name"]
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": tool_name, "arguments": json.dumps(answer)},
+                }
+            ]
+        else:
+            message["content"] = json.dumps(answer)
+
+        prompt_tokens = len(json.dumps(payload.get("messages", []))) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if "tool_calls" in message else "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _make_handler(self) -> type:
+        """
+        Creates the request handler class bound to this server.
+
+        Returns:
+            type: The BaseHTTPRequestHandler subclass.
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle(self) -> None:
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # pooled keep-alive connections are reset when the client closes
+                    pass
+
+            def _send_json(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up on the request, e.g. because its deadline passed
+                    pass
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests.append(payload)
+
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                failure = stub._next_failure()
+                if failure is not None:
+                    self._send_json(
+                        failure, {"error": {"message": f"injected {failure}"}}
+                    )
+                    return
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self._send_json(200, stub.build_completion(payload))
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
@@ -0,0 +1,177 @@
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("WeightLoading")
+logger.setLevel(logging.INFO)
+
+
+def resolve_dtype(torch_dtype: Optional[str]) -> Any:
+    """
+    Converts a dtype name such as "bfloat16" into a torch dtype.
+
+    Args:
+        torch_dtype (Optional[str]): The dtype name, or None for the model default.
+
+    Returns:
+        Any: The torch dtype, or None.
+    """
+    if torch_dtype is None:
+        return None
+    import torch
+
+    dtype = getattr(torch, torch_dtype, None)
+    if not isinstance(dtype, torch.dtype):
+        raise ValueError(f"Unknown torch dtype {torch_dtype}")
+    return dtype
+
+
+def mmap_checkpoint_path(
+    cache_dir: str, model_path: str, dtype: Any, skip_modules: Iterable[str] = ()
+) -> str:
+    """
+    Returns where the memory-mappable checkpoint for a model and dtype is stored.
+
+    Args:
+        cache_dir (str): The directory holding converted checkpoints.
+        model_path (str): The HuggingFace model id or path.
+        dtype (Any): The torch dtype of the checkpoint, or None for the model default.
+        skip_modules (Iterable[str]): The modules left out of the checkpoint.
+
+    Returns:
+        str: The path of the safetensors file.
+    """
+    name = model_path.replace("/", "--")
+    dtype_name = str(dtype).replace("torch.", "") if dtype is not None else "default"
+    skipped = "".join(f"-no-{module}" for module in sorted(skip_modules))
+    return os.path.join(
+        os.path.expanduser(cache_dir), f"{name}-{dtype_name}{skipped}.safetensors"
+    )
+
+
+def drop_modules(model: Any, skip_modules: Iterable[str]) -> Any:
+    """
+    Replaces unused submodules with identities so that their weights are released.
+
+    Args:
+        model (Any): The loaded model.
+        skip_modules (Iterable[str]): Dotted submodule names, e.g. "language_model.lm_head".
+
+    Returns:
+        Any: The model without the skipped modules.
+    """
+    import torch
+
+    for module_name in skip_modules:
+        parent_name, _, child_name = module_name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        setattr(parent, child_name, torch.nn.Identity())
+        logger.info(f"Dropped {module_name}")
+    return model
+
+
+def save_mmap_checkpoint(model: Any, path: str) -> None:
+    """
+    Writes every parameter and buffer of a loaded model, including non-persistent buffers, to a
+    safetensors file that `load_mmap_weights` can map straight into memory.
+
+    Args:
+        model (Any): The loaded model, already in the target dtype.
+        path (str): The path of the safetensors file.
+    """
+    from safetensors.torch import save_file
+
+    tensors: Dict[str, Any] = {}
+    # named_parameters skips tied duplicates, which load_mmap_weights restores from the model's aliases
+    for name, tensor in list(model.named_parameters()) + list(model.named_buffers()):
+        tensors[name] = tensor.detach().contiguous()
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # a private temporary file, so that workers converting the same checkpoint at once do not write over
+    # each other before the atomic rename
+    descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    os.close(descriptor)
+    try:
+        save_file(tensors, temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    logger.info(f"Saved memory-mappable checkpoint to {path}")
+
+
+def load_mmap_weights(model: Any, path: str) -> Any:
+    """
+    Points a model's parameters and buffers at memory-mapped tensors from a safetensors file.
+
+    The tensors are views onto a read-only file mapping, so their pages live in the page cache and are
+    shared by every worker process that maps the same file, rather than being copied into each process.
+
+    Args:
+        model (Any): A model with the same architecture as the checkpoint. It can live on the meta device.
+        path (str): The path of the safetensors file.
+
+    Returns:
+        Any: The model with memory-mapped weights.
+
+    Raises:
+        ValueError: If any parameter or buffer is missing from the checkpoint.
+    """
+    import torch
+    from safetensors import safe_open
+
+    # tied weights appear once in the checkpoint but under several names in the model
+    aliases: Dict[int, List[str]] = defaultdict(list)
+    for name, tensor in model.named_parameters(remove_duplicate=False):
+        aliases[id(tensor)].append(name)
+    for name, tensor in model.named_buffers(remove_duplicate=False):
+        aliases[id(tensor)].append(name)
+    names = {group[0]: group for group in aliases.values()}
+
+    with safe_open(path, framework="pt", device="cpu") as f:
+        for key in f.keys():
+            tensor = f.get_tensor(key)
+            parameter = torch.nn.Parameter(tensor, requires_grad=False)
+            for name in names.get(key, [key]):
+                module_name, _, attribute = name.rpartition(".")
+                module = model.get_submodule(module_name) if module_name else model
+                if attribute in module._parameters:
+                    module._parameters[attribute] = parameter
+                else:
+                    module._buffers[attribute] = tensor
+
+    missing = [
+        name
+        for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+        if tensor.is_meta
+    ]
+    if missing:
+        raise ValueError(f"Checkpoint {path} is missing {missing[:5]}")
+    return model
+
+
+def build_empty_model(model_class: Any, model_path: str, dtype: Any) -> Any:
+    """
+    Builds a model from its config on the meta device, without allocating or initializing weights.
+
+    Args:
+        model_class (Any): The auto model class, e.g. AutoModelForCausalLM.
+        model_path (str): The HuggingFace model id or path.
+        dtype (Any): The torch dtype of the model, or None.
+
+    Returns:
+        Any: The model with all tensors on the meta device.
+    """
+    import torch
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+    with torch.device("meta"):
+        return model_class.from_config(
+            config, trust_remote_code=True, torch_dtype=dtype
+        )
@@ -2,3 +2,54 @@ llama_path = "mlx-community/Llama-3.2-3B-Instruct-4bit"
 open_ai_model = "gpt-4o-mini"
 qwen_path = "mlx-community/Qwen2-VL-2B-Instruct-4bit"
 florence_path = "microsoft/Florence-2-base-ft"
+
+# shared HTTP client for the OpenAI callers
+http_pool_size = 10
+http_timeout = 60.0
+http_max_retries = 3
+http_backoff_base = 0.5
+http_backoff_max = 8.0
+http_hedge_requests = False
+http_hedge_quantile = 0.95
+http_hedge_min_samples = 20
+
+# tasks run when warming up Florence
+florence_warmup_tasks = [
+    "general object detection",
+    "specific object detection",
+    "image captioning",
+    "OCR",
+]
+
+# llama.cpp text backend for CPU hosts
+llama_cpp_repo = "bartowski/Llama-3.2-3B-Instruct-GGUF"
+llama_cpp_file = "*Q4_K_M.gguf"
+llama_cpp_context = 8192
+
+# Florence weight loading, e.g. "bfloat16" or "float16" weights memory-mapped from a converted checkpoint
+florence_torch_dtype = None
+florence_mmap_weights = False
+florence_skip_modules = []
+florence_checkpoint_cache = "~/.cache/image_agent"
+
+# perceptual-hash cache of vision results for near-duplicate images (64-bit hashes)
+perceptual_cache_threshold = 6
+perceptual_cache_algorithm = "dhash"
+perceptual_cache_max_entries = 10000
+perceptual_cache_max_aspect_difference = 0.02
+
+# adaptive general vision routing, backends in preference order
+adaptive_vision_backends = ["local", "gpt"]
+adaptive_vision_slo = 10.0
+adaptive_vision_quantile = 0.9
+adaptive_vision_min_samples = 5
+adaptive_vision_default_latency = {"local": 6.0, "gpt": 4.0}
+adaptive_vision_max_concurrency = {"local": 1, "gpt": 8}
+adaptive_vision_error_cooldown = 30.0
+adaptive_vision_window = 100
+
+# OpenAI prices of the text and vision model, in dollars per token, for request budgets
+openai_input_price = 0.15 / 1e6
+openai_output_price = 0.60 / 1e6
+# the prompt tokens of an image sent to the vision model at the default 512px width
+openai_image_tokens = 255
@@ -0,0 +1,371 @@
+"""
+Memory profiling for the agent.
+
+Reports the resident memory of each backend after it loads and, for each request, the peak RSS, the top
+tracemalloc allocators of every graph node and how the state and store grow as steps complete.
+
+Run from the command line against stub or real backends:
+
+    python -m image_agent.profiling --backend stub --output memory_report.json
+    python -m image_agent.profiling --backend real --vision-mode gpt --image example_images/dogs.jpg
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+MB: float = 1024 * 1024
+
+
+def current_rss_bytes() -> int:
+    """
+    Returns the current resident set size of this process, in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns the peak resident set size of this process, in bytes.
+
+    On Linux this is the high-water mark since the last `reset_peak_rss`.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak RSS high-water mark, which is only supported on Linux.
+
+    Returns:
+        bool: True if the peak was reset, False if peaks are measured over the process lifetime.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def model_weight_bytes(caller: Any) -> Optional[int]:
+    """
+    Sums the parameter and buffer sizes of a caller's PyTorch model, if it has one.
+
+    Args:
+        caller (Any): A model caller.
+
+    Returns:
+        Optional[int]: The size of the weights in bytes, or None for non-PyTorch callers.
+    """
+    model = getattr(caller, "model", None)
+    if model is None or not hasattr(model, "parameters"):
+        return None
+    tensors = list(model.parameters()) + list(getattr(model, "buffers", list)())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class MemoryProfiler:
+    """
+    A class to collect memory measurements for backend loading and agent requests.
+
+    tracemalloc is process-wide, so requests should be profiled one at a time.
+
+    Attributes:
+        top_allocators (int): The number of allocation sites reported for each node.
+        backends (Dict[str, dict]): Memory measurements for each loaded backend.
+        requests (List[dict]): Memory measurements for each profiled request.
+    """
+
+    def __init__(self, top_allocators: int = 10) -> None:
+        """
+        Initializes the MemoryProfiler.
+
+        Args:
+            top_allocators (int): The number of allocation sites reported for each node.
+        """
+        self.top_allocators: int = top_allocators
+        self.backends: Dict[str, dict] = {}
+        self.requests: List[dict] = []
+        self._request: Optional[dict] = None
+
+    def measure_load(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Creates a backend and records the resident memory it added.
+
+        Args:
+            name (str): The name of the backend.
+            factory (Callable[[], Any]): Creates the backend.
+
+        Returns:
+            Any: The created backend.
+        """
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        caller = factory()
+        rss_after = current_rss_bytes()
+
+        record = {
+            "type": type(caller).__name__,
+            "load_s": round(time.perf_counter() - start, 3),
+            "rss_delta_mb": round((rss_after - rss_before) / MB, 2),
+            "rss_after_mb": round(rss_after / MB, 2),
+        }
+        weights = model_weight_bytes(caller)
+        if weights is not None:
+            record["weights_mb"] = round(weights / MB, 2)
+        self.backends[name] = record
+        return caller
+
+    def start_request(self, query: str) -> None:
+        """
+        Starts measuring a request.
+
+        Args:
+            query (str): The request query, included in the report.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._request = {
+            "query": query,
+            "peak_reset": reset_peak_rss(),
+            "rss_start_mb": round(current_rss_bytes() / MB, 2),
+            "nodes": [],
+            "state_growth": [],
+            "_plan_output_entries": 0,
+            "_plan_output_bytes": 0,
+            "_store_items": 0,
+            "_store_bytes": 0,
+            "_start": time.perf_counter(),
+        }
+
+    def wrap_node(self, name: str, fn: Callable[[dict], dict]) -> Callable[[dict], dict]:
+        """
+        Wraps a graph node so that its allocations are attributed to it.
+
+        Args:
+            name (str): The node name.
+            fn (Callable[[dict], dict]): The node function.
+
+        Returns:
+            Callable[[dict], dict]: The wrapped node function.
+        """
+
+        def profiled_node(state: dict) -> dict:
+            if self._request is None or not tracemalloc.is_tracing():
+                return fn(state)
+
+            before = tracemalloc.take_snapshot()
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            result = fn(state)
+            elapsed = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+
+            # leave out the snapshots' own allocations
+            exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            stats = after.filter_traces(exclude).compare_to(
+                before.filter_traces(exclude), "lineno"
+            )
+            self._request["nodes"].append(
+                {
+                    "node": name,
+                    "seconds": round(elapsed, 4),
+                    "rss_delta_mb": round((current_rss_bytes() - rss_before) / MB, 2),
+                    "allocated_mb": round(sum(s.size_diff for s in stats) / MB, 3),
+                    "top_allocators": [
+                        {
+                            "location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                            "size_diff_kb": round(s.size_diff / 1024, 1),
+                            "count_diff": s.count_diff,
+                        }
+                        for s in stats[: self.top_allocators]
+                    ],
+                }
+            )
+            return result
+
+        return profiled_node
+
+    def record_update(self, update: dict) -> None:
+        """
+        Records how the state and the store grow with a graph update.
+
+        Args:
+            update (dict): The update streamed by the graph, which is also written to the store.
+        """
+        if self._request is None:
+            return
+        request = self._request
+        request["_store_items"] += 1
+        request["_store_bytes"] += len(json.dumps(update, default=str))
+        for node, values in update.items():
+            new_outputs = (values or {}).get("plan_output", [])
+            request["_plan_output_entries"] += len(new_outputs)
+            request["_plan_output_bytes"] += len(json.dumps(new_outputs, default=str))
+            request["state_growth"].append(
+                {
+                    "node": node,
+                    "plan_output_entries": request["_plan_output_entries"],
+                    "plan_output_kb": round(request["_plan_output_bytes"] / 1024, 2),
+                    "store_items": request["_store_items"],
+                    "store_kb": round(request["_store_bytes"] / 1024, 2),
+                }
+            )
+
+    def end_request(self, failed: bool = False) -> dict:
+        """
+        Finishes measuring the current request.
+
+        Args:
+            failed (bool): Whether the request raised instead of completing.
+
+        Returns:
+            dict: The measurements of the request.
+        """
+        request = self._request
+        self._request = None
+        _, traced_peak = tracemalloc.get_traced_memory()
+        report = {k: v for k, v in request.items() if not k.startswith("_")}
+        report["seconds"] = round(time.perf_counter() - request["_start"], 3)
+        report["peak_rss_mb"] = round(peak_rss_bytes() / MB, 2)
+        report["rss_end_mb"] = round(current_rss_bytes() / MB, 2)
+        report["tracemalloc_peak_mb"] = round(traced_peak / MB, 2)
+        report["failed"] = failed
+        self.requests.append(report)
+        return report
+
+    def report(self) -> dict:
+        """
+        Returns the full memory report.
+        """
+        return {
+            "pid": os.getpid(),
+            "rss_mb": round(current_rss_bytes() / MB, 2),
+            "backends": self.backends,
+            "requests": self.requests,
+        }
+
+    def write_report(self, path: str) -> None:
+        """
+        Writes the full memory report as JSON.
+
+        Args:
+            path (str): The output path.
+        """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def stub_responder(payload: dict) -> Any:
+    """
+    Answers the agent's OpenAI requests with a fixed plan that exercises every kind of node.
+
+    Args:
+        payload (dict): The chat completions request body.
+
+    Returns:
+        Any: The text or structured response.
+    """
+    from image_agent.prompts.PlanStructure import Plan
+
+    response_format = payload.get("response_format") or {}
+    schema_name = response_format.get("json_schema", {}).get("name")
+    tools = payload.get("tools") or [{}]
+    tool_name = tools[0].get("function", {}).get("name")
+    if Plan.__name__ in (schema_name, tool_name):
+        steps = [
+            ("special_vision", "general object detection", None),
+            ("special_vision", "OCR", None),
+            ("general_vision", "conversation", "Describe the image"),
+        ]
+        return {
+            "plan": [
+                {"tool_name": name, "tool_mode": mode, "tool_input": text}
+                for name, mode, text in steps
+            ]
+        }
+    if schema_name or payload.get("tools"):
+        return {"final_answer": 1, "assessment": "The outputs answer the question."}
+    return "Detect all objects, read any text, then describe the image."
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profile the memory use of the image agent.")
+    parser.add_argument("--backend", choices=["stub", "real"], default="stub")
+    parser.add_argument("--vision-mode", default="gpt")
+    parser.add_argument("--image", default=None)
+    parser.add_argument("--query", default="What objects are in this image and what does the text say?")
+    parser.add_argument("--requests", type=int, default=1)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    from PIL import Image
+    from image_agent.agent.Agent import Agent
+
+    image = (
+        Image.open(args.image).convert("RGB")
+        if args.image
+        else Image.effect_noise((768, 512), 64).convert("RGB")
+    )
+    profiler = MemoryProfiler(top_allocators=args.top)
+
+    if args.backend == "stub":
+        from image_agent.models.StubServer import StubChatCompletionsServer
+        from image_agent.models.Stub import StubFlorenceCaller
+
+        with StubChatCompletionsServer(responder=stub_responder) as server:
+            agent = Agent(
+                openai_api_key="stub",
+                vision_mode="gpt",
+                openai_base_url=server.base_url,
+                backends={"special_vision": StubFlorenceCaller()},
+                profiler=profiler,
+            )
+            for _ in range(args.requests):
+                agent.invoke(args.query, image)
+    else:
+        from image_agent.utils import load_secrets
+
+        agent = Agent(
+            openai_api_key=load_secrets()["OPENAI_API_KEY"],
+            vision_mode=args.vision_mode,
+            profiler=profiler,
+        )
+        for _ in range(args.requests):
+            agent.invoke(args.query, image)
+
+    if args.output:
+        profiler.write_report(args.output)
+    else:
+        print(json.dumps(profiler.report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
 from pydantic import BaseModel, Field
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Literal, Optional, List, get_args
+
+ToolName = Literal["special_vision", "general_vision"]
+ToolMode = Literal[
+    "general object detection",
+    "specific object detection",
+    "image captioning",
+    "OCR",
+    "conversation",
+]
+TOOL_NAMES = list(get_args(ToolName))
+TOOL_MODES = list(get_args(ToolMode))
 
 
 class PlanComponent(BaseModel):
     """Information about one stage of the plan"""
 
-    tool_name: str = Field(
+    # the literals are validated by pydantic and appear as enums in the JSON schema, where they
+    # also constrain structured decoding
+    tool_name: ToolName = Field(
         description="The name of the tool to be called. Must be either special_vision or general_vision"
     )
-    tool_mode: str = Field(
+    tool_mode: ToolMode = Field(
         description="The mode inwhich to call the tool. Must be chosen from the list given in the prompt"
     )
     tool_input: Optional[str] = Field(description="The input text for the tool")
@@ -18,7 +31,7 @@ class PlanComponent(BaseModel):
 class Plan(BaseModel):
     """The entire plan as a list of steps"""
 
-    plan: List[PlanComponent] = Field(description="The plan")
+    plan: List[PlanComponent] = Field(description="The plan", min_length=1, max_length=5)
 
 
 @dataclass
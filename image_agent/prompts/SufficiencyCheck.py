@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field
+from dataclasses import dataclass
+
+
+class SufficiencyCheck(BaseModel):
+    """Whether the outputs so far already answer the question"""
+
+    sufficient: int = Field(
+        description="1 if the outputs so far fully answer the question, 0 if more steps are needed"
+    )
+    reason: str = Field(description="A one sentence explanation of your decision")
+
+
+@dataclass
+class SufficiencyCheckPrompt:
+    system_template: str = """
+    You are a helpful assistant who decides whether an agent can stop executing its plan early.
+    You will be provided with the user's question, the agent's plan and the outputs of the steps that have run so far.
+    The remaining steps of the plan are expensive, so they should be skipped if they are not needed.
+
+    Answer 1 only if the outputs so far contain everything needed to fully answer every part of the question.
+    If any part of the question is not yet answered, or the outputs are empty or contradictory, answer 0.
+
+    Your output should contain two things:
+    1. A binary indicator, 1 if the outputs so far are sufficient, 0 if not
+    2. A one sentence explanation for your decision
+    """
@@ -1,6 +1,8 @@
 from typing import Dict
 from dotenv import load_dotenv
+import hashlib
 import os
+import re
 
 
 def load_secrets(env_path: str = ".env") -> Dict[str, str]:
@@ -21,3 +23,48 @@ def load_secrets(env_path: str = ".env") -> Dict[str, str]:
     load_dotenv(dotenv_path=env_path)
 
     return {"OPENAI_API_KEY": os.getenv("OPENAI_API_KEY")}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so that trivially different phrasings of the same question compare equal.
+
+    Case, surrounding and repeated whitespace and trailing punctuation are ignored.
+
+    Args:
+        query (str): The query to normalize.
+
+    Returns:
+        str: The normalized query.
+    """
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+
+def hash_query(query: str) -> str:
+    """
+    Hash a query after normalizing it.
+
+    Args:
+        query (str): The query to hash.
+
+    Returns:
+        str: The hex digest of the normalized query.
+    """
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+def is_partial_result(results: list) -> bool:
+    """
+    Whether an agent run ended early, cut short by its deadline or its budget.
+
+    Args:
+        results (list): The updates streamed by the agent graph.
+
+    Returns:
+        bool: True if any update set the `timed_out` or `over_budget` flag.
+    """
+    return any(
+        isinstance(output, dict) and (output.get("timed_out") or output.get("over_budget"))
+        for update in results
+        for output in update.values()
+    )